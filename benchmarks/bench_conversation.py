@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 13:40
+@Author  : Joshua Magady
+@File    : bench_conversation.py
+@Desc    : Memory and throughput benchmark of Conversation against list-of-dict contexts,
+           for independent histories and for branches of a shared history.
+
+Usage:
+
+    OPENAI_API_KEY=... PYTHONPATH=src python benchmarks/bench_conversation.py --turns 10
+"""
+import argparse
+import time
+import tracemalloc
+
+from metacogitor.utils.conversation import Conversation
+
+SYSTEM_PROMPT = "You are a helpful assistant."
+
+
+def build_dicts(num_conversations: int, turns: int) -> list:
+    """Build histories the way ask_batch does, as lists of message dicts."""
+
+    conversations = []
+    for i in range(num_conversations):
+        context = [{"role": "system", "content": SYSTEM_PROMPT}]
+        for j in range(turns):
+            context.append({"role": "user", "content": f"question {i} {j}"})
+            context.append({"role": "assistant", "content": f"answer {i} {j}"})
+        conversations.append(context)
+    return conversations
+
+
+def build_conversations(num_conversations: int, turns: int) -> list:
+    """Build the same histories as compact conversations."""
+
+    conversations = []
+    for i in range(num_conversations):
+        conversation = Conversation([SYSTEM_PROMPT])
+        for j in range(turns):
+            conversation.add_user(f"question {i} {j}")
+            conversation.add_assistant(f"answer {i} {j}")
+        conversations.append(conversation)
+    return conversations
+
+
+def branch_dicts(num_branches: int, turns: int) -> list:
+    """Branch a shared history by copying the list of message dicts."""
+
+    root = build_dicts(1, turns)[0]
+    branches = []
+    for i in range(num_branches):
+        branch = list(root)
+        branch.append({"role": "user", "content": f"branch {i}"})
+        branches.append(branch)
+    return branches
+
+
+def branch_conversations(num_branches: int, turns: int) -> list:
+    """Branch a shared history by forking the conversation."""
+
+    root = build_conversations(1, turns)[0]
+    branches = []
+    for i in range(num_branches):
+        branch = root.fork()
+        branch.add_user(f"branch {i}")
+        branches.append(branch)
+    return branches
+
+
+def measure(build, num_conversations: int, turns: int) -> tuple[float, int, list]:
+    """Get the build time in seconds, retained bytes and histories of a builder."""
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    conversations = build(num_conversations, turns)
+    elapsed = time.perf_counter() - start
+    retained, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, retained, conversations
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--conversations", type=int, default=2000)
+    parser.add_argument("--turns", type=int, default=10)
+    args = parser.parse_args(argv)
+
+    messages = args.conversations * (1 + 2 * args.turns)
+    print(f"{args.conversations} conversations, {messages} messages")
+    print(
+        f"{'store':<14}{'build s':>10}{'msgs/s':>12}{'MiB':>10}{'B/msg':>8}{'send s':>10}"
+    )
+    for name, build, send in (
+        ("list[dict]", build_dicts, list),
+        ("Conversation", build_conversations, Conversation.to_dicts),
+    ):
+        elapsed, retained, conversations = measure(
+            build, args.conversations, args.turns
+        )
+        start = time.perf_counter()
+        for conversation in conversations:
+            send(conversation)
+        send_elapsed = time.perf_counter() - start
+        print(
+            f"{name:<14}{elapsed:>10.3f}{messages / elapsed:>12.0f}"
+            f"{retained / 2**20:>10.1f}{retained / messages:>8.0f}{send_elapsed:>10.3f}"
+        )
+
+    print(f"\n{args.conversations} branches of a {args.turns * 10}-turn history")
+    print(f"{'store':<14}{'branch s':>10}{'MiB':>10}")
+    for name, branch in (
+        ("list[dict]", branch_dicts),
+        ("Conversation", branch_conversations),
+    ):
+        elapsed, retained, _ = measure(branch, args.conversations, args.turns * 10)
+        print(f"{name:<14}{elapsed:>10.3f}{retained / 2**20:>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 15:55
+@Author  : Joshua Magady
+@File    : bench_provider.py
+@Desc    : Offline throughput and tail latency benchmark of BaseGPTAPI against the fake provider.
+
+Usage:
+
+    OPENAI_API_KEY=... PYTHONPATH=src python benchmarks/bench_provider.py --requests 500 --hedge
+"""
+import argparse
+import asyncio
+import time
+
+from metacogitor.providers import FakeGPTAPI, LatencyDistribution
+from metacogitor.utils import Hedger, RetryEngine, RetryPolicy
+
+
+def percentile(values: list[float], p: float) -> float:
+    """Get the p-th percentile of the values."""
+
+    values = sorted(values)
+    return values[min(len(values) - 1, int(p / 100 * len(values)))]
+
+
+async def run(api: FakeGPTAPI, num_requests: int, concurrency: int) -> list[float]:
+    """Ask independent questions and get the latency of each."""
+
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def ask(i: int):
+        async with semaphore:
+            start = time.perf_counter()
+            await api.aask(f"question {i}")
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*[ask(i) for i in range(num_requests)])
+    return latencies
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--ttft", type=float, default=0.05)
+    parser.add_argument("--ttft-sigma", type=float, default=0.05)
+    parser.add_argument("--tokens-per-second", type=float, default=500.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--hedge", action="store_true")
+    args = parser.parse_args(argv)
+
+    api = FakeGPTAPI(
+        time_to_first_token=LatencyDistribution(
+            "lognormal", mean=args.ttft, sigma=args.ttft_sigma
+        ),
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        retry_after=0,
+        update_costs=False,
+    )
+    if args.error_rate:
+        api.retry_engine = RetryEngine(RetryPolicy(max_attempts=10, base_delay=0.01))
+    if args.hedge:
+        api.hedger = Hedger(percentile=95, budget=0.05)
+
+    start = time.perf_counter()
+    latencies = asyncio.run(run(api, args.requests, args.concurrency))
+    elapsed = time.perf_counter() - start
+
+    print(
+        f"{args.requests} requests in {elapsed:.2f}s: {args.requests / elapsed:.1f} req/s"
+    )
+    for p in (50, 90, 99):
+        print(f"p{p}: {percentile(latencies, p) * 1000:.1f} ms")
+    if api.hedger:
+        print(f"hedging: {api.hedger.stats()}")
+    if api.retry_engine:
+        print(f"retries: {api.retry_engine.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,465 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 17:40
+@Author  : Joshua Magady
+@File    : batch_runner.py
+@Desc    : This defines the resumable JSONL batch job runner.
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from pathlib import Path
+from typing import Any, Callable, Iterator, NamedTuple, Optional, Union
+
+from metacogitor.logs import logger
+from metacogitor.providers.base_gpt_api import BaseGPTAPI
+from metacogitor.utils.cost_manager import CostManager
+from metacogitor.utils.rate_limiter import RateLimiter
+
+__ALL__ = ["BatchItem", "BatchProgress", "BatchRunner", "main"]
+
+
+class BatchItem(NamedTuple):
+    """One prompt of a batch job.
+
+    Attributes:
+        id (Any): Identifier of the item, copied to its result.
+        prompt (str): Question to ask, when messages are not given.
+        messages (list[dict]): Messages to send instead of the prompt.
+        system_msgs (list[str]): System messages sent with the prompt.
+    """
+
+    id: Any
+    """Identifier of the item, copied to its result."""
+
+    prompt: Optional[str]
+    """Question to ask, when messages are not given."""
+
+    messages: Optional[list[dict]]
+    """Messages to send instead of the prompt."""
+
+    system_msgs: Optional[list[str]]
+    """System messages sent with the prompt."""
+
+
+class BatchProgress(NamedTuple):
+    """Progress of a batch job.
+
+    Attributes:
+        total (int): Number of items of the input.
+        skipped (int): Number of items completed by an earlier run.
+        completed (int): Number of items completed by this run.
+        failed (int): Number of items that failed in this run.
+        elapsed (float): Seconds since the run started.
+        throughput (float): Items completed per second by this run.
+        cost (float): Cost incurred by this run, from the cost manager.
+        eta (float): Estimated seconds until the job is done, or None before the first completion.
+    """
+
+    total: int
+    """Number of items of the input."""
+
+    skipped: int
+    """Number of items completed by an earlier run."""
+
+    completed: int
+    """Number of items completed by this run."""
+
+    failed: int
+    """Number of items that failed in this run."""
+
+    elapsed: float
+    """Seconds since the run started."""
+
+    throughput: float
+    """Items completed per second by this run."""
+
+    cost: float
+    """Cost incurred by this run, from the cost manager."""
+
+    eta: Optional[float]
+    """Estimated seconds until the job is done, or None before the first completion."""
+
+    def __str__(self) -> str:
+        done = self.skipped + self.completed
+        eta = "?" if self.eta is None else f"{self.eta:.0f}s"
+        return (
+            f"{done}/{self.total} done ({self.failed} failed), "
+            f"{self.throughput:.2f} items/s, cost ${self.cost:.3f}, ETA {eta}"
+        )
+
+
+def read_items(path: Union[str, Path]) -> Iterator[BatchItem]:
+    """Stream the items of an input JSONL file.
+
+    Each line is an object with a "prompt" (and optional "system_msgs") or
+    "messages", and an optional "id". Items without an id are identified by
+    their line number. Blank lines are ignored.
+
+    Args:
+        path (Union[str, Path]): Path of the input file.
+
+    Yields:
+        BatchItem: The items, in file order.
+
+    Raises:
+        ValueError: If a line is not a valid item.
+    """
+
+    with open(path, "r", encoding="utf-8") as file:
+        for number, line in enumerate(file, 1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            if not isinstance(record, dict) or (
+                "prompt" not in record and "messages" not in record
+            ):
+                raise ValueError(
+                    f"{path}:{number}: expected an object with a prompt or messages"
+                )
+            yield BatchItem(
+                record.get("id", number),
+                record.get("prompt"),
+                record.get("messages"),
+                record.get("system_msgs"),
+            )
+
+
+def repair_output(path: Union[str, Path]) -> int:
+    """Truncate a trailing partial line cut short by a crash from an output file.
+
+    Only the bytes after the last newline are removed, so the next run
+    appends after the last complete line. Earlier lines are left untouched.
+
+    Args:
+        path (Union[str, Path]): Path of the output file.
+
+    Returns:
+        int: Number of bytes removed.
+    """
+
+    if not os.path.exists(path):
+        return 0
+    with open(path, "rb+") as file:
+        size = file.seek(0, os.SEEK_END)
+        end = size
+        while end > 0:
+            start = max(0, end - 4096)
+            file.seek(start)
+            newline = file.read(end - start).rfind(b"\n")
+            if newline >= 0:
+                end = start + newline + 1
+                break
+            end = start
+        if end < size:
+            logger.warning(f"Truncating partial result at {path}:{end}")
+            file.truncate(end)
+    return size - end
+
+
+def load_completed(path: Union[str, Path]) -> set:
+    """Load the ids of the items completed by earlier runs from an output file.
+
+    The output file is the checkpoint of a job; it is only read. Invalid
+    lines are skipped with a warning, and a trailing partial line does not
+    count as completed (see repair_output).
+
+    Args:
+        path (Union[str, Path]): Path of the output file.
+
+    Returns:
+        set: Keys of the ids of the completed items.
+    """
+
+    completed = set()
+    if not os.path.exists(path):
+        return completed
+    with open(path, "rb") as file:
+        for number, line in enumerate(file, 1):
+            if not line.endswith(b"\n"):
+                break
+            if not line.strip():
+                continue
+            try:
+                completed.add(_id_key(json.loads(line)["id"]))
+            except (ValueError, KeyError, TypeError):
+                logger.warning(f"Skipping invalid result at {path}:{number}")
+    return completed
+
+
+def _id_key(item_id: Any) -> str:
+    """Get the hashable key of an item id (Private Method).
+
+    Args:
+        item_id (Any): Id of an item, any JSON value.
+
+    Returns:
+        str: The key.
+    """
+
+    return json.dumps(item_id, sort_keys=True)
+
+
+class BatchRunner:
+    """Run the prompts of a JSONL file through a provider, resumably.
+
+    Items are streamed from the input and asked with bounded concurrency and
+    an optional rate limit, so memory stays constant with the size of the
+    input. Results are appended to the output JSONL as they complete and
+    flushed, so the output doubles as the checkpoint: a crashed or interrupted
+    job run again with the same output skips the completed items. Failed
+    items are logged to the errors file and retried by the next run.
+    Progress (throughput, cost so far and ETA) is logged periodically.
+
+    Usage:
+
+        runner = BatchRunner(api, concurrency=16, rpm=600)
+        progress = runner.run("prompts.jsonl", "results.jsonl")
+    """
+
+    def __init__(
+        self,
+        api: BaseGPTAPI,
+        concurrency: int = 8,
+        rpm: Optional[int] = None,
+        report_interval: float = 10.0,
+        sync_every: int = 100,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialize the runner.
+
+        Args:
+            api (BaseGPTAPI): The provider.
+            concurrency (int, optional): Maximum items in flight. Defaults to 8.
+            rpm (int, optional): Maximum requests per minute. Defaults to no limit.
+            report_interval (float, optional): Seconds between progress reports. Defaults to 10.
+            sync_every (int, optional): Results written between syncs of the output to disk. Defaults to 100.
+            clock (Callable[[], float], optional): Time source. Defaults to time.monotonic.
+        """
+
+        self.api = api
+        """The provider."""
+
+        self.concurrency = max(1, concurrency)
+        """Maximum items in flight."""
+
+        self.rate_limiter = RateLimiter(rpm) if rpm else None
+        """Rate limiter of the requests, if any."""
+
+        self.report_interval = report_interval
+        """Seconds between progress reports."""
+
+        self.sync_every = sync_every
+        """Results written between syncs of the output to disk."""
+
+        self.clock = clock
+        """Time source."""
+
+        self._total = 0
+        self._skipped = 0
+        self._completed = 0
+        self._failed = 0
+        self._started = clock()
+        self._start_cost = CostManager().get_total_cost()
+
+    def progress(self) -> BatchProgress:
+        """Get the progress of the current run.
+
+        Returns:
+            BatchProgress: Named tuple of counters, throughput, cost and ETA.
+        """
+
+        elapsed = self.clock() - self._started
+        throughput = self._completed / elapsed if elapsed > 0 else 0.0
+        remaining = self._total - self._skipped - self._completed - self._failed
+        eta = remaining / throughput if throughput > 0 else None
+        return BatchProgress(
+            self._total,
+            self._skipped,
+            self._completed,
+            self._failed,
+            elapsed,
+            throughput,
+            CostManager().get_total_cost() - self._start_cost,
+            eta,
+        )
+
+    async def _ask(self, item: BatchItem) -> str:
+        """Ask the provider for the answer of an item (Private Method).
+
+        Args:
+            item (BatchItem): The item.
+
+        Returns:
+            str: The answer.
+        """
+
+        if self.rate_limiter is not None:
+            await asyncio.sleep(self.rate_limiter.reserve(1))
+        if item.messages is not None:
+            return await self.api._acompletion_text(item.messages)
+        return await self.api.aask(item.prompt, item.system_msgs)
+
+    async def arun(
+        self,
+        input_path: Union[str, Path],
+        output_path: Union[str, Path],
+        errors_path: Optional[Union[str, Path]] = None,
+    ) -> BatchProgress:
+        """Run a batch job, resuming from the output of earlier runs.
+
+        Args:
+            input_path (Union[str, Path]): Path of the input JSONL.
+            output_path (Union[str, Path]): Path of the output JSONL, appended with {"id", "response"} objects.
+            errors_path (Union[str, Path], optional): Path of the errors JSONL. Defaults to the output path
+                with an ".errors.jsonl" suffix.
+
+        Returns:
+            BatchProgress: The final progress of the run.
+        """
+
+        errors_path = errors_path or f"{output_path}.errors.jsonl"
+        repair_output(output_path)
+        completed = load_completed(output_path)
+        self._total = sum(1 for _ in read_items(input_path))
+        self._skipped = len(completed)
+        self._completed = self._failed = 0
+        self._started = self.clock()
+        self._start_cost = CostManager().get_total_cost()
+        if completed:
+            logger.info(f"Resuming batch job, {len(completed)} items already done")
+
+        pending = {}
+        items = (
+            item for item in read_items(input_path) if _id_key(item.id) not in completed
+        )
+        with open(output_path, "a", encoding="utf-8") as output, open(
+            errors_path, "a", encoding="utf-8"
+        ) as errors:
+            last_report = self.clock()
+            unsynced = 0
+
+            async def wait_some():
+                nonlocal last_report, unsynced
+                done, _ = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                unsynced += self._write(done, pending, output, errors)
+                if unsynced >= self.sync_every:
+                    os.fsync(output.fileno())
+                    unsynced = 0
+                if self.clock() - last_report >= self.report_interval:
+                    logger.info(f"Batch job progress: {self.progress()}")
+                    last_report = self.clock()
+
+            try:
+                for item in items:
+                    pending[asyncio.ensure_future(self._ask(item))] = item
+                    if len(pending) >= self.concurrency:
+                        await wait_some()
+                while pending:
+                    await wait_some()
+            finally:
+                for task in pending:
+                    task.cancel()
+                if pending:
+                    await asyncio.wait(pending)
+                output.flush()
+                os.fsync(output.fileno())
+
+        progress = self.progress()
+        logger.info(f"Batch job finished: {progress}")
+        return progress
+
+    def _write(self, done: set, pending: dict, output, errors) -> int:
+        """Write the results of finished items and forget them (Private Method).
+
+        Args:
+            done (set): Finished tasks.
+            pending (dict): Tasks in flight, mapped to their item.
+            output: Output file.
+            errors: Errors file.
+
+        Returns:
+            int: Number of results written to the output.
+        """
+
+        written = 0
+        for task in done:
+            item = pending.pop(task)
+            error = task.exception()
+            if error is None:
+                record = {"id": item.id, "response": task.result()}
+                output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._completed += 1
+                written += 1
+            else:
+                logger.warning(f"Batch item {item.id!r} failed: {error!r}")
+                record = {"id": item.id, "error": repr(error)}
+                errors.write(json.dumps(record, ensure_ascii=False) + "\n")
+                self._failed += 1
+        output.flush()
+        errors.flush()
+        return written
+
+    def run(
+        self,
+        input_path: Union[str, Path],
+        output_path: Union[str, Path],
+        errors_path: Optional[Union[str, Path]] = None,
+    ) -> BatchProgress:
+        """Run a batch job in a new event loop, resuming from the output of earlier runs.
+
+        Args:
+            input_path (Union[str, Path]): Path of the input JSONL.
+            output_path (Union[str, Path]): Path of the output JSONL.
+            errors_path (Union[str, Path], optional): Path of the errors JSONL.
+
+        Returns:
+            BatchProgress: The final progress of the run.
+        """
+
+        return asyncio.run(self.arun(input_path, output_path, errors_path))
+
+
+def main(argv: Optional[list[str]] = None):
+    """Run a batch job from the command line."""
+
+    parser = argparse.ArgumentParser(
+        description="Run the prompts of a JSONL file through a GPT API, resumably"
+    )
+    parser.add_argument("input", help="input JSONL of prompts")
+    parser.add_argument("output", help="output JSONL of results, also the checkpoint")
+    parser.add_argument("--errors", help="errors JSONL (default: OUTPUT.errors.jsonl)")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=int, default=None)
+    parser.add_argument("--model", default=None)
+    parser.add_argument("--report-interval", type=float, default=10.0)
+    parser.add_argument(
+        "--fake", action="store_true", help="use the deterministic fake provider"
+    )
+    args = parser.parse_args(argv)
+
+    if args.fake:
+        from metacogitor.providers.fake_provider import FakeGPTAPI
+
+        api = FakeGPTAPI() if args.model is None else FakeGPTAPI(model=args.model)
+    else:
+        from metacogitor.providers.openai_api import OpenAIGPTAPI
+
+        api = OpenAIGPTAPI(model=args.model)
+    runner = BatchRunner(
+        api,
+        concurrency=args.concurrency,
+        rpm=args.rpm,
+        report_interval=args.report_interval,
+    )
+    progress = runner.run(args.input, args.output, args.errors)
+    print(progress)
+
+
+if __name__ == "__main__":
+    main()
@@ -15,7 +15,7 @@ from metacogitor.const import PROJECT_ROOT
 from metacogitor.logs import logger
 from metacogitor.tools import SearchEngineType, WebBrowserEngineType
 from metacogitor.utils.singleton import Singleton
-from metacogitor.errors import NotConfiguredException
+from metacogitor.exceptions import NotConfiguredException
 
 
 class Config(metaclass=Singleton):
@@ -62,18 +62,22 @@ class Config(metaclass=Singleton):
                 "Set OPENAI_API_KEY or Anthropic_API_KEY first"
             )
         self.openai_api_base = self._get("OPENAI_API_BASE")
+        self.openai_proxy = self._get("OPENAI_PROXY") or self.global_proxy
         if not self.openai_api_base or "YOUR_API_BASE" == self.openai_api_base:
-            openai_proxy = self._get("OPENAI_PROXY") or self.global_proxy
-            if openai_proxy:
-                openai.proxy = openai_proxy
+            if self.openai_proxy:
+                openai.proxy = self.openai_proxy
             else:
                 logger.info("Set OPENAI_API_BASE in case of network issues")
         self.openai_api_type = self._get("OPENAI_API_TYPE")
         self.openai_api_version = self._get("OPENAI_API_VERSION")
         self.openai_api_rpm = self._get("RPM", 3)
+        self.openai_api_tpm = self._get("TPM")
+        self.rate_limit_store = self._get("RATE_LIMIT_STORE")
         self.openai_api_model = self._get("OPENAI_API_MODEL", "gpt-4")
         self.max_tokens_rsp = self._get("MAX_TOKENS", 2048)
         self.deployment_id = self._get("DEPLOYMENT_ID")
+        self.openai_api_timeout = float(self._get("OPENAI_API_TIMEOUT", 60))
+        self.openai_max_connections = int(self._get("OPENAI_MAX_CONNECTIONS", 100))
 
         self.claude_api_key = self._get("Anthropic_API_KEY")
         self.serpapi_api_key = self._get("SERPAPI_API_KEY")
@@ -93,7 +97,6 @@ class Config(metaclass=Singleton):
         if self.long_term_memory:
             logger.warning("LONG_TERM_MEMORY is True")
         self.max_budget = self._get("MAX_BUDGET", 10.0)
-        self.total_cost = 0.0
 
         self.puppeteer_config = self._get("PUPPETEER_CONFIG", "")
         self.mmdc = self._get("MMDC", "mmdc")
@@ -101,6 +104,20 @@ class Config(metaclass=Singleton):
         self.model_for_researcher_summary = self._get("MODEL_FOR_RESEARCHER_SUMMARY")
         self.model_for_researcher_report = self._get("MODEL_FOR_RESEARCHER_REPORT")
 
+    @property
+    def total_cost(self) -> float:
+        """Total cost accrued so far (Deprecated).
+
+        Kept for compatibility, use CostManager().get_total_cost() instead.
+
+        Returns:
+            float: The total cost.
+        """
+
+        from metacogitor.utils.cost_manager import CostManager
+
+        return CostManager().get_total_cost()
+
     def _init_with_config_files_and_env(self, configs, yaml_file):
         """Load config from YAML files and environment variables. (Private Method)
 
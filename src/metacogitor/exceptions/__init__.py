@@ -1,3 +1,5 @@
 from metacogitor.exceptions.base_exception import *
 from metacogitor.exceptions.not_configured_exception import *
 from metacogitor.exceptions.error_details import *
+from metacogitor.exceptions.context_overflow_exception import *
+from metacogitor.exceptions.provider_exception import *
@@ -0,0 +1,30 @@
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 10:12
+@Author  : Joshua Magady
+@File    : context_overflow_exception.py
+@Desc    : This defines the ContextOverflowException Class.
+"""
+
+from pydantic import ValidationError
+from metacogitor.exceptions.error_details import ErrorDetails
+from metacogitor.exceptions.base_exception import BaseError
+
+__ALL__ = ["ContextOverflowException"]
+
+
+class ContextOverflowException(BaseError):
+    """Exception for conversations that cannot fit in the model's context window.
+
+    Attributes:
+        message (str): Explanation of the error.
+    """
+
+    def __init__(self, **kwargs):
+        """Initialize the exception."""
+        try:
+            self.error = ErrorDetails(**kwargs)
+        except ValidationError as e:
+            raise ValueError("Invalid error details") from e
+
+        super().__init__(self.error)
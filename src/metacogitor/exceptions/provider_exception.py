@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 14:05
+@Author  : Joshua Magady
+@File    : provider_exception.py
+@Desc    : This defines the ProviderException and CircuitOpenException Classes.
+"""
+from typing import Optional
+
+from pydantic import ValidationError
+from metacogitor.exceptions.error_details import ErrorDetails
+from metacogitor.exceptions.base_exception import BaseError
+
+__ALL__ = ["ProviderException", "CircuitOpenException"]
+
+
+class ProviderException(BaseError):
+    """Exception for failed provider calls.
+
+    The error code is the HTTP status of the provider response.
+
+    Attributes:
+        message (str): Explanation of the error.
+        retry_after (float): Seconds the provider asked to wait before retrying, if any.
+        endpoint (str): Endpoint of the failed call, if known.
+    """
+
+    def __init__(
+        self,
+        retry_after: Optional[float] = None,
+        endpoint: Optional[str] = None,
+        **kwargs,
+    ):
+        """Initialize the exception."""
+        try:
+            self.error = ErrorDetails(**kwargs)
+        except ValidationError as e:
+            raise ValueError("Invalid error details") from e
+
+        self.retry_after = retry_after
+        self.endpoint = endpoint
+        super().__init__(self.error)
+
+    @property
+    def status(self) -> int:
+        """Get the HTTP status of the provider response."""
+
+        return self.error.code
+
+
+class CircuitOpenException(BaseError):
+    """Exception for calls rejected because the circuit of their endpoint is open.
+
+    Attributes:
+        message (str): Explanation of the error.
+        retry_after (float): Seconds until the circuit lets a probe call through.
+        endpoint (str): Endpoint whose circuit is open.
+    """
+
+    def __init__(
+        self,
+        retry_after: Optional[float] = None,
+        endpoint: Optional[str] = None,
+        **kwargs,
+    ):
+        """Initialize the exception."""
+        try:
+            self.error = ErrorDetails(**kwargs)
+        except ValidationError as e:
+            raise ValueError("Invalid error details") from e
+
+        self.retry_after = retry_after
+        self.endpoint = endpoint
+        super().__init__(self.error)
@@ -1,2 +1,5 @@
 from metacogitor.providers.base_chatbot import *
 from metacogitor.providers.base_gpt_api import *
+from metacogitor.providers.fake_provider import *
+from metacogitor.providers.openai_api import *
+from metacogitor.providers.provider_pool import *
@@ -6,14 +6,97 @@
 @File    : base_gpt_api.py
 @Desc    : This is the base class for all GPT API providers
 """
+import asyncio
+import contextvars
+import threading
+import time
 from abc import abstractmethod
-from typing import Optional
+from concurrent import futures
+from contextlib import aclosing
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Iterator,
+    NamedTuple,
+    Optional,
+    Union,
+)
 
 from metacogitor.logs import logger
 from metacogitor.providers import BaseChatbot
+from metacogitor.utils.rate_limiter import RateLimiter, TokenBucketLimiter
+from metacogitor.utils.async_map import amap_as_completed
+from metacogitor.utils.conversation import Conversation
+from metacogitor.utils.code_extractor import CodeBlockExtractor, extract_code
+from metacogitor.utils.response_cache import BaseResponseCache, make_cache_key
+from metacogitor.utils.single_flight import SingleFlight
+from metacogitor.utils.retry import RetryEngine
+from metacogitor.utils.hedging import Hedger
+from metacogitor.utils.cost_manager import CostManager
+from metacogitor.utils.context_fitter import fit_messages
+from metacogitor.utils.token_counter import (
+    TOKEN_COSTS,
+    TOKEN_MAX,
+    TokenLedger,
+    count_message_tokens,
+    get_encoding,
+)
+from metacogitor.config import CONFIG
 
 
-__ALL__ = ["BaseGPTAPI"]
+__ALL__ = ["StreamStats", "CodeStats", "BaseGPTAPI"]
+
+
+class StreamStats(NamedTuple):
+    """Timing of one streamed completion.
+
+    Attributes:
+        time_to_first_token (float): Seconds until the first delta was received, or None if there was none.
+        duration (float): Seconds until the stream ended.
+        completion_tokens (int): Number of tokens streamed.
+        tokens_per_second (float): Generation rate after the first delta.
+    """
+
+    time_to_first_token: Optional[float]
+    """Seconds until the first delta was received, or None if there was none."""
+
+    duration: float
+    """Seconds until the stream ended."""
+
+    completion_tokens: int
+    """Number of tokens streamed."""
+
+    tokens_per_second: float
+    """Generation rate after the first delta."""
+
+
+class CodeStats(NamedTuple):
+    """Outcome of one early-terminated code answer.
+
+    Attributes:
+        completion_tokens (int): Number of tokens streamed before the stream stopped.
+        code_tokens (int): Number of tokens of the extracted code.
+        stopped_early (bool): True if the stream was cancelled once the code block closed.
+        tokens_saved (int): Tokens of the response budget left ungenerated by cancelling the stream.
+    """
+
+    completion_tokens: int
+    """Number of tokens streamed before the stream stopped."""
+
+    code_tokens: int
+    """Number of tokens of the extracted code."""
+
+    stopped_early: bool
+    """True if the stream was cancelled once the code block closed."""
+
+    tokens_saved: int
+    """Tokens of the response budget left ungenerated by cancelling the stream.
+
+    The model may have ended sooner on its own, so this bounds the saving from above.
+    """
 
 
 class BaseGPTAPI(BaseChatbot):
@@ -24,6 +107,45 @@ class BaseGPTAPI(BaseChatbot):
 
     system_prompt = "You are a helpful assistant."
 
+    model = "gpt-3.5-turbo-0613"
+    """AI model used for token accounting of conversations."""
+
+    fit_context = False
+    """Trim the conversation history to the model's context window before each request."""
+
+    max_concurrency = 8
+    """Default number of concurrent requests for fan-out APIs such as aask_many and ask_many."""
+
+    rate_limiter: Optional[RateLimiter] = None
+    """Default rate limiter applied by fan-out APIs such as aask_many and ask_many."""
+
+    token_limiter: Optional[TokenBucketLimiter] = None
+    """Limiter admitting every provider call by requests and estimated prompt tokens per minute."""
+
+    response_cache: Optional[BaseResponseCache] = None
+    """Cache consulted before sending a request to the provider."""
+
+    coalesce_requests = False
+    """Share one in-flight request between concurrent identical asynchronous requests."""
+
+    _single_flight: Optional[SingleFlight] = None
+
+    retry_engine: Optional[RetryEngine] = None
+    """Retry engine wrapping provider calls with backoff and a per-endpoint circuit breaker."""
+
+    hedger: Optional[Hedger] = None
+    """Hedger duplicating asynchronous provider calls slower than a percentile of recent latency."""
+
+    _executor: Optional[futures.ThreadPoolExecutor] = None
+
+    _executor_lock = threading.Lock()
+
+    last_stream_stats: Optional[StreamStats] = None
+    """Timing of the most recent streamed completion."""
+
+    last_code_stats: Optional[CodeStats] = None
+    """Outcome of the most recent code answer of aask_code."""
+
     def _user_msg(self, msg: str) -> dict[str, str]:
         """
         Create a user message dictionary.
@@ -60,6 +182,28 @@ class BaseGPTAPI(BaseChatbot):
         """
         return [self._system_msg(msg) for msg in msgs]
 
+    def _new_context(self, messages: Optional[list[dict]] = None) -> TokenLedger:
+        """
+        Create a conversation context that keeps running token counts.
+
+        :param messages: Initial messages. Defaults to the default system message.
+        :return: Token ledger holding the conversation messages.
+        """
+        if messages is None:
+            messages = [self._default_system_msg()]
+        return TokenLedger(messages, model=self.model)
+
+    def _fit_context(self, context: list[dict]) -> list[dict]:
+        """
+        Trim the conversation so it fits the model's context window minus the reserved completion tokens.
+
+        :param context: List of conversation context.
+        :return: The messages to send, or the context itself if fitting is disabled.
+        """
+        if not self.fit_context or self.model not in TOKEN_MAX:
+            return context
+        return fit_messages(context, self.model, reserve=CONFIG.max_tokens_rsp)
+
     def _default_system_msg(self):
         """
         Create the default system message.
@@ -68,32 +212,486 @@ class BaseGPTAPI(BaseChatbot):
         """
         return self._system_msg(self.system_prompt)
 
-    def ask(self, msg: str) -> str:
+    def _sampling_params(self) -> dict:
+        """
+        Get the sampling parameters that affect the responses of the provider.
+
+        Providers with configurable sampling (temperature, max tokens, ...) should override this,
+        as the parameters are part of the response cache key.
+
+        :return: Dictionary of sampling parameters.
+        """
+        return {}
+
+    def _cache_key(self, kind: str, messages: list[dict]) -> str:
+        """
+        Build the response cache key of a request.
+
+        :param kind: Kind of response cached, as completion dicts and texts are stored separately.
+        :param messages: List of message dictionaries.
+        :return: Cache key.
+        """
+        return make_cache_key(
+            self.model, messages, kind=kind, **self._sampling_params()
+        )
+
+    def _completion(self, messages: list[dict]) -> dict:
+        """
+        Get a completion, served from the response cache when possible.
+
+        Cache hits never reach the provider, so they do not incur any cost.
+
+        :param messages: List of message dictionaries.
+        :return: Completion response dictionary.
+        """
+
+        def call():
+            return self._limited(messages, lambda: self.completion(messages))
+
+        if self.response_cache is None:
+            return self._retry(call)
+        key = self._cache_key("completion", messages)
+        rsp = self.response_cache.get(key)
+        if rsp is None:
+            rsp = self._retry(call)
+            self.response_cache.set(key, rsp)
+        return rsp
+
+    def _estimate_tokens(self, messages: list[dict]) -> int:
+        """
+        Estimate the prompt tokens of a request, charged to the token limiter at admission.
+
+        :param messages: List of message dictionaries.
+        :return: Number of prompt tokens.
+        """
+        if self.model in TOKEN_COSTS:
+            return count_message_tokens(messages, self.model)
+        return sum(len(m.get("content") or "") for m in messages) // 4
+
+    def _used_tokens(self, prompt_tokens: int, rsp) -> int:
+        """
+        Get the tokens actually used by a request, from the usage of its response or by counting its text.
+
+        :param prompt_tokens: Estimated prompt tokens of the request.
+        :param rsp: Completion response dictionary, or completion text.
+        :return: Number of prompt and completion tokens.
+        """
+        if isinstance(rsp, dict):
+            usage = rsp.get("usage") or {}
+            if "total_tokens" in usage:
+                return usage["total_tokens"]
+            try:
+                rsp = self.get_choice_text(rsp)
+            except (TypeError, KeyError, IndexError):
+                return prompt_tokens
+        if not isinstance(rsp, str):
+            return prompt_tokens
+        encoding = get_encoding(self.model, fallback=True)
+        return prompt_tokens + len(encoding.encode(rsp, disallowed_special=()))
+
+    def _reconcile(self, charged: int, rsp):
+        """
+        Reconcile the charge of a completed request with its actual usage.
+
+        The response was already received, so a limiter failing to update its store (e.g. a network
+        bucket store timing out) is logged rather than raised.
+
+        :param charged: Tokens charged at admission.
+        :param rsp: Completion response dictionary, or completion text.
+        """
+        try:
+            self.token_limiter.reconcile(charged, self._used_tokens(charged, rsp))
+        except Exception as e:
+            logger.warning(f"Failed to reconcile the token limiter: {e!r}")
+
+    async def _areconcile(self, charged: int, rsp):
+        """
+        Asynchronously reconcile the charge of a completed request with its actual usage.
+
+        Limiters whose store blocks (SharedRateLimiter) provide an areconcile coroutine that runs off
+        the event loop. Failures are logged rather than raised.
+
+        :param charged: Tokens charged at admission.
+        :param rsp: Completion response dictionary, or completion text.
+        """
+        areconcile = getattr(self.token_limiter, "areconcile", None)
+        if areconcile is None:
+            self._reconcile(charged, rsp)
+            return
+        try:
+            await areconcile(charged, self._used_tokens(charged, rsp))
+        except Exception as e:
+            logger.warning(f"Failed to reconcile the token limiter: {e!r}")
+
+    def _limited(self, messages: list[dict], func: Callable):
+        """
+        Call the provider once the token limiter admits the request, when enabled.
+
+        The estimated prompt tokens are charged at admission and reconciled with the actual usage
+        afterwards. Failed requests keep their charge, as the prompt was sent. The outcome is reported
+        to the limiter, which an adaptive limiter uses to adjust its rate.
+
+        :param messages: List of message dictionaries.
+        :param func: The provider call.
+        :return: The response.
+        """
+        if self.token_limiter is None:
+            return func()
+        charged = self._estimate_tokens(messages)
+        self.token_limiter.wait_if_needed_sync(1, charged)
+        try:
+            rsp = func()
+        except Exception as e:
+            self.token_limiter.record(e)
+            raise
+        self.token_limiter.record()
+        self._reconcile(charged, rsp)
+        return rsp
+
+    async def _alimited(self, messages: list[dict], func: Callable[[], Awaitable]):
+        """
+        Await a provider call once the token limiter admits the request, when enabled.
+
+        :param messages: List of message dictionaries.
+        :param func: Factory of the provider call.
+        :return: The response.
+        """
+        if self.token_limiter is None:
+            return await func()
+        charged = self._estimate_tokens(messages)
+        await self.token_limiter.wait_if_needed(1, charged)
+        try:
+            rsp = await func()
+        except Exception as e:
+            self.token_limiter.record(e)
+            raise
+        self.token_limiter.record()
+        await self._areconcile(charged, rsp)
+        return rsp
+
+    async def _alimited_stream(self, messages: list[dict]) -> AsyncIterator[str]:
+        """
+        Stream a completion from the provider once the token limiter admits the request.
+
+        The charge is reconciled with the streamed text when the stream ends, including when it is
+        closed early.
+
+        :param messages: List of message dictionaries.
+        :return: Async iterator of text deltas.
+        """
+        charged = self._estimate_tokens(messages)
+        await self.token_limiter.wait_if_needed(1, charged)
+        parts = []
+        try:
+            async with aclosing(self.acompletion_stream(messages)) as deltas:
+                async for delta in deltas:
+                    parts.append(delta)
+                    yield delta
+        except Exception as e:
+            self.token_limiter.record(e)
+            raise
+        else:
+            self.token_limiter.record()
+        finally:
+            await self._areconcile(charged, "".join(parts))
+
+    def _provider_stream(self, messages: list[dict]) -> AsyncIterator[str]:
+        """
+        Start a provider stream, admitted by the token limiter when enabled.
+
+        :param messages: List of message dictionaries.
+        :return: Async iterator of text deltas.
+        """
+        if self.token_limiter is None:
+            return self.acompletion_stream(messages)
+        return self._alimited_stream(messages)
+
+    def _endpoint(self) -> str:
+        """
+        Get the name of the endpoint called by the provider, which selects its circuit breaker.
+
+        Providers talking to several endpoints should override this.
+
+        :return: Endpoint name.
+        """
+        return f"{type(self).__name__}:{self.model}"
+
+    def _retry(self, func: Callable):
+        """
+        Call the provider through the retry engine, when enabled.
+
+        :param func: The provider call.
+        :return: The response.
+        """
+        if self.retry_engine is None:
+            return func()
+        return self.retry_engine.call(func, self._endpoint())
+
+    async def _aretry(self, func: Callable[[], Awaitable]):
+        """
+        Await a provider call through the retry engine, when enabled.
+
+        :param func: Factory of the provider call.
+        :return: The response.
+        """
+        if self.retry_engine is None:
+            return await func()
+        return await self.retry_engine.acall(func, self._endpoint())
+
+    def _record_hedge_loss(self, messages: list[dict]):
+        """
+        Record the cost of a hedged provider call cancelled after losing its race.
+
+        Losers are cancelled before answering (or before their first delta, for streams), so only
+        their prompt tokens are billed.
+
+        :param messages: List of message dictionaries sent.
+        """
+        prompt_tokens = 0
+        if self.model in TOKEN_COSTS:
+            prompt_tokens = count_message_tokens(messages, self.model)
+        CostManager().record_hedge(prompt_tokens, 0, self.model)
+
+    async def _ahedge(self, messages: list[dict], func: Callable[[], Awaitable]):
+        """
+        Await a provider call, hedging it when the hedger is enabled.
+
+        :param messages: List of message dictionaries, used to account for a cancelled loser.
+        :param func: Factory of the provider call.
+        :return: The response of the first call to answer.
+        """
+        if self.hedger is None:
+            return await func()
+        return await self.hedger.run(
+            func, on_cancel=lambda attempt: self._record_hedge_loss(messages)
+        )
+
+    async def _acached(self, key: str, func: Callable[[], Awaitable]):
+        """
+        Await a provider call, served from the response cache when possible.
+
+        :param key: Response cache key of the request.
+        :param func: Factory of the provider call.
+        :return: The response.
+        """
+        if self.response_cache is not None:
+            rsp = self.response_cache.get(key)
+            if rsp is not None:
+                return rsp
+        rsp = await func()
+        if self.response_cache is not None:
+            self.response_cache.set(key, rsp)
+        return rsp
+
+    async def _acall(
+        self, kind: str, messages: list[dict], func: Callable[[], Awaitable]
+    ):
+        """
+        Await a provider call through the response cache, request coalescing and retry engine, when enabled.
+
+        Retries happen inside the coalesced call, so identical waiting requests share them.
+
+        :param kind: Kind of response, see _cache_key.
+        :param messages: List of message dictionaries.
+        :param func: Factory of the provider call.
+        :return: The response.
+        """
+        call = func if self.retry_engine is None else lambda: self._aretry(func)
+        if self.response_cache is None and not self.coalesce_requests:
+            return await call()
+        key = self._cache_key(kind, messages)
+        if not self.coalesce_requests:
+            return await self._acached(key, call)
+        if self._single_flight is None:
+            self._single_flight = SingleFlight()
+        return await self._single_flight.do(key, lambda: self._acached(key, call))
+
+    async def _acompletion(self, messages: list[dict]) -> dict:
+        """
+        Asynchronously get a completion, served from the response cache or an identical in-flight request
+        when possible, and hedged when the hedger is enabled.
+
+        :param messages: List of message dictionaries.
+        :return: Completion response dictionary.
+        """
+        return await self._acall(
+            "completion",
+            messages,
+            lambda: self._ahedge(
+                messages,
+                lambda: self._alimited(messages, lambda: self.acompletion(messages)),
+            ),
+        )
+
+    async def _acompletion_text(self, messages: list[dict], stream=False) -> str:
+        """
+        Asynchronously get a completion text, served from the response cache or an identical in-flight request
+        when possible, and hedged when the hedger is enabled.
+
+        :param messages: List of message dictionaries.
+        :param stream: Stream-print the response when it is sent to the provider.
+        :return: Completion text.
+        """
+        return await self._acall(
+            "text",
+            messages,
+            lambda: self._ahedge(
+                messages,
+                lambda: self._alimited(
+                    messages, lambda: self.acompletion_text(messages, stream=stream)
+                ),
+            ),
+        )
+
+    def ask(self, msg: str, system_msgs: Optional[list[str]] = None) -> str:
         """
         Ask the GPT-based chatbot a question and receive an answer.
 
         :param msg: The input question.
+        :param system_msgs: List of system messages. Defaults to the default system message.
         :return: The generated answer.
         """
-        message = [self._default_system_msg(), self._user_msg(msg)]
-        rsp = self.completion(message)
+        message = self._question_msgs(msg, system_msgs)
+        rsp = self._completion(message)
         logger.debug(message)
         return self.get_choice_text(rsp)
 
-    async def aask(self, msg: str, system_msgs: Optional[list[str]] = None) -> str:
+    def _question_msgs(
+        self, msg: str, system_msgs: Optional[list[str]] = None
+    ) -> list[dict[str, str]]:
         """
-        Asynchronously ask the GPT-based chatbot a question and receive an answer.
+        Create the messages of a single question.
+
+        :param msg: The input question.
+        :param system_msgs: List of system messages. Defaults to the default system message.
+        :return: List of message dictionaries.
+        """
+        if system_msgs:
+            return self._system_msgs(system_msgs) + [self._user_msg(msg)]
+        return [self._default_system_msg(), self._user_msg(msg)]
+
+    def _record_stream_stats(
+        self, start: float, first: Optional[float], end: float, text: str
+    ) -> StreamStats:
+        """
+        Record the timing of a streamed completion.
+
+        :param start: perf_counter value when the request was sent.
+        :param first: perf_counter value when the first delta was received, or None.
+        :param end: perf_counter value when the stream ended.
+        :param text: The streamed text.
+        :return: The recorded stream statistics.
+        """
+        completion_tokens = len(
+            get_encoding(self.model, fallback=True).encode(text, disallowed_special=())
+        )
+        generating = end - first if first is not None else 0
+        stats = StreamStats(
+            first - start if first is not None else None,
+            end - start,
+            completion_tokens,
+            completion_tokens / generating if generating > 0 else 0.0,
+        )
+        self.last_stream_stats = stats
+        logger.debug(f"Stream stats: {stats}")
+        return stats
+
+    async def _astream(
+        self,
+        messages: list[dict],
+        on_stats: Optional[Callable[[StreamStats], None]] = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream the deltas of a completion from the provider, recording its timing.
+
+        When the hedger is enabled, a hedge stream is started if the first delta is late, and the
+        stream producing the first delta wins. last_stream_stats is shared by the concurrent calls of
+        the instance, so callers needing the statistics of their own stream pass on_stats.
+
+        :param messages: List of message dictionaries.
+        :param on_stats: Called with the statistics of this stream when it ends.
+        :return: Async iterator of text deltas.
+        """
+        start = time.perf_counter()
+        first = None
+        parts = []
+        if self.hedger is None:
+            stream = self._provider_stream(messages)
+        else:
+            stream = self.hedger.stream(
+                lambda: self._provider_stream(messages),
+                on_cancel=lambda attempt: self._record_hedge_loss(messages),
+            )
+        try:
+            async with aclosing(stream) as deltas:
+                async for delta in deltas:
+                    if first is None:
+                        first = time.perf_counter()
+                    parts.append(delta)
+                    yield delta
+        finally:
+            stats = self._record_stream_stats(
+                start, first, time.perf_counter(), "".join(parts)
+            )
+            if on_stats is not None:
+                on_stats(stats)
+
+    async def _acollect_stream(self, messages: list[dict]) -> str:
+        """
+        Stream a completion from the provider and return the full text.
+
+        :param messages: List of message dictionaries.
+        :return: Completion text.
+        """
+        async with aclosing(self._astream(messages)) as deltas:
+            return "".join([delta async for delta in deltas])
+
+    async def astream(
+        self, msg: str, system_msgs: Optional[list[str]] = None
+    ) -> AsyncIterator[str]:
+        """
+        Asynchronously ask the GPT-based chatbot a question and stream the answer.
+
+        Deltas are pulled from the provider only as fast as the caller consumes them. The timing of
+        the call is available in last_stream_stats once the stream ends.
 
         :param msg: The input question.
         :param system_msgs: List of system messages.
+        :return: Async iterator of text deltas of the answer.
+        """
+        message = self._question_msgs(msg, system_msgs)
+        logger.debug(message)
+        async with aclosing(self._astream(message)) as deltas:
+            async for delta in deltas:
+                yield delta
+
+    async def aask(
+        self,
+        msg: str,
+        system_msgs: Optional[list[str]] = None,
+        conversation: Optional[Conversation] = None,
+    ) -> str:
+        """
+        Asynchronously ask the GPT-based chatbot a question and receive an answer.
+
+        To explore several continuations of a conversation concurrently, ask each one on its own fork.
+
+        :param msg: The input question.
+        :param system_msgs: List of system messages. Ignored when continuing a conversation.
+        :param conversation: Conversation to continue. The question and answer are appended to it.
         :return: The generated answer.
         """
-        if system_msgs:
-            message = self._system_msgs(system_msgs) + [self._user_msg(msg)]
+        if conversation is None:
+            message = self._question_msgs(msg, system_msgs)
         else:
-            message = [self._default_system_msg(), self._user_msg(msg)]
-        rsp = await self.acompletion_text(message, stream=True)
+            context = self._batch_context(conversation)
+            context.append(self._user_msg(msg))
+            message = self._fit_context(context)
+        rsp = await self._acall("text", message, lambda: self._acollect_stream(message))
         logger.debug(message)
+        if conversation is not None:
+            conversation.add_user(msg)
+            conversation.add_assistant(rsp)
         return rsp
 
     def _extract_assistant_rsp(self, context):
@@ -105,60 +703,334 @@ class BaseGPTAPI(BaseChatbot):
         """
         return "\n".join([i["content"] for i in context if i["role"] == "assistant"])
 
-    def ask_batch(self, msgs: list) -> str:
+    def new_conversation(self, system_msgs: Optional[list[str]] = None) -> Conversation:
+        """
+        Create a compact conversation to continue with aask, ask_batch or aask_batch.
+
+        Conversations with the same system messages share one immutable prefix, and forks of a
+        conversation share its history.
+
+        :param system_msgs: List of system messages. Defaults to the default system prompt.
+        :return: An empty conversation.
+        """
+        return Conversation(system_msgs or [self.system_prompt])
+
+    def _batch_context(self, conversation: Optional[Conversation]) -> TokenLedger:
+        """
+        Create the context of a batch of questions, continuing a conversation when given.
+
+        :param conversation: Conversation to continue, or None to start from the default system message.
+        :return: Token ledger holding the messages to send.
+        """
+        if conversation is None:
+            return self._new_context()
+        return self._new_context(conversation.to_dicts())
+
+    def ask_batch(self, msgs: list, conversation: Optional[Conversation] = None) -> str:
         """
         Ask the GPT-based chatbot multiple questions and receive a series of answers.
 
         :param msgs: A list of input questions.
+        :param conversation: Conversation to continue. The questions and answers are appended to it.
         :return: A series of generated answers as a concatenated string.
         """
-        context = [self._default_system_msg()]
+        context = self._batch_context(conversation)
+        start = len(context)
         for msg in msgs:
             umsg = self._user_msg(msg)
             context.append(umsg)
-            rsp = self.completion(context)
+            rsp = self._completion(self._fit_context(context))
             rsp_text = self.get_choice_text(rsp)
             context.append(self._assistant_msg(rsp_text))
-        return self._extract_assistant_rsp(context)
+            if conversation is not None:
+                conversation.add_user(msg)
+                conversation.add_assistant(rsp_text)
+        return self._extract_assistant_rsp(context[start:])
 
-    async def aask_batch(self, msgs: list) -> str:
+    async def aask_batch(
+        self, msgs: list, conversation: Optional[Conversation] = None
+    ) -> str:
         """
         Asynchronously ask the GPT-based chatbot multiple questions and receive a series of answers.
 
         :param msgs: A list of input questions.
+        :param conversation: Conversation to continue. The questions and answers are appended to it.
         :return: A series of generated answers as a concatenated string.
         """
-        context = []
-        context = [self._default_system_msg()]
+        context = self._batch_context(conversation)
+        start = len(context)
         for msg in msgs:
             umsg = self._user_msg(msg)
             context.append(umsg)
-            rsp_text = await self.acompletion_text(context)
+            rsp_text = await self._acompletion_text(self._fit_context(context))
             context.append(self._assistant_msg(rsp_text))
-        return self._extract_assistant_rsp(context)
+            if conversation is not None:
+                conversation.add_user(msg)
+                conversation.add_assistant(rsp_text)
+        return self._extract_assistant_rsp(context[start:])
+
+    async def aask_many_as_completed(
+        self,
+        msgs: Union[Iterable[str], AsyncIterable[str]],
+        system_msgs: Optional[list[str]] = None,
+        concurrency: Optional[int] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ) -> AsyncIterator[tuple[int, Union[str, Exception]]]:
+        """
+        Asynchronously ask many independent questions, yielding answers as they complete.
+
+        Each question is sent in its own conversation. At most `concurrency` requests are in
+        flight at once, and every request first waits on the rate limiter. A failed question
+        yields its exception instead of interrupting the others. Questions are pulled from `msgs`
+        only when a request slot frees up, so a generator of millions of questions is streamed
+        in constant memory.
+
+        :param msgs: Independent input questions, a list or any (async) iterable.
+        :param system_msgs: List of system messages used for every question.
+        :param concurrency: Maximum number of requests in flight. Defaults to max_concurrency.
+        :param rate_limiter: Rate limiter to wait on before each request. Defaults to rate_limiter.
+        :return: Async iterator of (index of the question, answer or exception) tuples.
+        """
 
-    def ask_code(self, msgs: list[str]) -> str:
+        def ask_one(msg: str) -> Awaitable[str]:
+            return self.aask(msg, system_msgs)
+
+        async with aclosing(
+            amap_as_completed(
+                ask_one,
+                msgs,
+                concurrency or self.max_concurrency,
+                rate_limiter or self.rate_limiter,
+            )
+        ) as completed:
+            async for result in completed:
+                yield result
+
+    async def aask_many(
+        self,
+        msgs: list[str],
+        system_msgs: Optional[list[str]] = None,
+        concurrency: Optional[int] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        return_exceptions: bool = True,
+    ) -> list[Union[str, Exception]]:
+        """
+        Asynchronously ask many independent questions concurrently.
+
+        :param msgs: A list of independent input questions.
+        :param system_msgs: List of system messages used for every question.
+        :param concurrency: Maximum number of requests in flight. Defaults to max_concurrency.
+        :param rate_limiter: Rate limiter to wait on before each request. Defaults to rate_limiter.
+        :param return_exceptions: Return the exception of a failed question in its place instead of raising it.
+        :return: The answers, in the same order as the questions.
+        """
+        results = [None] * len(msgs)
+        async with aclosing(
+            self.aask_many_as_completed(msgs, system_msgs, concurrency, rate_limiter)
+        ) as completed:
+            async for index, result in completed:
+                if isinstance(result, Exception) and not return_exceptions:
+                    raise result
+                results[index] = result
+        return results
+
+    def _get_executor(self) -> futures.ThreadPoolExecutor:
+        """
+        Get the thread pool of the synchronous fan-out APIs, creating it on first use.
+
+        :return: Thread pool with max_concurrency workers.
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = futures.ThreadPoolExecutor(
+                    max_workers=self.max_concurrency,
+                    thread_name_prefix=type(self).__name__,
+                )
+            return self._executor
+
+    def shutdown(self, wait: bool = True):
+        """
+        Shut down the thread pool of the synchronous fan-out APIs.
+
+        Questions not started yet are cancelled. The pool is created again if ask_many is used afterwards.
+
+        :param wait: Wait for the questions in flight to finish.
+        """
+        with self._executor_lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=wait, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.shutdown()
+
+    def ask_many_as_completed(
+        self,
+        msgs: list[str],
+        system_msgs: Optional[list[str]] = None,
+        concurrency: Optional[int] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+    ) -> Iterator[tuple[int, Union[str, Exception]]]:
+        """
+        Ask many independent questions on the thread pool, yielding answers as they complete.
+
+        This is the synchronous counterpart of aask_many_as_completed. At most `concurrency`
+        questions are submitted at once, capped by the max_concurrency workers of the pool, and
+        every request first waits on the rate limiter. A failed question yields its exception
+        instead of interrupting the others. Closing the iterator early cancels the questions
+        not started yet. The questions run in the context of the caller, so its cost_scope applies.
+
+        :param msgs: A list of independent input questions.
+        :param system_msgs: List of system messages used for every question.
+        :param concurrency: Maximum number of requests in flight. Defaults to max_concurrency.
+        :param rate_limiter: Rate limiter to wait on before each request. Defaults to rate_limiter.
+        :return: Iterator of (index of the question, answer or exception) tuples.
+        """
+        executor = self._get_executor()
+        concurrency = concurrency or self.max_concurrency
+        rate_limiter = rate_limiter or self.rate_limiter
+
+        def ask_one(msg: str) -> str:
+            if rate_limiter:
+                rate_limiter.wait_if_needed_sync(1)
+            return self.ask(msg, system_msgs)
+
+        pending: dict[futures.Future, int] = {}
+        questions = enumerate(msgs)
+        try:
+            while True:
+                for index, msg in questions:
+                    caller_context = contextvars.copy_context()
+                    pending[executor.submit(caller_context.run, ask_one, msg)] = index
+                    if len(pending) >= concurrency:
+                        break
+                if not pending:
+                    return
+                done, _ = futures.wait(pending, return_when=futures.FIRST_COMPLETED)
+                for future in done:
+                    index = pending.pop(future)
+                    try:
+                        yield index, future.result()
+                    except Exception as e:
+                        logger.warning(f"Question {index} failed: {e!r}")
+                        yield index, e
+        finally:
+            for future in pending:
+                future.cancel()
+
+    def ask_many(
+        self,
+        msgs: list[str],
+        system_msgs: Optional[list[str]] = None,
+        concurrency: Optional[int] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        return_exceptions: bool = True,
+    ) -> list[Union[str, Exception]]:
+        """
+        Ask many independent questions concurrently on the thread pool.
+
+        This is the synchronous counterpart of aask_many, for callers without an event loop.
+
+        :param msgs: A list of independent input questions.
+        :param system_msgs: List of system messages used for every question.
+        :param concurrency: Maximum number of requests in flight. Defaults to max_concurrency.
+        :param rate_limiter: Rate limiter to wait on before each request. Defaults to rate_limiter.
+        :param return_exceptions: Return the exception of a failed question in its place instead of raising it.
+        :return: The answers, in the same order as the questions.
+        """
+        results = [None] * len(msgs)
+        completed = self.ask_many_as_completed(
+            msgs, system_msgs, concurrency, rate_limiter
+        )
+        try:
+            for index, result in completed:
+                if isinstance(result, Exception) and not return_exceptions:
+                    raise result
+                results[index] = result
+        finally:
+            completed.close()
+        return results
+
+    async def _acollect_code(self, messages: list[dict], lang: Optional[str]) -> str:
+        """
+        Stream a completion from the provider until its code block closes, and cancel the rest.
+
+        :param messages: List of message dictionaries.
+        :param lang: Language of the code block. Defaults to the first block.
+        :return: The streamed text, up to the end of the code block.
+        """
+        extractor = CodeBlockExtractor(lang)
+        stream_stats = []
+        async with aclosing(self._astream(messages, stream_stats.append)) as deltas:
+            async for delta in deltas:
+                if extractor.feed(delta):
+                    break
+        encoding = get_encoding(self.model, fallback=True)
+        completion_tokens = stream_stats[0].completion_tokens
+        code = extractor.finish()
+        stats = CodeStats(
+            completion_tokens,
+            len(encoding.encode(code or "", disallowed_special=())),
+            extractor.done,
+            max(0, CONFIG.max_tokens_rsp - completion_tokens) if extractor.done else 0,
+        )
+        self.last_code_stats = stats
+        logger.debug(f"Code stats: {stats}")
+        return extractor.text
+
+    def ask_code(self, msgs: list[str], lang: Optional[str] = None) -> str:
         """
         Ask the GPT-based chatbot multiple questions and receive a piece of code.
 
+        The code of each answer is its first fenced code block (of the given language), or the whole
+        answer if it has none. Synchronous providers cannot be interrupted, so whole answers are
+        generated; use aask_code to stop the generation once the code is complete.
+
         :param msgs: A list of input questions.
-        :return: A piece of generated code.
+        :param lang: Language of the code blocks. Defaults to the first block of each answer.
+        :return: The code of the answers, one per line.
         """
+        context = self._new_context()
+        codes = []
+        for msg in msgs:
+            context.append(self._user_msg(msg))
+            rsp_text = self.get_choice_text(
+                self._completion(self._fit_context(context))
+            )
+            context.append(self._assistant_msg(rsp_text))
+            code = extract_code(rsp_text, lang)
+            codes.append(rsp_text if code is None else code)
+        return "\n".join(codes)
 
-        # TODO: No code segment filtering has been done here, and all results are actually displayed
-        rsp_text = self.ask_batch(msgs)
-        return rsp_text
-
-    async def aask_code(self, msgs: list[str]) -> str:
+    async def aask_code(self, msgs: list[str], lang: Optional[str] = None) -> str:
         """
         Asynchronously ask the GPT-based chatbot multiple questions and receive a piece of code.
 
+        Each answer is streamed and parsed as it arrives, and the stream is cancelled as soon as its
+        first fenced code block (of the given language) closes, so the model does not generate the
+        prose following the code. The outcome of the last answer is available in last_code_stats.
+
         :param msgs: A list of input questions.
-        :return: A piece of generated code.
+        :param lang: Language of the code blocks. Defaults to the first block of each answer.
+        :return: The code of the answers, one per line. Answers without a code block are returned whole.
         """
-        # TODO: No code segment filtering has been done here, and all results are actually displayed
-        rsp_text = await self.aask_batch(msgs)
-        return rsp_text
+        context = self._new_context()
+        codes = []
+        for msg in msgs:
+            context.append(self._user_msg(msg))
+            message = self._fit_context(context)
+            rsp_text = await self._acall(
+                f"code:{lang or ''}",
+                message,
+                lambda: self._acollect_code(message, lang),
+            )
+            context.append(self._assistant_msg(rsp_text))
+            code = extract_code(rsp_text, lang)
+            codes.append(rsp_text if code is None else code)
+        return "\n".join(codes)
 
     @abstractmethod
     def completion(self, messages: list[dict]):
@@ -185,6 +1057,14 @@ class BaseGPTAPI(BaseChatbot):
     async def acompletion_text(self, messages: list[dict], stream=False) -> str:
         """Asynchronous version of completion. Return str. Support stream-print"""
 
+    async def acompletion_stream(self, messages: list[dict]) -> AsyncIterator[str]:
+        """Asynchronous streaming version of completion. Yield the text deltas as they are generated.
+
+        Providers supporting streaming should override this. By default the whole text of
+        acompletion_text is yielded as a single delta.
+        """
+        yield await self.acompletion_text(messages, stream=True)
+
     def get_choice_text(self, rsp: dict) -> str:
         """
         Retrieve the first text of a choice.
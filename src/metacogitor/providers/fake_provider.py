@@ -0,0 +1,458 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 15:30
+@Author  : Joshua Magady
+@File    : fake_provider.py
+@Desc    : This is a deterministic fake GPT API provider for load and latency testing
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import math
+import random
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import AsyncIterator, Iterator, Optional
+
+from metacogitor.exceptions import ProviderException
+from metacogitor.logs import logger
+from metacogitor.providers.base_gpt_api import BaseGPTAPI
+from metacogitor.utils.cost_manager import CostManager
+from metacogitor.utils.token_counter import TOKEN_COSTS, count_message_tokens
+
+__ALL__ = ["LatencyDistribution", "FakeGPTAPI", "FakeProviderServer"]
+
+VOCABULARY = (
+    "the model answers with deterministic words drawn from a small vocabulary so "
+    "that every request has a stable reply and token count across runs"
+).split()
+
+
+@dataclass(frozen=True)
+class LatencyDistribution:
+    """
+    Distribution of a latency, in seconds.
+
+    Supported kinds are "constant" (always `mean`), "uniform" (between `low` and `high`), "normal" and
+    "lognormal" (with the given `mean` and standard deviation `sigma` of the latency itself). Samples
+    are never negative.
+    """
+
+    kind: str = "constant"
+    mean: float = 0.0
+    sigma: float = 0.0
+    low: float = 0.0
+    high: float = 0.0
+
+    def sample(self, rng: random.Random) -> float:
+        """
+        Draw a latency.
+
+        :param rng: Random generator.
+        :return: Latency in seconds.
+        """
+        if self.kind == "constant":
+            return self.mean
+        if self.kind == "uniform":
+            return rng.uniform(self.low, self.high)
+        if self.kind == "normal":
+            return max(0.0, rng.gauss(self.mean, self.sigma))
+        if self.kind == "lognormal":
+            if self.mean <= 0:
+                return 0.0
+            sigma2 = math.log1p((self.sigma / self.mean) ** 2)
+            return rng.lognormvariate(math.log(self.mean) - sigma2 / 2, sigma2**0.5)
+        raise ValueError(f"Unknown latency distribution {self.kind!r}")
+
+
+@dataclass
+class _Plan:
+    """Timing and content of one fake response (Private Class)."""
+
+    deltas: list[str]
+    time_to_first_token: float
+    token_interval: float
+    error: Optional[ProviderException] = None
+
+
+@dataclass
+class FakeGPTAPI(BaseGPTAPI):
+    """
+    Deterministic fake GPT API provider.
+
+    Replies are drawn from a seeded generator keyed by the request messages, so the same request
+    gets the same reply in every run, whatever the order or concurrency of the requests. Latency
+    is the time to first token plus one token interval per streamed token, and errors are injected
+    at the configured rate with the configured HTTP status. Attempts are counted for the last
+    `max_tracked_prompts` distinct requests only, so memory stays bounded in long load tests; an
+    evicted request starts over from its first attempt.
+    """
+
+    model: str = "gpt-3.5-turbo-0613"
+    seed: int = 0
+    time_to_first_token: LatencyDistribution = field(
+        default_factory=LatencyDistribution
+    )
+    tokens_per_second: float = 0.0
+    completion_tokens: tuple[int, int] = (16, 64)
+    error_rate: float = 0.0
+    error_status: int = 429
+    retry_after: Optional[float] = None
+    update_costs: bool = True
+    max_tracked_prompts: int = 10000
+
+    def __post_init__(self):
+        self._attempts = OrderedDict()
+        self._lock = threading.Lock()
+        self.requests = 0
+        """Number of requests received."""
+
+    def _plan(self, messages: list[dict]) -> _Plan:
+        """
+        Draw the reply, timing and error of a request.
+
+        The reply only depends on the seed and the messages. Timing and errors are drawn again for
+        each retry of the same messages, so injected errors are transient.
+
+        :param messages: List of message dictionaries.
+        :return: The response plan.
+        """
+        key = hashlib.sha256(
+            json.dumps(messages, sort_keys=True, ensure_ascii=False).encode()
+        ).hexdigest()
+        with self._lock:
+            attempt = self._attempts.pop(key, 0)
+            self._attempts[key] = attempt + 1
+            if len(self._attempts) > self.max_tracked_prompts:
+                self._attempts.popitem(last=False)
+            self.requests += 1
+        rng = random.Random(f"{self.seed}:{key}:{attempt}")
+        if rng.random() < self.error_rate:
+            error = ProviderException(
+                code=self.error_status,
+                message=f"Injected error {self.error_status}",
+                retry_after=self.retry_after,
+                endpoint="fake",
+            )
+            return _Plan([], self.time_to_first_token.sample(rng), 0.0, error)
+        reply = random.Random(f"{self.seed}:{key}")
+        words = [
+            reply.choice(VOCABULARY)
+            for _ in range(reply.randint(*self.completion_tokens))
+        ]
+        deltas = words[:1] + [f" {word}" for word in words[1:]]
+        interval = 1 / self.tokens_per_second if self.tokens_per_second > 0 else 0.0
+        return _Plan(deltas, self.time_to_first_token.sample(rng), interval)
+
+    def _response(self, messages: list[dict], text: str, num_deltas: int) -> dict:
+        """
+        Build the completion response of a fake reply, and record its cost.
+
+        :param messages: List of message dictionaries.
+        :param text: Reply text.
+        :param num_deltas: Number of tokens of the reply.
+        :return: Completion response dictionary in the OpenAI format.
+        """
+        if self.model in TOKEN_COSTS:
+            prompt_tokens = count_message_tokens(messages, self.model)
+        else:
+            prompt_tokens = sum(len(m.get("content", "")) for m in messages) // 4
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": num_deltas,
+            "total_tokens": prompt_tokens + num_deltas,
+        }
+        if self.update_costs and self.model in TOKEN_COSTS:
+            CostManager().update_cost(prompt_tokens, num_deltas, self.model)
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": self.model,
+            "choices": [
+                {
+                    "index": 0,
+                    "message": {"role": "assistant", "content": text},
+                    "finish_reason": "stop",
+                }
+            ],
+            "usage": usage,
+        }
+
+    def completion(self, messages: list[dict]) -> dict:
+        """
+        Get a fake completion, sleeping for its latency.
+
+        :param messages: List of message dictionaries.
+        :return: Completion response dictionary.
+        """
+        plan = self._plan(messages)
+        time.sleep(plan.time_to_first_token)
+        if plan.error:
+            raise plan.error
+        time.sleep(plan.token_interval * max(len(plan.deltas) - 1, 0))
+        return self._response(messages, "".join(plan.deltas), len(plan.deltas))
+
+    def completion_stream(self, messages: list[dict]) -> Iterator[str]:
+        """
+        Stream a fake completion, sleeping for its latency.
+
+        :param messages: List of message dictionaries.
+        :return: Iterator of text deltas.
+        """
+        plan = self._plan(messages)
+        time.sleep(plan.time_to_first_token)
+        if plan.error:
+            raise plan.error
+        for i, delta in enumerate(plan.deltas):
+            if i:
+                time.sleep(plan.token_interval)
+            yield delta
+        self._response(messages, "".join(plan.deltas), len(plan.deltas))
+
+    async def acompletion(self, messages: list[dict]) -> dict:
+        """
+        Asynchronously get a fake completion, sleeping for its latency.
+
+        :param messages: List of message dictionaries.
+        :return: Completion response dictionary.
+        """
+        plan = self._plan(messages)
+        await asyncio.sleep(plan.time_to_first_token)
+        if plan.error:
+            raise plan.error
+        await asyncio.sleep(plan.token_interval * max(len(plan.deltas) - 1, 0))
+        return self._response(messages, "".join(plan.deltas), len(plan.deltas))
+
+    async def acompletion_stream(self, messages: list[dict]) -> AsyncIterator[str]:
+        """
+        Asynchronously stream a fake completion, sleeping for its latency.
+
+        :param messages: List of message dictionaries.
+        :return: Async iterator of text deltas.
+        """
+        plan = self._plan(messages)
+        await asyncio.sleep(plan.time_to_first_token)
+        if plan.error:
+            raise plan.error
+        for i, delta in enumerate(plan.deltas):
+            if i:
+                await asyncio.sleep(plan.token_interval)
+            yield delta
+        self._response(messages, "".join(plan.deltas), len(plan.deltas))
+
+    async def acompletion_text(self, messages: list[dict], stream=False) -> str:
+        """
+        Asynchronously get a fake completion text.
+
+        :param messages: List of message dictionaries.
+        :param stream: Stream the reply token by token instead of waiting for the whole of it.
+        :return: Completion text.
+        """
+        if stream:
+            return "".join([delta async for delta in self.acompletion_stream(messages)])
+        return self.get_choice_text(await self.acompletion(messages))
+
+
+class _FakeProviderHandler(BaseHTTPRequestHandler):
+    """HTTP handler of the OpenAI chat completions endpoint (Private Class)."""
+
+    protocol_version = "HTTP/1.1"
+    provider: FakeGPTAPI = None
+
+    def log_message(self, format, *args):
+        logger.debug(f"{self.address_string()} - {format % args}")
+
+    def _send_json(self, status: int, body: dict, headers: Optional[dict] = None):
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _send_error(self, error: ProviderException):
+        headers = {}
+        if error.retry_after is not None:
+            headers["Retry-After"] = str(error.retry_after)
+        body = {"error": {"message": error.error.message, "code": error.status}}
+        self._send_json(error.status, body, headers)
+
+    def _send_chunk(self, data: str):
+        payload = f"data: {data}\n\n".encode()
+        self.wfile.write(f"{len(payload):x}\r\n".encode() + payload + b"\r\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self._send_json(404, {"error": {"message": "Not found", "code": 404}})
+            return
+        messages = request.get("messages", [])
+        try:
+            if not request.get("stream"):
+                self._send_json(200, self.provider.completion(messages))
+                return
+            deltas = self.provider.completion_stream(messages)
+            first = next(deltas, None)
+        except ProviderException as e:
+            self._send_error(e)
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+        chunk_id = f"chatcmpl-{uuid.uuid4().hex}"
+        for delta in _chain(first, deltas):
+            chunk = {
+                "id": chunk_id,
+                "object": "chat.completion.chunk",
+                "model": self.provider.model,
+                "choices": [{"index": 0, "delta": {"content": delta}}],
+            }
+            self._send_chunk(json.dumps(chunk))
+        self._send_chunk("[DONE]")
+        self.wfile.write(b"0\r\n\r\n")
+
+
+def _chain(first: Optional[str], rest: Iterator[str]) -> Iterator[str]:
+    """Yield the first delta followed by the rest (Private Method)."""
+
+    if first is not None:
+        yield first
+        yield from rest
+
+
+class _FakeHTTPServer(ThreadingHTTPServer):
+    """HTTP server counting the connections it accepts (Private Class)."""
+
+    daemon_threads = True
+    connections = 0
+
+    def process_request(self, request, client_address):
+        self.connections += 1
+        super().process_request(request, client_address)
+
+
+class FakeProviderServer:
+    """
+    Local HTTP server exposing a fake provider as an OpenAI compatible chat completions endpoint.
+
+    Usage:
+
+        with FakeProviderServer(FakeGPTAPI(tokens_per_second=50)) as server:
+            ...  # point OPENAI_API_BASE at server.url
+    """
+
+    def __init__(
+        self,
+        provider: Optional[FakeGPTAPI] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        """
+        Initialize the server.
+
+        :param provider: Fake provider answering the requests. Defaults to FakeGPTAPI().
+        :param host: Host to bind. Defaults to localhost.
+        :param port: Port to bind. Defaults to a free port.
+        """
+        self.provider = provider or FakeGPTAPI()
+        handler = type(
+            "FakeProviderHandler", (_FakeProviderHandler,), {"provider": self.provider}
+        )
+        self._server = _FakeHTTPServer((host, port), handler)
+        self._thread = None
+
+    @property
+    def connections(self) -> int:
+        """Get the number of connections accepted, to check that clients keep them alive."""
+
+        return self._server.connections
+
+    @property
+    def url(self) -> str:
+        """Get the base URL of the API, to use as OPENAI_API_BASE."""
+
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "FakeProviderServer":
+        """
+        Serve requests in a background thread.
+
+        :return: The server.
+        """
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="FakeProviderServer", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving and close the socket."""
+
+        if self._thread is not None:
+            self._server.shutdown()
+            self._thread.join()
+            self._thread = None
+        self._server.server_close()
+
+    def serve_forever(self):
+        """Serve requests in the calling thread until interrupted."""
+
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def main(argv: Optional[list[str]] = None):
+    """Run a fake provider server from the command line."""
+
+    parser = argparse.ArgumentParser(description="Serve a deterministic fake GPT API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--ttft", type=float, default=0.2, help="mean time to first token"
+    )
+    parser.add_argument("--ttft-sigma", type=float, default=0.05)
+    parser.add_argument("--tokens-per-second", type=float, default=50.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=429)
+    args = parser.parse_args(argv)
+
+    provider = FakeGPTAPI(
+        seed=args.seed,
+        time_to_first_token=LatencyDistribution(
+            "lognormal", mean=args.ttft, sigma=args.ttft_sigma
+        ),
+        tokens_per_second=args.tokens_per_second,
+        error_rate=args.error_rate,
+        error_status=args.error_status,
+    )
+    server = FakeProviderServer(provider, args.host, args.port)
+    logger.info(f"Serving fake provider on {server.url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
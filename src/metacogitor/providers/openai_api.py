@@ -0,0 +1,388 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 16:20
+@Author  : Joshua Magady
+@File    : openai_api.py
+@Desc    : This is the OpenAI compatible GPT API provider on pooled keep-alive HTTP connections
+"""
+import asyncio
+import json
+import threading
+from typing import AsyncIterator, Optional
+
+import aiohttp
+import requests
+from requests.adapters import HTTPAdapter
+
+from metacogitor.exceptions import ProviderException
+from metacogitor.logs import logger
+from metacogitor.providers.base_gpt_api import BaseGPTAPI
+from metacogitor.utils.cost_manager import CostManager
+from metacogitor.utils.sse import SSEDecoder
+from metacogitor.utils.token_counter import (
+    TOKEN_COSTS,
+    count_message_tokens,
+    get_encoding,
+)
+from metacogitor.config import CONFIG
+
+__ALL__ = ["OpenAIGPTAPI"]
+
+DEFAULT_API_BASE = "https://api.openai.com/v1"
+
+
+class OpenAIGPTAPI(BaseGPTAPI):
+    """
+    OpenAI compatible GPT API provider.
+
+    Requests go through one pooled HTTP client per event loop (and one for synchronous calls) that
+    keeps connections alive, so requests reuse connections instead of opening one each. The pool size
+    and timeouts are configurable. Works with OpenAI, Azure OpenAI deployments and any OpenAI
+    compatible server.
+    """
+
+    def __init__(
+        self,
+        model: Optional[str] = None,
+        api_key: Optional[str] = None,
+        api_base: Optional[str] = None,
+        api_type: Optional[str] = None,
+        api_version: Optional[str] = None,
+        deployment_id: Optional[str] = None,
+        proxy: Optional[str] = None,
+        max_connections: Optional[int] = None,
+        timeout: Optional[float] = None,
+        connect_timeout: float = 10.0,
+        keepalive_timeout: float = 30.0,
+    ):
+        """
+        Initialize the provider. Settings default to the configuration.
+
+        :param model: Model name. Defaults to OPENAI_API_MODEL.
+        :param api_key: API key. Defaults to OPENAI_API_KEY.
+        :param api_base: Base URL of the API. Defaults to OPENAI_API_BASE, or the OpenAI API.
+        :param api_type: "openai", or "azure" for Azure OpenAI deployments. Defaults to OPENAI_API_TYPE.
+        :param api_version: API version of Azure deployments. Defaults to OPENAI_API_VERSION.
+        :param deployment_id: Azure deployment. Defaults to DEPLOYMENT_ID.
+        :param proxy: HTTP proxy URL. Defaults to OPENAI_PROXY or GLOBAL_PROXY.
+        :param max_connections: Maximum number of open connections. Defaults to OPENAI_MAX_CONNECTIONS.
+        :param timeout: Seconds allowed for a whole request. Defaults to OPENAI_API_TIMEOUT.
+        :param connect_timeout: Seconds allowed to open a connection.
+        :param keepalive_timeout: Seconds an idle connection is kept open.
+        """
+        self.model = model or CONFIG.openai_api_model
+        self.api_key = api_key or CONFIG.openai_api_key
+        api_base = api_base or CONFIG.openai_api_base
+        if not api_base or api_base == "YOUR_API_BASE":
+            api_base = DEFAULT_API_BASE
+        self.api_base = api_base.rstrip("/")
+        self.api_type = (api_type or CONFIG.openai_api_type or "openai").lower()
+        self.api_version = api_version or CONFIG.openai_api_version
+        self.deployment_id = deployment_id or CONFIG.deployment_id
+        self.proxy = proxy or CONFIG.openai_proxy
+        self.max_connections = max_connections or CONFIG.openai_max_connections
+        self.timeout = timeout or CONFIG.openai_api_timeout
+        self.connect_timeout = connect_timeout
+        self.keepalive_timeout = keepalive_timeout
+
+        self._sessions = {}
+        self._sync_session = None
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        """Get the URL of the chat completions endpoint."""
+
+        if self.api_type == "azure":
+            return (
+                f"{self.api_base}/openai/deployments/{self.deployment_id}"
+                f"/chat/completions?api-version={self.api_version}"
+            )
+        return f"{self.api_base}/chat/completions"
+
+    def _endpoint(self) -> str:
+        """
+        Get the name of the endpoint, which selects its circuit breaker.
+
+        :return: Endpoint name.
+        """
+        return self.url
+
+    def _headers(self) -> dict[str, str]:
+        """
+        Get the request headers.
+
+        :return: Dictionary of headers.
+        """
+        if self.api_type == "azure":
+            return {"api-key": self.api_key}
+        return {"Authorization": f"Bearer {self.api_key}"}
+
+    def _sampling_params(self) -> dict:
+        """
+        Get the sampling parameters sent with every request.
+
+        :return: Dictionary of sampling parameters.
+        """
+        return {
+            "max_tokens": CONFIG.max_tokens_rsp,
+            "n": 1,
+            "stop": None,
+            "temperature": 0.3,
+        }
+
+    def _payload(self, messages: list[dict], stream: bool = False) -> dict:
+        """
+        Build the request body.
+
+        :param messages: List of message dictionaries.
+        :param stream: Stream the response.
+        :return: Request body.
+        """
+        payload = {"messages": messages, **self._sampling_params()}
+        if self.api_type != "azure":
+            payload["model"] = self.model
+        if stream:
+            payload["stream"] = True
+        return payload
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """
+        Get the pooled HTTP client of the running event loop, creating it on first use.
+
+        :return: HTTP client session.
+        """
+        loop = asyncio.get_running_loop()
+        session = self._sessions.get(loop)
+        if session is None or session.closed:
+            for other in [key for key in self._sessions if key.is_closed()]:
+                del self._sessions[other]
+            connector = aiohttp.TCPConnector(
+                limit=self.max_connections, keepalive_timeout=self.keepalive_timeout
+            )
+            session = self._sessions[loop] = aiohttp.ClientSession(
+                connector=connector,
+                headers=self._headers(),
+                timeout=aiohttp.ClientTimeout(
+                    total=self.timeout, sock_connect=self.connect_timeout
+                ),
+            )
+        return session
+
+    def _get_sync_session(self) -> requests.Session:
+        """
+        Get the pooled HTTP client of synchronous calls, creating it on first use.
+
+        :return: HTTP client session.
+        """
+        with self._lock:
+            if self._sync_session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(
+                    pool_connections=1, pool_maxsize=self.max_connections
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                session.headers.update(self._headers())
+                if self.proxy:
+                    session.proxies = {"http": self.proxy, "https": self.proxy}
+                self._sync_session = session
+            return self._sync_session
+
+    def _error(self, status: int, body: str, headers) -> ProviderException:
+        """
+        Build the exception of a failed response.
+
+        :param status: HTTP status.
+        :param body: Response body.
+        :param headers: Response headers.
+        :return: The provider exception.
+        """
+        try:
+            message = json.loads(body)["error"]["message"]
+        except (ValueError, KeyError, TypeError):
+            message = body[:500] or f"HTTP {status}"
+        retry_after = headers.get("Retry-After")
+        try:
+            retry_after = float(retry_after) if retry_after is not None else None
+        except ValueError:
+            retry_after = None
+        return ProviderException(
+            code=status if 100 <= status <= 1000 else 500,
+            message=message,
+            retry_after=retry_after,
+            endpoint=self._endpoint(),
+        )
+
+    def _transport_error(self, error: Exception) -> ProviderException:
+        """
+        Build the exception of a call that failed without a response, so the retry engine can classify it.
+
+        Connection failures happen before the request is sent and map to 503, which is always retried.
+        Timeouts map to 504 and dropped connections to 502, which are only retried for idempotent calls
+        since the provider may have processed the request.
+
+        :param error: The requests or aiohttp error.
+        :return: The provider exception.
+        """
+        if isinstance(error, (requests.ConnectTimeout, aiohttp.ClientConnectorError)):
+            status = 503
+        elif isinstance(error, (requests.Timeout, aiohttp.ServerTimeoutError)):
+            status = 504
+        else:
+            status = 502
+        return ProviderException(
+            code=status,
+            message=f"{type(error).__name__}: {error}",
+            endpoint=self._endpoint(),
+        )
+
+    def _update_costs(self, usage: dict):
+        """
+        Report the token usage of a response to the cost manager.
+
+        :param usage: Usage dictionary of the response.
+        """
+        if not CONFIG.calc_usage or self.model not in TOKEN_COSTS:
+            return
+        CostManager().update_cost(
+            usage.get("prompt_tokens", 0), usage.get("completion_tokens", 0), self.model
+        )
+
+    def _stream_usage(self, messages: list[dict], text: str) -> dict:
+        """
+        Count the usage of a streamed response, which the API does not report.
+
+        :param messages: List of message dictionaries.
+        :param text: Streamed text.
+        :return: Usage dictionary.
+        """
+        if self.model not in TOKEN_COSTS:
+            return {}
+        completion_tokens = len(
+            get_encoding(self.model).encode(text, disallowed_special=())
+        )
+        return {
+            "prompt_tokens": count_message_tokens(messages, self.model),
+            "completion_tokens": completion_tokens,
+        }
+
+    def completion(self, messages: list[dict]) -> dict:
+        """
+        Get a completion.
+
+        :param messages: List of message dictionaries.
+        :return: Completion response dictionary.
+        """
+        try:
+            rsp = self._get_sync_session().post(
+                self.url,
+                json=self._payload(messages),
+                timeout=(self.connect_timeout, self.timeout),
+            )
+            if rsp.status_code != 200:
+                raise self._error(rsp.status_code, rsp.text, rsp.headers)
+            rsp = rsp.json()
+        except requests.RequestException as e:
+            raise self._transport_error(e) from e
+        self._update_costs(rsp.get("usage", {}))
+        return rsp
+
+    async def acompletion(self, messages: list[dict]) -> dict:
+        """
+        Asynchronously get a completion.
+
+        :param messages: List of message dictionaries.
+        :return: Completion response dictionary.
+        """
+        try:
+            async with self._get_session().post(
+                self.url, json=self._payload(messages), proxy=self.proxy
+            ) as rsp:
+                if rsp.status != 200:
+                    raise self._error(rsp.status, await rsp.text(), rsp.headers)
+                rsp = await rsp.json()
+        except aiohttp.ClientError as e:
+            raise self._transport_error(e) from e
+        self._update_costs(rsp.get("usage", {}))
+        return rsp
+
+    async def acompletion_stream(self, messages: list[dict]) -> AsyncIterator[str]:
+        """
+        Asynchronously stream a completion, yielding the text deltas as the events arrive.
+
+        The usage is reported to the cost manager when the stream ends, including when it is closed early.
+        A stream cancelled before any output, like the loser of a hedged request, is not billed here:
+        whoever cancelled it bills its prompt (see BaseGPTAPI._record_hedge_loss).
+
+        :param messages: List of message dictionaries.
+        :return: Async iterator of text deltas.
+        """
+        decoder = SSEDecoder()
+        parts = []
+        usage = None
+        try:
+            async with self._get_session().post(
+                self.url, json=self._payload(messages, stream=True), proxy=self.proxy
+            ) as rsp:
+                if rsp.status != 200:
+                    raise self._error(rsp.status, await rsp.text(), rsp.headers)
+                billed = True
+                try:
+                    async for chunk in rsp.content.iter_any():
+                        for data in decoder.feed(chunk):
+                            if data == "[DONE]":
+                                continue
+                            event = json.loads(data)
+                            usage = event.get("usage") or usage
+                            for choice in event.get("choices", []):
+                                delta = choice.get("delta", {}).get("content")
+                                if delta:
+                                    parts.append(delta)
+                                    yield delta
+                except (asyncio.CancelledError, GeneratorExit):
+                    billed = bool(usage or parts)
+                    raise
+                finally:
+                    if billed:
+                        self._update_costs(
+                            usage or self._stream_usage(messages, "".join(parts))
+                        )
+        except aiohttp.ClientError as e:
+            raise self._transport_error(e) from e
+
+    async def acompletion_text(self, messages: list[dict], stream=False) -> str:
+        """
+        Asynchronously get a completion text.
+
+        :param messages: List of message dictionaries.
+        :param stream: Stream the response and log the deltas as they arrive.
+        :return: Completion text.
+        """
+        if not stream:
+            return self.get_choice_text(await self.acompletion(messages))
+        parts = []
+        async for delta in self.acompletion_stream(messages):
+            logger.debug(delta)
+            parts.append(delta)
+        return "".join(parts)
+
+    async def aclose(self):
+        """Close the pooled HTTP clients."""
+
+        sessions, self._sessions = self._sessions, {}
+        loop = asyncio.get_running_loop()
+        for session_loop, session in sessions.items():
+            if session_loop is loop:
+                await session.close()
+        self.close()
+
+    def close(self):
+        """Close the pooled HTTP client of synchronous calls, and the thread pool."""
+
+        with self._lock:
+            session, self._sync_session = self._sync_session, None
+        if session is not None:
+            session.close()
+        self.shutdown()
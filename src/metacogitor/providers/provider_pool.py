@@ -0,0 +1,434 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 17:05
+@Author  : Joshua Magady
+@File    : provider_pool.py
+@Desc    : This is the load balancing pool of GPT API providers, presented as a single provider
+"""
+import asyncio
+import threading
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, NamedTuple, Optional, Union
+
+from metacogitor.logs import logger
+from metacogitor.providers.base_gpt_api import BaseGPTAPI
+from metacogitor.utils.rate_limiter import RateLimiter
+from metacogitor.utils.retry import get_retry_after, get_status
+from metacogitor.config import CONFIG
+
+__ALL__ = ["PoolMemberStats", "PoolMember", "ProviderPool"]
+
+
+class PoolMemberStats(NamedTuple):
+    """
+    Statistics of a pool member.
+    """
+
+    name: str
+    """Name of the member."""
+
+    outstanding: int
+    """Number of requests in flight."""
+
+    latency: Optional[float]
+    """Moving average of the latency in seconds, or None before the first answer."""
+
+    requests: int
+    """Number of requests routed to the member."""
+
+    failures: int
+    """Number of failed requests."""
+
+    ejections: int
+    """Number of times the member was ejected for throttling."""
+
+    ejected: bool
+    """True if the member is currently ejected."""
+
+
+class PoolMember:
+    """
+    A provider of a pool (one API key or deployment), with its own rate limiter and health state.
+    """
+
+    def __init__(
+        self,
+        provider: BaseGPTAPI,
+        rpm: Optional[int] = None,
+        name: Optional[str] = None,
+    ):
+        """
+        Initialize the member.
+
+        :param provider: The provider.
+        :param rpm: Requests per minute allowed to the member. Unlimited by default.
+        :param name: Name of the member, used in logs and statistics. Named after its position in the pool by default.
+        """
+        self.provider = provider
+        self.name = name
+        self.rate_limiter = RateLimiter(rpm) if rpm else None
+        self.outstanding = 0
+        self.latency: Optional[float] = None
+        self.requests = 0
+        self.failures = 0
+        self.ejections = 0
+        self.throttles = 0
+        self.ejected_until = 0.0
+
+    def __repr__(self) -> str:
+        return f"PoolMember({self.name!r})"
+
+
+class ProviderPool(BaseGPTAPI):
+    """
+    Pool of providers spreading requests across several API keys and deployments, presented as a
+    single provider.
+
+    Each request is routed to the healthy member with the fewest requests in flight, ties going to the
+    member with the lowest moving average latency. A member answering with a throttling error (HTTP 429,
+    or any error with a Retry-After) is ejected for the Retry-After delay, or an exponentially growing
+    ejection time when it keeps throttling, and the request fails over to another member. Ejected
+    members rejoin the pool when their ejection expires. When every member is ejected, requests go to the
+    member whose ejection expires first.
+
+    Usage:
+
+        pool = ProviderPool.from_keys(["sk-...", "sk-..."], rpm=60)
+        answer = await pool.aask("hello")
+    """
+
+    def __init__(
+        self,
+        members: list[Union[BaseGPTAPI, PoolMember]],
+        model: Optional[str] = None,
+        ewma_alpha: float = 0.3,
+        ejection_time: float = 10.0,
+        max_ejection_time: float = 300.0,
+        failover: bool = True,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initialize the pool.
+
+        :param members: Providers or members of the pool.
+        :param model: Model name, used for token counting. Defaults to the model of the first member.
+        :param ewma_alpha: Weight of the latest latency in the moving average.
+        :param ejection_time: Seconds a member is ejected the first time it throttles. Doubled each consecutive time.
+        :param max_ejection_time: Maximum seconds a member is ejected.
+        :param failover: Send a throttled request again to another member.
+        :param clock: Time source.
+        """
+        if not members:
+            raise ValueError("A provider pool needs at least one member")
+        self.members = [
+            member if isinstance(member, PoolMember) else PoolMember(member)
+            for member in members
+        ]
+        for index, member in enumerate(self.members):
+            if member.name is None:
+                member.name = f"{type(member.provider).__name__}-{index}"
+        self.model = model or self.members[0].provider.model
+        self.ewma_alpha = ewma_alpha
+        self.ejection_time = ejection_time
+        self.max_ejection_time = max_ejection_time
+        self.failover = failover
+        self.clock = clock
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_keys(
+        cls, api_keys: list[str], rpm: Optional[int] = None, **kwargs
+    ) -> "ProviderPool":
+        """
+        Build a pool of OpenAI compatible providers, one per API key.
+
+        :param api_keys: API keys.
+        :param rpm: Requests per minute allowed to each key. Defaults to RPM.
+        :param kwargs: Other settings of the providers, see OpenAIGPTAPI.
+        :return: The pool.
+        """
+        from metacogitor.providers.openai_api import OpenAIGPTAPI
+
+        rpm = rpm or int(CONFIG.openai_api_rpm)
+        return cls(
+            [
+                PoolMember(OpenAIGPTAPI(api_key=key, **kwargs), rpm, f"key-{index}")
+                for index, key in enumerate(api_keys)
+            ]
+        )
+
+    def _endpoint(self) -> str:
+        """
+        Get the name of the endpoint, which selects its circuit breaker.
+
+        :return: Endpoint name.
+        """
+        return f"{type(self).__name__}:{','.join(m.name for m in self.members)}"
+
+    def stats(self) -> list[PoolMemberStats]:
+        """
+        Get the statistics of the members.
+
+        :return: List of member statistics, in pool order.
+        """
+        now = self.clock()
+        with self._lock:
+            return [
+                PoolMemberStats(
+                    m.name,
+                    m.outstanding,
+                    m.latency,
+                    m.requests,
+                    m.failures,
+                    m.ejections,
+                    m.ejected_until > now,
+                )
+                for m in self.members
+            ]
+
+    def _acquire(self, tried: list[PoolMember]) -> PoolMember:
+        """
+        Route a request to a member and count it as outstanding.
+
+        :param tried: Members that already failed the request, avoided when possible.
+        :return: The member.
+        """
+        now = self.clock()
+        with self._lock:
+            candidates = [m for m in self.members if m not in tried] or self.members
+            healthy = [m for m in candidates if m.ejected_until <= now]
+            if healthy:
+                member = min(
+                    healthy,
+                    key=lambda m: (m.outstanding, m.latency or 0.0),
+                )
+            else:
+                member = min(candidates, key=lambda m: m.ejected_until)
+            member.outstanding += 1
+            member.requests += 1
+        return member
+
+    def _is_throttle(self, error: BaseException) -> bool:
+        """
+        Check if an error means the member is throttling.
+
+        :param error: The error.
+        :return: True if the member should be ejected.
+        """
+        return get_status(error) == 429 or get_retry_after(error) is not None
+
+    def _update_latency(self, member: PoolMember, latency: float):
+        """
+        Fold a latency into the moving average of a member. The pool lock must be held.
+
+        :param member: The member.
+        :param latency: Latency in seconds.
+        """
+        if member.latency is None:
+            member.latency = latency
+        else:
+            member.latency += self.ewma_alpha * (latency - member.latency)
+
+    def _record_latency(self, member: PoolMember, latency: float):
+        """
+        Record the latency of a member.
+
+        :param member: The member.
+        :param latency: Latency in seconds.
+        """
+        with self._lock:
+            self._update_latency(member, latency)
+
+    def _release(
+        self,
+        member: PoolMember,
+        start: Optional[float],
+        error: Optional[BaseException] = None,
+    ) -> bool:
+        """
+        Record the outcome of a request routed to a member.
+
+        :param member: The member.
+        :param start: Time the request was sent, or None if it never was.
+        :param error: Error of a failed request.
+        :return: True if the member was ejected for throttling.
+        """
+        now = self.clock()
+        with self._lock:
+            member.outstanding -= 1
+            if error is None:
+                if start is not None:
+                    self._update_latency(member, now - start)
+                member.throttles = 0
+                return False
+            member.failures += 1
+            if not self._is_throttle(error):
+                return False
+            member.throttles += 1
+            member.ejections += 1
+            duration = min(
+                self.max_ejection_time,
+                self.ejection_time * 2 ** (member.throttles - 1),
+            )
+            duration = max(duration, get_retry_after(error) or 0.0)
+            member.ejected_until = now + duration
+        logger.warning(
+            f"Ejecting pool member {member.name} for {duration:.1f}s after {error!r}"
+        )
+        return True
+
+    def _should_failover(self, throttled: bool, tried: list[PoolMember]) -> bool:
+        """
+        Check if a throttled request should be sent to another member.
+
+        :param throttled: True if the member was ejected for throttling.
+        :param tried: Members that already failed the request.
+        :return: True to fail over.
+        """
+        return self.failover and throttled and len(tried) < len(self.members)
+
+    def _call_member(self, func: Callable[[BaseGPTAPI], object]):
+        """
+        Call a member, failing over to another one when it throttles.
+
+        :param func: The call, given the provider of the member.
+        :return: The response.
+        """
+        tried = []
+        while True:
+            member = self._acquire(tried)
+            start = None
+            try:
+                if member.rate_limiter is not None:
+                    member.rate_limiter.wait_if_needed_sync(1)
+                start = self.clock()
+                rsp = func(member.provider)
+            except Exception as e:
+                tried.append(member)
+                if not self._should_failover(self._release(member, start, e), tried):
+                    raise
+                continue
+            except BaseException:
+                self._release(member, None)
+                raise
+            self._release(member, start)
+            return rsp
+
+    async def _acall_member(self, func: Callable[[BaseGPTAPI], Awaitable]):
+        """
+        Await a call to a member, failing over to another one when it throttles.
+
+        :param func: Factory of the call, given the provider of the member.
+        :return: The response.
+        """
+        tried = []
+        while True:
+            member = self._acquire(tried)
+            start = None
+            try:
+                if member.rate_limiter is not None:
+                    await asyncio.sleep(member.rate_limiter.reserve(1))
+                start = self.clock()
+                rsp = await func(member.provider)
+            except Exception as e:
+                tried.append(member)
+                if not self._should_failover(self._release(member, start, e), tried):
+                    raise
+                continue
+            except BaseException:
+                self._release(member, None)
+                raise
+            self._release(member, start)
+            return rsp
+
+    def completion(self, messages: list[dict]) -> dict:
+        """
+        Get a completion from a member of the pool.
+
+        :param messages: List of message dictionaries.
+        :return: Completion response dictionary.
+        """
+        return self._call_member(lambda provider: provider.completion(messages))
+
+    async def acompletion(self, messages: list[dict]) -> dict:
+        """
+        Asynchronously get a completion from a member of the pool.
+
+        :param messages: List of message dictionaries.
+        :return: Completion response dictionary.
+        """
+        return await self._acall_member(lambda provider: provider.acompletion(messages))
+
+    async def acompletion_text(self, messages: list[dict], stream=False) -> str:
+        """
+        Asynchronously get a completion text from a member of the pool.
+
+        :param messages: List of message dictionaries.
+        :param stream: Stream-print the response.
+        :return: Completion text.
+        """
+        return await self._acall_member(
+            lambda provider: provider.acompletion_text(messages, stream=stream)
+        )
+
+    async def acompletion_stream(self, messages: list[dict]) -> AsyncIterator[str]:
+        """
+        Asynchronously stream a completion from a member of the pool.
+
+        The request counts as outstanding until the stream ends, and the latency of the member is
+        the time to the first delta. A stream throttled before its first delta fails over.
+
+        :param messages: List of message dictionaries.
+        :return: Async iterator of text deltas.
+        """
+        tried = []
+        while True:
+            member = self._acquire(tried)
+            first = None
+            try:
+                if member.rate_limiter is not None:
+                    await asyncio.sleep(member.rate_limiter.reserve(1))
+                start = self.clock()
+                async with aclosing(
+                    member.provider.acompletion_stream(messages)
+                ) as deltas:
+                    async for delta in deltas:
+                        if first is None:
+                            first = self.clock()
+                            self._record_latency(member, first - start)
+                        yield delta
+            except Exception as e:
+                throttled = self._release(member, None, e)
+                tried.append(member)
+                if first is not None or not self._should_failover(throttled, tried):
+                    raise
+                continue
+            except BaseException:
+                self._release(member, None)
+                raise
+            self._release(member, None)
+            return
+
+    def close(self):
+        """Close the members, and the thread pool."""
+
+        for member in self.members:
+            close = getattr(member.provider, "close", None)
+            if close is not None:
+                close()
+            else:
+                member.provider.shutdown()
+        self.shutdown()
+
+    async def aclose(self):
+        """Close the members, and the thread pool."""
+
+        for member in self.members:
+            aclose = getattr(member.provider, "aclose", None)
+            if aclose is not None:
+                await aclose()
+            else:
+                member.provider.shutdown()
+        self.shutdown()
@@ -2,3 +2,13 @@ from metacogitor.utils.rate_limiter import *
 from metacogitor.utils.cost_manager import *
 from metacogitor.utils.token_counter import *
 from metacogitor.utils.debounce import *
+from metacogitor.utils.context_fitter import *
+from metacogitor.utils.response_cache import *
+from metacogitor.utils.single_flight import *
+from metacogitor.utils.conversation import *
+from metacogitor.utils.retry import *
+from metacogitor.utils.hedging import *
+from metacogitor.utils.sse import *
+from metacogitor.utils.code_extractor import *
+from metacogitor.utils.shared_rate_limiter import *
+from metacogitor.utils.async_map import *
@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 21:40
+@Author  : Joshua Magady
+@File    : async_map.py
+@Desc    : This defines the rate limited streaming map of coroutines over work items.
+"""
+import asyncio
+from typing import (
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Iterable,
+    Union,
+)
+
+from metacogitor.logs import logger
+
+__ALL__ = ["amap_as_completed"]
+
+
+async def _next_item(iterator) -> tuple[bool, Any]:
+    """Get the next item of a sync or async iterator (Private Method).
+
+    Args:
+        iterator: The iterator.
+
+    Returns:
+        tuple[bool, Any]: (True, item), or (False, None) once the iterator is exhausted.
+    """
+
+    if hasattr(iterator, "__anext__"):
+        try:
+            return True, await iterator.__anext__()
+        except StopAsyncIteration:
+            return False, None
+    try:
+        return True, next(iterator)
+    except StopIteration:
+        return False, None
+
+
+async def amap_as_completed(
+    func: Callable[[Any], Awaitable],
+    items: Union[Iterable, AsyncIterable],
+    concurrency: int = 8,
+    rate_limiter=None,
+    return_exceptions: bool = True,
+) -> AsyncIterator[tuple[int, Any]]:
+    """Apply a coroutine function to a stream of work items, yielding results as they complete.
+
+    Items are pulled from the iterable only when a slot frees up, so at most `concurrency` items
+    are held at once, whatever the size of the input: a generator of millions of prompts is never
+    materialized. Every call first waits on the rate limiter, any limiter with a wait_if_needed
+    coroutine (RateLimiter, TokenBucketLimiter, FairRateLimiter, SharedRateLimiter). Closing the
+    iterator early cancels the calls in flight.
+
+    Usage:
+
+        async with aclosing(amap_as_completed(api.aask, prompts(), 16, limiter)) as results:
+            async for index, answer in results:
+                ...
+
+    Args:
+        func (Callable): Coroutine function called with each item.
+        items (Iterable | AsyncIterable): Work items, consumed lazily.
+        concurrency (int): Maximum number of calls in flight.
+        rate_limiter (optional): Rate limiter to wait on before each call.
+        return_exceptions (bool): Yield the exception of a failed call in place of its result instead of raising it.
+
+    Yields:
+        tuple[int, Any]: (index of the item, result or exception) tuples, in completion order.
+    """
+
+    if concurrency < 1:
+        raise ValueError("concurrency must be at least 1")
+
+    async def call(index: int, item):
+        try:
+            if rate_limiter is not None:
+                await rate_limiter.wait_if_needed(1)
+            return index, await func(item)
+        except Exception as e:
+            if not return_exceptions:
+                raise
+            logger.warning(f"Item {index} failed: {e!r}")
+            return index, e
+
+    iterator = aiter(items) if hasattr(items, "__aiter__") else iter(items)
+    pending = set()
+    index = 0
+    exhausted = False
+    try:
+        while True:
+            while not exhausted and len(pending) < concurrency:
+                more, item = await _next_item(iterator)
+                if not more:
+                    exhausted = True
+                    break
+                pending.add(asyncio.ensure_future(call(index, item)))
+                index += 1
+            if not pending:
+                return
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                yield task.result()
+    finally:
+        for task in pending:
+            task.cancel()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 18:15
+@Author  : Joshua Magady
+@File    : code_extractor.py
+@Desc    : This defines the incremental extractor of fenced code blocks.
+"""
+from typing import Optional
+
+__ALL__ = ["CodeBlockExtractor", "extract_code"]
+
+_SEARCH, _CODE, _SKIP, _DONE = range(4)
+
+
+class CodeBlockExtractor:
+    """Extract the first fenced code block of a text streamed in deltas.
+
+    Deltas are parsed line by line as they arrive, so the caller learns that
+    the requested block is complete as soon as its closing fence line ends,
+    and can stop the stream there. Fences are runs of at least three
+    backticks or tildes; a block is closed by a fence of the same character
+    at least as long as its opening fence. When a language is given, blocks
+    of other languages are skipped.
+
+    Usage:
+
+        extractor = CodeBlockExtractor("python")
+        async for delta in stream:
+            if extractor.feed(delta):
+                break
+        code = extractor.finish()
+    """
+
+    def __init__(self, lang: Optional[str] = None):
+        """Initialize the extractor.
+
+        Args:
+            lang (str, optional): Language of the block to extract. Defaults to the first block.
+        """
+
+        self.lang = lang.lower() if lang else None
+        """Language of the block to extract."""
+
+        self._state = _SEARCH
+        self._fence = ""
+        self._line = ""
+        self._code = []
+        self._deltas = []
+
+    @property
+    def done(self) -> bool:
+        """True once the requested block is closed."""
+
+        return self._state == _DONE
+
+    @property
+    def found(self) -> bool:
+        """True once the requested block is opened."""
+
+        return self._state in (_CODE, _DONE)
+
+    @property
+    def text(self) -> str:
+        """Text fed so far."""
+
+        return "".join(self._deltas)
+
+    @property
+    def code(self) -> Optional[str]:
+        """Code of the requested block so far, or None if it is not opened yet."""
+
+        if not self.found:
+            return None
+        return "\n".join(self._code)
+
+    def feed(self, delta: str) -> bool:
+        """Parse a delta.
+
+        Args:
+            delta (str): Next text delta of the stream.
+
+        Returns:
+            bool: True once the requested block is closed, when the stream can stop.
+        """
+
+        if self._state == _DONE:
+            return True
+        self._deltas.append(delta)
+        lines = (self._line + delta).split("\n")
+        self._line = lines.pop()
+        for line in lines:
+            self._parse_line(line)
+            if self._state == _DONE:
+                break
+        return self._state == _DONE
+
+    def finish(self) -> Optional[str]:
+        """End the stream, parsing its last line.
+
+        A block still open at the end of the stream ends with the stream.
+
+        Returns:
+            str: Code of the requested block, or None if the text has none.
+        """
+
+        if self._line and self._state != _DONE:
+            self._parse_line(self._line)
+        self._line = ""
+        return self.code
+
+    def _fence_of(self, line: str) -> str:
+        """Get the fence opening or closing a line, if any (Private Method).
+
+        Args:
+            line (str): The line.
+
+        Returns:
+            str: The fence, or an empty string.
+        """
+
+        stripped = line.lstrip()
+        if len(line) - len(stripped) > 3 or stripped[:3] not in ("```", "~~~"):
+            return ""
+        char = stripped[0]
+        return stripped[: len(stripped) - len(stripped.lstrip(char))]
+
+    def _parse_line(self, line: str):
+        """Parse a complete line (Private Method).
+
+        Args:
+            line (str): The line, without its newline.
+        """
+
+        fence = self._fence_of(line)
+        if self._state == _SEARCH:
+            if fence:
+                info = line.strip()[len(fence) :].strip().split()
+                lang = info[0].lower() if info else ""
+                self._fence = fence
+                if self.lang is None or lang == self.lang:
+                    self._state = _CODE
+                else:
+                    self._state = _SKIP
+            return
+        closing = (
+            fence
+            and fence[0] == self._fence[0]
+            and len(fence) >= len(self._fence)
+            and not line.strip()[len(fence) :].strip()
+        )
+        if self._state == _SKIP:
+            if closing:
+                self._state = _SEARCH
+        elif closing:
+            self._state = _DONE
+        else:
+            self._code.append(line)
+
+
+def extract_code(text: str, lang: Optional[str] = None) -> Optional[str]:
+    """Extract the first fenced code block of a text.
+
+    Args:
+        text (str): The text.
+        lang (str, optional): Language of the block to extract. Defaults to the first block.
+
+    Returns:
+        str: Code of the block, or None if the text has none.
+    """
+
+    extractor = CodeBlockExtractor(lang)
+    extractor.feed(text)
+    return extractor.finish()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 10:20
+@Author  : Joshua Magady
+@File    : context_fitter.py
+@Desc    : Trim conversation history to fit a model's context window.
+"""
+from bisect import bisect_left, bisect_right
+from typing import Callable, Optional
+
+from metacogitor.exceptions import ContextOverflowException
+from metacogitor.utils.token_counter import TOKEN_MAX, TokenLedger
+
+__ALL__ = ["fit_messages"]
+
+
+def fit_messages(
+    messages: list[dict],
+    model: str = "gpt-3.5-turbo-0613",
+    max_tokens: Optional[int] = None,
+    reserve: int = 0,
+    keep_last: int = 1,
+    priority: Optional[Callable[[dict], float]] = None,
+) -> list[dict]:
+    """Trim a conversation so that it fits the model's context window.
+
+    The system messages at the start of the conversation and the last
+    `keep_last` messages are always kept. By default the largest suffix of the
+    remaining history that fits is kept. With a `priority` function, the
+    messages with the highest priority are kept instead (newer messages win
+    ties), in their original order.
+
+    Token counts come from the prefix sums of a `TokenLedger`, so passing the
+    conversation's ledger avoids re-tokenizing the history, and the cut-off is
+    found with a binary search.
+
+    Args:
+        messages (list[dict]): List of message dicts, or a TokenLedger.
+        model (str, optional): AI model to count for. Defaults to "gpt-3.5-turbo-0613".
+        max_tokens (int, optional): Context window size. Defaults to TOKEN_MAX of the model.
+        reserve (int, optional): Tokens reserved for the completion. Defaults to 0.
+        keep_last (int, optional): Number of most recent messages always kept. Defaults to 1.
+        priority (Callable[[dict], float], optional): Priority of a history message,
+            higher is kept first. Defaults to keeping the most recent messages.
+
+    Returns:
+        list[dict]: The messages to send.
+
+    Raises:
+        ContextOverflowException: If the kept messages alone exceed the budget.
+    """
+
+    if isinstance(messages, TokenLedger) and messages.model == model:
+        ledger = messages
+    else:
+        ledger = TokenLedger(messages, model=model)
+    if max_tokens is None:
+        max_tokens = TOKEN_MAX[model]
+
+    prefix = ledger.prefix_sums
+    total = len(ledger)
+    budget = (
+        max_tokens - reserve - 3
+    )  # every reply is primed with <|start|>assistant<|message|>
+
+    head = 0
+    while head < total and ledger[head]["role"] == "system":
+        head += 1
+    tail = max(head, total - keep_last)
+
+    available = budget - prefix[head] - (prefix[total] - prefix[tail])
+    if available < 0:
+        raise ContextOverflowException(
+            code=413,
+            message=f"System and last {keep_last} messages need "
+            f"{budget - available} tokens, only {budget} available for {model}",
+        )
+
+    if priority is None:
+        start = bisect_left(prefix, prefix[tail] - available, head, tail)
+        return ledger[:head] + ledger[start:]
+
+    ranked = sorted(
+        range(head, tail), key=lambda i: (priority(ledger[i]), i), reverse=True
+    )
+    used = [0]
+    for i in ranked:
+        used.append(used[-1] + prefix[i + 1] - prefix[i])
+    kept = sorted(ranked[: bisect_right(used, available) - 1])
+    return ledger[:head] + [ledger[i] for i in kept] + ledger[tail:]
@@ -0,0 +1,265 @@
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 13:10
+@Author  : Joshua Magady
+@File    : conversation.py
+@Desc    : This defines the compact Conversation store for chat histories.
+"""
+import sys
+from functools import lru_cache
+from typing import Iterable, Iterator, Optional
+
+__ALL__ = ["ChatMessage", "Conversation", "shared_system_prefix"]
+
+
+class ChatMessage:
+    """Compact, immutable record of one chat message.
+
+    Records use `__slots__` and interned role strings, so a message costs a
+    small fixed overhead instead of a dict. The OpenAI dict format is only
+    produced by `to_dict`, at send time.
+    """
+
+    __slots__ = ("role", "content", "name")
+
+    def __init__(self, role: str, content: str, name: Optional[str] = None):
+        """Initialize the message.
+
+        Args:
+            role (str): Role of the author ("system", "user", "assistant", ...).
+            content (str): Text of the message.
+            name (str, optional): Name of the author. Defaults to None.
+        """
+
+        object.__setattr__(self, "role", sys.intern(role))
+        object.__setattr__(self, "content", content)
+        object.__setattr__(self, "name", name)
+
+    def __setattr__(self, key, value):
+        raise AttributeError("ChatMessage is immutable")
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, ChatMessage):
+            return NotImplemented
+        return (self.role, self.content, self.name) == (
+            other.role,
+            other.content,
+            other.name,
+        )
+
+    def __hash__(self) -> int:
+        return hash((self.role, self.content, self.name))
+
+    def __repr__(self) -> str:
+        return f"ChatMessage(role={self.role!r}, content={self.content!r})"
+
+    def to_dict(self) -> dict[str, str]:
+        """Build the OpenAI message dict.
+
+        Returns:
+            dict[str, str]: Message dict with role, content and optional name.
+        """
+
+        message = {"role": self.role, "content": self.content}
+        if self.name is not None:
+            message["name"] = self.name
+        return message
+
+    @classmethod
+    def from_dict(cls, message: dict) -> "ChatMessage":
+        """Build a record from an OpenAI message dict.
+
+        Args:
+            message (dict): Message dict.
+
+        Returns:
+            ChatMessage: The message record.
+        """
+
+        return cls(message["role"], message["content"], message.get("name"))
+
+
+@lru_cache(maxsize=1024)
+def shared_system_prefix(system_msgs: tuple[str, ...]) -> tuple[ChatMessage, ...]:
+    """Get the shared, immutable system-prompt prefix of a conversation.
+
+    Conversations started with the same system prompts share the same tuple of
+    records instead of each holding a copy.
+
+    Args:
+        system_msgs (tuple[str, ...]): System prompts.
+
+    Returns:
+        tuple[ChatMessage, ...]: System message records.
+    """
+
+    return tuple(ChatMessage("system", msg) for msg in system_msgs)
+
+
+class _Node:
+    """Immutable link of a persistent message list (Private Class)."""
+
+    __slots__ = ("message", "parent", "length")
+
+    def __init__(self, message: ChatMessage, parent: Optional["_Node"]):
+        self.message = message
+        self.parent = parent
+        self.length = 1 if parent is None else parent.length + 1
+
+
+class Conversation:
+    """Compact, persistent store of a chat history.
+
+    A conversation is an immutable system-prompt prefix shared between
+    conversations, followed by an immutable linked list of message records.
+    Appending links a new record to the end without touching the existing
+    ones, so `fork` is O(1): forks share every message before the fork point
+    and only pay for the messages appended after it. Call `to_dicts` to get
+    the messages to send.
+
+    Usage:
+
+        conversation = Conversation(["You are a helpful assistant."])
+        conversation.add_user("Hello")
+        branch = conversation.fork()
+        branch.add_user("Tell me a joke")  # conversation is unchanged
+        api.completion(branch.to_dicts())
+    """
+
+    __slots__ = ("prefix", "_tail")
+
+    def __init__(
+        self,
+        system_msgs: Optional[Iterable[str]] = None,
+        messages: Iterable[ChatMessage] = (),
+    ):
+        """Initialize the conversation.
+
+        Args:
+            system_msgs (Iterable[str], optional): System prompts of the shared prefix. Defaults to none.
+            messages (Iterable[ChatMessage], optional): Initial message records. Defaults to empty.
+        """
+
+        self.prefix = shared_system_prefix(tuple(system_msgs or ()))
+        self._tail = None
+        for message in messages:
+            self._tail = _Node(message, self._tail)
+
+    @classmethod
+    def from_dicts(cls, messages: Iterable[dict]) -> "Conversation":
+        """Build a conversation from OpenAI message dicts.
+
+        Leading system messages become the shared prefix.
+
+        Args:
+            messages (Iterable[dict]): Message dicts.
+
+        Returns:
+            Conversation: The conversation.
+        """
+
+        messages = list(messages)
+        head = 0
+        while (
+            head < len(messages)
+            and messages[head]["role"] == "system"
+            and "name" not in messages[head]
+        ):
+            head += 1
+        return cls(
+            [m["content"] for m in messages[:head]],
+            [ChatMessage.from_dict(m) for m in messages[head:]],
+        )
+
+    def fork(self) -> "Conversation":
+        """Branch off the conversation in O(1).
+
+        Messages appended to the fork or to this conversation afterwards are
+        not seen by the other one.
+
+        Returns:
+            Conversation: A conversation sharing the whole history.
+        """
+
+        fork = Conversation.__new__(Conversation)
+        fork.prefix = self.prefix
+        fork._tail = self._tail
+        return fork
+
+    def append(self, role: str, content: str, name: Optional[str] = None):
+        """Append a message.
+
+        Args:
+            role (str): Role of the author.
+            content (str): Text of the message.
+            name (str, optional): Name of the author. Defaults to None.
+        """
+
+        self._tail = _Node(ChatMessage(role, content, name), self._tail)
+
+    def add_user(self, content: str):
+        """Append a user message.
+
+        Args:
+            content (str): Text of the message.
+        """
+
+        self._tail = _Node(ChatMessage("user", content), self._tail)
+
+    def add_assistant(self, content: str):
+        """Append an assistant message.
+
+        Args:
+            content (str): Text of the message.
+        """
+
+        self._tail = _Node(ChatMessage("assistant", content), self._tail)
+
+    def _records(self) -> list[ChatMessage]:
+        """Get the message records after the prefix, in order (Private Method).
+
+        Returns:
+            list[ChatMessage]: The message records.
+        """
+
+        records = []
+        node = self._tail
+        while node is not None:
+            records.append(node.message)
+            node = node.parent
+        records.reverse()
+        return records
+
+    def __len__(self) -> int:
+        return len(self.prefix) + (0 if self._tail is None else self._tail.length)
+
+    def __iter__(self) -> Iterator[ChatMessage]:
+        yield from self.prefix
+        yield from self._records()
+
+    def __getitem__(self, index: int) -> ChatMessage:
+        if isinstance(index, slice):
+            return list(self)[index]
+        length = len(self)
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError("conversation index out of range")
+        if index < len(self.prefix):
+            return self.prefix[index]
+        node = self._tail
+        for _ in range(length - 1 - index):
+            node = node.parent
+        return node.message
+
+    def __repr__(self) -> str:
+        return f"Conversation({len(self)} messages)"
+
+    def to_dicts(self) -> list[dict[str, str]]:
+        """Build the OpenAI message dicts to send.
+
+        Returns:
+            list[dict[str, str]]: Fresh message dicts, in order.
+        """
+
+        return [message.to_dict() for message in self]
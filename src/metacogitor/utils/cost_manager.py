@@ -6,7 +6,12 @@
 @Desc    : This defines the Cost Manager Classes.
 """
 
-from typing import NamedTuple
+import threading
+import weakref
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Iterator, NamedTuple, Optional
+
 from metacogitor.utils.singleton import Singleton
 from metacogitor.utils.token_counter import (
     TOKEN_COSTS,
@@ -17,7 +22,7 @@ from metacogitor.utils.token_counter import (
 from metacogitor.logs import logger
 from metacogitor.config import CONFIG
 
-__ALL__ = ["Costs", "CostManager"]
+__ALL__ = ["Costs", "CostBreakdown", "CostSnapshot", "cost_scope", "CostManager"]
 
 
 class Costs(NamedTuple):
@@ -47,60 +52,327 @@ class Costs(NamedTuple):
     """The maximum budget allowed."""
 
 
+class CostBreakdown(NamedTuple):
+    """Usage and cost of the API calls of one slice of a breakdown."""
+
+    prompt_tokens: int
+    """Number of prompt tokens used."""
+
+    completion_tokens: int
+    """Number of completion tokens generated."""
+
+    cost: float
+    """Cost accrued."""
+
+    requests: int
+    """Number of API calls recorded."""
+
+
+class CostSnapshot(NamedTuple):
+    """Consistent view of the costs, broken down by model, role and tenant.
+
+    Calls made outside of a cost_scope are attributed to the role or tenant None.
+    """
+
+    total: CostBreakdown
+    """Usage and cost of all API calls."""
+
+    by_model: dict[str, CostBreakdown]
+    """Usage and cost per model."""
+
+    by_role: dict[Optional[str], CostBreakdown]
+    """Usage and cost per role."""
+
+    by_tenant: dict[Optional[str], CostBreakdown]
+    """Usage and cost per tenant."""
+
+    by_key: dict[tuple[str, Optional[str], Optional[str]], CostBreakdown]
+    """Usage and cost per (model, role, tenant)."""
+
+    total_hedges: int
+    """Number of hedged requests cancelled after losing their race."""
+
+
+_scope: ContextVar[tuple[Optional[str], Optional[str]]] = ContextVar(
+    "cost_scope", default=(None, None)
+)
+
+
+@contextmanager
+def cost_scope(
+    role: Optional[str] = None, tenant: Optional[str] = None
+) -> Iterator[None]:
+    """Attribute the costs of the API calls made in a block to a role and a tenant.
+
+    The scope follows the context: it applies to the coroutines and tasks started in the block, and
+    to the questions of BaseGPTAPI.ask_many. Nested scopes inherit the role or tenant they leave
+    unset.
+
+    Usage:
+
+        with cost_scope(role="Engineer", tenant="acme"):
+            await api.aask("hello")
+
+    Args:
+        role (str, optional): Role making the calls.
+        tenant (str, optional): Tenant billed for the calls.
+    """
+
+    current_role, current_tenant = _scope.get()
+    token = _scope.set((role or current_role, tenant or current_tenant))
+    try:
+        yield
+    finally:
+        _scope.reset(token)
+
+
+class _CostShard:
+    """Costs recorded by one thread (Private Class).
+
+    Only its thread updates a shard, so its lock is contended by reads only.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries: dict[tuple, list] = {}
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cost = 0.0
+        self.hedges = 0
+
+    def clear(self):
+        """Reset the shard."""
+
+        with self.lock:
+            self.entries.clear()
+            self.prompt_tokens = 0
+            self.completion_tokens = 0
+            self.cost = 0.0
+            self.hedges = 0
+
+    def absorb(self, other: "_CostShard"):
+        """Add the costs of another shard. The locks of both shards must be held.
+
+        Args:
+            other (_CostShard): The shard to add.
+        """
+
+        for key, entry in other.entries.items():
+            _merge(self.entries, key, entry)
+        self.prompt_tokens += other.prompt_tokens
+        self.completion_tokens += other.completion_tokens
+        self.cost += other.cost
+        self.hedges += other.hedges
+
+
+class _ShardOwner:
+    """Thread-local marker whose collection at thread exit retires the thread's shard (Private Class)."""
+
+    __slots__ = ("__weakref__",)
+
+
+def _merge(slices: dict, key, entry: list):
+    """Add an entry to a slice of a breakdown (Private Method).
+
+    Args:
+        slices (dict): Breakdown being built, of [prompt, completion, cost, requests] lists.
+        key: Key of the slice.
+        entry (list): Entry of a shard.
+    """
+
+    total = slices.setdefault(key, [0, 0, 0.0, 0])
+    for i, value in enumerate(entry):
+        total[i] += value
+
+
 class CostManager(metaclass=Singleton):
     """Manages costs incurred from using the AI assistant.
 
     This singleton class tracks the number of tokens, costs,
     and budget when making API calls to the AI assistant.
+
+    It is safe to update from many threads and coroutines. Each thread
+    records into its own shard, so updates do not contend with each other;
+    reads sum the shards. The shard of an exited thread is folded into a
+    base shard, so reads stay cheap despite thread churn. Costs are attributed to the model and to the role
+    and tenant of the current cost_scope, see snapshot for the breakdowns.
     """
 
     def __init__(self):
-        self.total_prompt_tokens = 0
+        self.total_budget = 0
+        """Total budget allowed."""
+
+        self._base = _CostShard()
+        self._shards: list[_CostShard] = [self._base]
+        self._shards_lock = threading.Lock()
+        self._local = threading.local()
+        self._current = Costs(0, 0, 0, 0)
+
+    def _shard(self) -> _CostShard:
+        """Get the shard of the calling thread, registering it on first use (Private Method).
+
+        Returns:
+            _CostShard: The shard.
+        """
+
+        shard = getattr(self._local, "shard", None)
+        if shard is None:
+            shard = self._local.shard = _CostShard()
+            owner = self._local.owner = _ShardOwner()
+            with self._shards_lock:
+                self._shards.append(shard)
+            # Thread-local values are dropped when their thread exits.
+            weakref.finalize(owner, self._retire, shard)
+        return shard
+
+    def _retire(self, shard: _CostShard):
+        """Fold the shard of an exited thread into the base shard, and drop it (Private Method).
+
+        Args:
+            shard (_CostShard): The shard.
+        """
+
+        with self._shards_lock:
+            with self._base.lock, shard.lock:
+                self._base.absorb(shard)
+            self._shards.remove(shard)
+
+    def _sum(self, name: str):
+        """Sum a total over the shards (Private Method).
+
+        Args:
+            name (str): Name of the total.
+
+        Returns:
+            The sum.
+        """
+
+        with self._shards_lock:
+            return sum(getattr(shard, name) for shard in self._shards)
+
+    @property
+    def total_prompt_tokens(self) -> int:
         """Total number of prompt tokens used."""
 
-        self.total_completion_tokens = 0
+        return self._sum("prompt_tokens")
+
+    @property
+    def total_completion_tokens(self) -> int:
         """Total number of completion tokens generated."""
 
-        self.total_cost = 0
+        return self._sum("completion_tokens")
+
+    @property
+    def total_cost(self) -> float:
         """Total cost accrued so far."""
 
-        self.total_budget = 0
-        """Total budget allowed."""
+        return self._sum("cost")
+
+    @property
+    def total_hedges(self) -> int:
+        """Total number of hedged requests cancelled after losing their race."""
+
+        return self._sum("hedges")
 
-        self.current_prompt_tokens = 0
+    @property
+    def current_prompt_tokens(self) -> int:
         """Current number of last prompt tokens used."""
 
-        self.current_completion_tokens = 0
+        return self._current.total_prompt_tokens
+
+    @property
+    def current_completion_tokens(self) -> int:
         """Current number of last completion tokens generated."""
 
-        self.current_cost = 0
+        return self._current.total_completion_tokens
+
+    @property
+    def current_cost(self) -> float:
         """Current cost of last API call."""
 
-    def update_cost(self, prompt_tokens, completion_tokens, model):
+        return self._current.total_cost
+
+    def update_cost(
+        self,
+        prompt_tokens,
+        completion_tokens,
+        model,
+        role: Optional[str] = None,
+        tenant: Optional[str] = None,
+    ):
         """Update the total cost, prompt tokens, and completion tokens.
 
         Args:
             prompt_tokens (int): Number of prompt tokens used.
             completion_tokens (int): Number of completion tokens generated.
             model (str): The AI model used.
+            role (str, optional): Role making the call. Defaults to the role of the current cost_scope.
+            tenant (str, optional): Tenant billed for the call. Defaults to the tenant of the current cost_scope.
         """
 
-        self.current_prompt_tokens = prompt_tokens
-        self.current_completion_tokens = completion_tokens
-
-        self.total_prompt_tokens += self.current_prompt_tokens
-        self.total_completion_tokens += self.current_completion_tokens
         cost = (
-            self.current_prompt_tokens * TOKEN_COSTS[model]["prompt"]
-            + self.current_completion_tokens * TOKEN_COSTS[model]["completion"]
+            prompt_tokens * TOKEN_COSTS[model]["prompt"]
+            + completion_tokens * TOKEN_COSTS[model]["completion"]
         ) / 1000
-        self.current_cost = cost
-        self.total_cost += self.current_cost
+        scope_role, scope_tenant = _scope.get()
+        key = (model, role or scope_role, tenant or scope_tenant)
+        shard = self._shard()
+        with shard.lock:
+            entry = shard.entries.get(key)
+            if entry is None:
+                entry = shard.entries[key] = [0, 0, 0.0, 0]
+            entry[0] += prompt_tokens
+            entry[1] += completion_tokens
+            entry[2] += cost
+            entry[3] += 1
+            shard.prompt_tokens += prompt_tokens
+            shard.completion_tokens += completion_tokens
+            shard.cost += cost
+            thread_cost = shard.cost
+        self._current = Costs(prompt_tokens, completion_tokens, cost, self.total_budget)
+        # The total walks every shard under the global lock; the thread's own shard is free.
         logger.info(
-            f"Total running cost: ${self.total_cost:.3f} | Max budget: ${CONFIG.max_budget:.3f} | "
+            f"Thread running cost: ${thread_cost:.3f} | Max budget: ${CONFIG.max_budget:.3f} | "
             f"Current cost: ${cost:.3f}, prompt_tokens: {prompt_tokens}, completion_tokens: {completion_tokens}"
         )
-        CONFIG.total_cost = self.total_cost
+
+    def record_hedge(
+        self,
+        prompt_tokens,
+        completion_tokens,
+        model,
+        role: Optional[str] = None,
+        tenant: Optional[str] = None,
+    ):
+        """Record the cost of a hedged request cancelled after losing its race.
+
+        A cancelled request reports no usage, but the provider still bills
+        the prompt and whatever it generated before the cancellation.
+
+        Args:
+            prompt_tokens (int): Number of prompt tokens sent.
+            completion_tokens (int): Number of completion tokens received before the cancellation.
+            model (str): The AI model used.
+            role (str, optional): Role making the call. Defaults to the role of the current cost_scope.
+            tenant (str, optional): Tenant billed for the call. Defaults to the tenant of the current cost_scope.
+        """
+
+        shard = self._shard()
+        with shard.lock:
+            shard.hedges += 1
+        if model in TOKEN_COSTS:
+            self.update_cost(prompt_tokens, completion_tokens, model, role, tenant)
+        else:
+            logger.warning(f"No token costs for {model}, hedge cost not recorded")
+
+    def get_total_hedges(self):
+        """Get the total number of cancelled hedged requests.
+
+        Returns:
+            int: Total cancelled hedged requests.
+        """
+
+        return self.total_hedges
 
     def get_total_prompt_tokens(self):
         """Get the total number of prompt tokens used.
@@ -136,10 +408,11 @@ class CostManager(metaclass=Singleton):
             Costs: Named tuple instance holding cost info.
         """
 
+        total = self.snapshot().total
         return Costs(
-            self.total_prompt_tokens,
-            self.total_completion_tokens,
-            self.total_cost,
+            total.prompt_tokens,
+            total.completion_tokens,
+            total.cost,
             self.total_budget,
         )
 
@@ -150,20 +423,55 @@ class CostManager(metaclass=Singleton):
             float: The current cost.
         """
 
-        return Costs(
-            self.current_prompt_tokens,
-            self.current_completion_tokens,
-            self.current_cost,
-            self.total_budget,
+        return self._current._replace(total_budget=self.total_budget)
+
+    def snapshot(self) -> CostSnapshot:
+        """Get a consistent view of the costs, with their breakdowns.
+
+        Each shard is copied under its lock, so a snapshot never sees half
+        of an update. Its cost grows with the number of live threads and of
+        (model, role, tenant) keys, not with the number of calls.
+
+        Returns:
+            CostSnapshot: Named tuple instance holding the totals and breakdowns.
+        """
+
+        by_key = {}
+        hedges = 0
+        with self._shards_lock:
+            for shard in self._shards:
+                with shard.lock:
+                    for key, entry in shard.entries.items():
+                        _merge(by_key, key, entry)
+                    hedges += shard.hedges
+
+        total = [0, 0, 0.0, 0]
+        by_model, by_role, by_tenant = {}, {}, {}
+        for (model, role, tenant), entry in by_key.items():
+            _merge(by_model, model, entry)
+            _merge(by_role, role, entry)
+            _merge(by_tenant, tenant, entry)
+            for i, value in enumerate(entry):
+                total[i] += value
+
+        def breakdown(slices: dict) -> dict:
+            return {key: CostBreakdown(*entry) for key, entry in slices.items()}
+
+        return CostSnapshot(
+            CostBreakdown(*total),
+            breakdown(by_model),
+            breakdown(by_role),
+            breakdown(by_tenant),
+            breakdown(by_key),
+            hedges,
         )
 
     def reset(self):
         """Reset the cost manager to initial state."""
 
-        self.total_prompt_tokens = 0
-        self.total_completion_tokens = 0
-        self.total_cost = 0
+        with self._shards_lock:
+            shards = list(self._shards)
+        for shard in shards:
+            shard.clear()
         self.total_budget = 0
-        self.current_prompt_tokens = 0
-        self.current_completion_tokens = 0
-        self.current_cost = 0
+        self._current = Costs(0, 0, 0, 0)
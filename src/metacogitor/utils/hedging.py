@@ -0,0 +1,268 @@
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 14:50
+@Author  : Joshua Magady
+@File    : hedging.py
+@Desc    : This defines the Hedger class to send hedged requests against tail latency.
+"""
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import suppress
+from typing import Any, AsyncIterator, Awaitable, Callable, NamedTuple, Optional
+
+__ALL__ = ["HedgeStats", "Hedger"]
+
+_END = object()
+"""Marker of a stream that ended before its first delta."""
+
+
+class HedgeStats(NamedTuple):
+    """Statistics of a hedger.
+
+    Attributes:
+        requests (int): Number of primary requests.
+        hedges (int): Number of hedge requests sent.
+        hedge_wins (int): Number of hedges that answered before their primary.
+        cancelled (int): Number of losing requests cancelled.
+    """
+
+    requests: int
+    """Number of primary requests."""
+
+    hedges: int
+    """Number of hedge requests sent."""
+
+    hedge_wins: int
+    """Number of hedges that answered before their primary."""
+
+    cancelled: int
+    """Number of losing requests cancelled."""
+
+
+class Hedger:
+    """Send a duplicate request when the first one is slower than usual.
+
+    The hedger keeps the latencies of recent requests. When a request has not
+    answered (or produced its first delta, for streams) within the given
+    percentile of them, a hedge request is sent, the first to answer wins and
+    the other is cancelled. Hedges are capped by a budget: at most `budget`
+    hedges per primary request overall, so hedging adds at most that
+    fraction of requests.
+
+    Usage:
+
+        hedger = Hedger(percentile=95, budget=0.05)
+        rsp = await hedger.run(lambda: api.acompletion(messages))
+    """
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        budget: float = 0.05,
+        window: int = 200,
+        min_samples: int = 20,
+        min_delay: float = 0.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialize the hedger.
+
+        Args:
+            percentile (float, optional): Percentile of recent latency after which to hedge. Defaults to 95.
+            budget (float, optional): Maximum hedges per primary request. Defaults to 0.05.
+            window (int, optional): Number of recent latencies kept. Defaults to 200.
+            min_samples (int, optional): Latencies needed before hedging starts. Defaults to 20.
+            min_delay (float, optional): Minimum seconds before hedging. Defaults to 0.
+            clock (Callable[[], float], optional): Time source. Defaults to time.monotonic.
+        """
+
+        self.percentile = percentile
+        """Percentile of recent latency after which to hedge."""
+
+        self.budget = budget
+        """Maximum hedges per primary request."""
+
+        self.min_samples = min_samples
+        """Latencies needed before hedging starts."""
+
+        self.min_delay = min_delay
+        """Minimum seconds before hedging."""
+
+        self.clock = clock
+        """Time source."""
+
+        self._latencies = deque(maxlen=window)
+        self._requests = 0
+        self._hedges = 0
+        self._hedge_wins = 0
+        self._cancelled = 0
+
+    def record_latency(self, latency: float):
+        """Record the latency of a request.
+
+        Args:
+            latency (float): Seconds until the request answered or produced its first delta.
+        """
+
+        self._latencies.append(latency)
+
+    def delay(self) -> Optional[float]:
+        """Get the delay after which a request is hedged.
+
+        Returns:
+            float: Seconds to wait for the primary request, or None until enough latencies are known.
+        """
+
+        if len(self._latencies) < self.min_samples:
+            return None
+        latencies = sorted(self._latencies)
+        rank = math.ceil(self.percentile / 100 * len(latencies)) - 1
+        return max(self.min_delay, latencies[min(max(rank, 0), len(latencies) - 1)])
+
+    def stats(self) -> HedgeStats:
+        """Get the hedging statistics.
+
+        Returns:
+            HedgeStats: Named tuple of request and hedge counters.
+        """
+
+        return HedgeStats(
+            self._requests, self._hedges, self._hedge_wins, self._cancelled
+        )
+
+    def _take_budget(self) -> bool:
+        """Reserve a hedge if the budget allows it (Private Method).
+
+        Returns:
+            bool: True if a hedge may be sent.
+        """
+
+        if self._hedges + 1 > self.budget * self._requests:
+            return False
+        self._hedges += 1
+        return True
+
+    async def race(
+        self,
+        factory: Callable[[int], Awaitable],
+        on_cancel: Optional[Callable[[int], None]] = None,
+    ) -> tuple[int, Any]:
+        """Await a request, hedging it when it is slower than the hedging delay.
+
+        Args:
+            factory (Callable[[int], Awaitable]): Factory of attempt 0 (primary) and 1 (hedge).
+            on_cancel (Callable[[int], None], optional): Called with the attempt of a cancelled loser.
+
+        Returns:
+            tuple[int, Any]: The winning attempt and its result.
+
+        Raises:
+            Exception: The error of the primary request, if every attempt failed.
+        """
+
+        self._requests += 1
+        started = {}
+        tasks = {}
+
+        def launch(attempt: int):
+            started[attempt] = self.clock()
+            tasks[attempt] = asyncio.ensure_future(factory(attempt))
+
+        winner = None
+        launch(0)
+        try:
+            delay = self.delay()
+            if delay is not None:
+                done, _ = await asyncio.wait([tasks[0]], timeout=delay)
+                if not done and self._take_budget():
+                    launch(1)
+            pending = set(tasks.values())
+            while winner is None:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for attempt, task in tasks.items():
+                    if task in done and task.exception() is None:
+                        winner = attempt
+                        break
+                else:
+                    if not pending:
+                        raise tasks[0].exception()
+            self.record_latency(self.clock() - started[winner])
+            if winner == 1:
+                self._hedge_wins += 1
+            return winner, tasks[winner].result()
+        finally:
+            cancelled = []
+            for attempt, task in tasks.items():
+                if task.done():
+                    if not task.cancelled():
+                        task.exception()  # mark as retrieved
+                    continue
+                task.cancel()
+                cancelled.append(task)
+                if winner is not None:
+                    self._cancelled += 1
+                    if on_cancel is not None:
+                        on_cancel(attempt)
+            if cancelled:
+                await asyncio.wait(cancelled)
+
+    async def run(
+        self,
+        func: Callable[[], Awaitable],
+        on_cancel: Optional[Callable[[int], None]] = None,
+    ) -> Any:
+        """Await a request, hedging it when it is slower than the hedging delay.
+
+        Args:
+            func (Callable[[], Awaitable]): Factory of the request.
+            on_cancel (Callable[[int], None], optional): Called with the attempt of a cancelled loser.
+
+        Returns:
+            Any: Result of the first request to answer.
+        """
+
+        _, result = await self.race(lambda attempt: func(), on_cancel)
+        return result
+
+    async def stream(
+        self,
+        factory: Callable[[], AsyncIterator],
+        on_cancel: Optional[Callable[[int], None]] = None,
+    ) -> AsyncIterator:
+        """Stream a request, hedging it when its first delta is slower than the hedging delay.
+
+        The streams race for their first delta; the rest of the winning stream
+        is then yielded and the losing stream is closed.
+
+        Args:
+            factory (Callable[[], AsyncIterator]): Factory of the stream.
+            on_cancel (Callable[[int], None], optional): Called with the attempt of a cancelled loser.
+
+        Returns:
+            AsyncIterator: Deltas of the winning stream.
+        """
+
+        streams = {}
+
+        async def first_delta(attempt: int):
+            stream = streams[attempt] = factory()
+            try:
+                return await stream.__anext__()
+            except StopAsyncIteration:
+                return _END
+
+        winner = None
+        try:
+            winner, delta = await self.race(first_delta, on_cancel)
+            if delta is _END:
+                return
+            yield delta
+            async for delta in streams[winner]:
+                yield delta
+        finally:
+            for stream in streams.values():
+                with suppress(Exception):
+                    await stream.aclose()
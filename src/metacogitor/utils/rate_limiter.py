@@ -3,12 +3,25 @@
 @Time    : 2023/8/18 23:08
 @Author  : Joshua Magady
 @File    : rate_limiter.py
-@Desc    : This defines the rate limiter class.
+@Desc    : This defines the rate limiter classes.
 """
 
 import asyncio
+import threading
 import time
+from collections import deque
+from typing import Callable, NamedTuple, Optional
+
 from metacogitor.logs import logger  # Import the logger module if not already done
+from metacogitor.utils.retry import get_retry_after, get_status
+
+__ALL__ = [
+    "RateLimiter",
+    "TokenBucketLimiter",
+    "AdaptiveRateLimiter",
+    "LimiterStats",
+    "FairRateLimiter",
+]
 
 
 class RateLimiter:
@@ -27,11 +40,15 @@ class RateLimiter:
         # Using 1.1 for interval calculation to account for QoS even with strict time adherence
         self.interval = 1.1 * 60 / rpm
         self.rpm = rpm
+        self._lock = threading.Lock()
 
     def split_batches(self, batch):
         """
         Split a batch into sub-batches of the specified size.
 
+        The sub-batches are built in memory. To stream work items through a limiter with a concurrency
+        bound instead, use amap_as_completed.
+
         :param batch: List to be split into sub-batches.
         :return: List of sub-batches.
         """
@@ -41,14 +58,585 @@ class RateLimiter:
         """
         Asynchronously wait if the rate limit needs to be enforced.
 
+        The call time is reserved with reserve before sleeping, so concurrent coroutines are spaced by
+        the interval instead of all waking up at once. Use FairRateLimiter to also hand slots back on
+        cancellation.
+
         :param num_requests: Number of requests made.
         """
-        current_time = time.time()
-        elapsed_time = current_time - self.last_call_time
-
-        if elapsed_time < self.interval * num_requests:
-            remaining_time = self.interval * num_requests - elapsed_time
+        remaining_time = self.reserve(num_requests)
+        if remaining_time > 0:
             logger.info(f"Sleeping for {remaining_time} seconds")
             await asyncio.sleep(remaining_time)
 
-        self.last_call_time = time.time()
+    def reserve(self, num_requests) -> float:
+        """
+        Reserve the next call time without waiting. Safe to call from many threads and tasks.
+
+        Each caller reserves its call time under a lock, so concurrent callers are spaced by the
+        interval instead of all waking up at once.
+
+        :param num_requests: Number of requests made.
+        :return: Seconds to wait before making the requests.
+        """
+        with self._lock:
+            current_time = time.time()
+            elapsed_time = current_time - self.last_call_time
+            remaining_time = max(0, self.interval * num_requests - elapsed_time)
+            self.last_call_time = current_time + remaining_time
+        return remaining_time
+
+    def wait_if_needed_sync(self, num_requests):
+        """
+        Block the calling thread if the rate limit needs to be enforced. Safe to call from many threads.
+
+        The call time is reserved with reserve, and the thread sleeps outside of the lock.
+
+        :param num_requests: Number of requests made.
+        """
+        remaining_time = self.reserve(num_requests)
+        if remaining_time > 0:
+            logger.info(f"Sleeping for {remaining_time} seconds")
+            time.sleep(remaining_time)
+
+
+class _TokenBucket:
+    """
+    Bucket refilled continuously at a rate per minute, up to its capacity (Private Class).
+
+    Charges may take the level below zero: the debt is repaid by the refill before the next admission.
+    """
+
+    def __init__(self, per_minute: float, capacity: float, now: float):
+        self.rate = per_minute / 60
+        self.capacity = capacity
+        self.level = capacity
+        self.updated = now
+
+    def refill(self, now: float):
+        """
+        Add the tokens accrued since the last update.
+
+        :param now: Current time.
+        """
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+class TokenBucketLimiter:
+    """
+    Rate control class enforcing requests per minute and tokens per minute together, the way providers
+    throttle.
+
+    Both limits are token buckets refilled continuously at the exact provider rate, so bursts up to the
+    bucket capacity go through at once and sustained throughput reaches the provider ceiling, without any
+    safety padding. A request is admitted once both buckets can pay for it: one request, and its estimated
+    prompt tokens. After the response, reconcile charges the difference with the actual usage (completion
+    tokens included), so the estimate only needs to be right on average.
+
+    Admissions are reserved under a lock, first come first served, and safe to use from many threads and
+    tasks. It can be used wherever a RateLimiter is expected.
+    """
+
+    def __init__(
+        self,
+        rpm: float,
+        tpm: Optional[float] = None,
+        burst_requests: Optional[float] = None,
+        burst_tokens: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initialize the TokenBucketLimiter instance. The buckets start full.
+
+        :param rpm: Requests per minute.
+        :param tpm: Tokens per minute. Tokens are not limited by default.
+        :param burst_requests: Capacity of the request bucket. Defaults to a minute of requests, like providers.
+        :param burst_tokens: Capacity of the token bucket. Defaults to a minute of tokens, like providers.
+        :param clock: Time source.
+        """
+        self.rpm = rpm
+        self.tpm = tpm
+        self.clock = clock
+        now = clock()
+        self._requests = _TokenBucket(rpm, burst_requests or rpm, now)
+        self._tokens = (
+            _TokenBucket(tpm, burst_tokens or tpm, now) if tpm is not None else None
+        )
+        self._lock = threading.Lock()
+
+    def available(self) -> tuple[float, Optional[float]]:
+        """
+        Get the current levels of the buckets.
+
+        :return: Requests and tokens that can be admitted now. Tokens are None when not limited.
+        """
+        with self._lock:
+            now = self.clock()
+            self._requests.refill(now)
+            if self._tokens is None:
+                return self._requests.level, None
+            self._tokens.refill(now)
+            return self._requests.level, self._tokens.level
+
+    def reserve(self, num_requests: int = 1, tokens: int = 0) -> float:
+        """
+        Admit requests without waiting: charge them now, and get the time to wait before sending them.
+
+        :param num_requests: Number of requests.
+        :param tokens: Estimated tokens of the requests.
+        :return: Seconds to wait before making the requests.
+        """
+        with self._lock:
+            now = self.clock()
+            buckets = [(self._requests, num_requests)]
+            if self._tokens is not None:
+                buckets.append((self._tokens, tokens))
+            delay = 0.0
+            for bucket, amount in buckets:
+                # Requests larger than the bucket are admitted once it is full.
+                bucket.refill(now)
+                needed = min(amount, bucket.capacity)
+                delay = max(delay, (needed - bucket.level) / bucket.rate)
+                # Charge now: later callers wait for the debt to be repaid, so they queue behind this one.
+                bucket.level -= amount
+        return delay
+
+    def reconcile(self, charged: int, actual: int):
+        """
+        Correct the tokens charged at admission with the actual usage of the response.
+
+        :param charged: Tokens charged at admission.
+        :param actual: Tokens actually used, prompt and completion.
+        """
+        if self._tokens is None:
+            return
+        with self._lock:
+            self._tokens.refill(self.clock())
+            self._tokens.level = min(
+                self._tokens.capacity, self._tokens.level + charged - actual
+            )
+
+    def record(self, error: Optional[BaseException] = None):
+        """
+        Report the outcome of an admitted request. The limits are static, so this does nothing; see
+        AdaptiveRateLimiter.
+
+        :param error: Error of a failed request, or None if it succeeded.
+        """
+
+    async def wait_if_needed(self, num_requests: int = 1, tokens: int = 0):
+        """
+        Asynchronously wait until requests are admitted.
+
+        :param num_requests: Number of requests.
+        :param tokens: Estimated tokens of the requests.
+        """
+        delay = self.reserve(num_requests, tokens)
+        if delay > 0:
+            logger.info(f"Sleeping for {delay} seconds")
+            await asyncio.sleep(delay)
+
+    def wait_if_needed_sync(self, num_requests: int = 1, tokens: int = 0):
+        """
+        Block the calling thread until requests are admitted.
+
+        :param num_requests: Number of requests.
+        :param tokens: Estimated tokens of the requests.
+        """
+        delay = self.reserve(num_requests, tokens)
+        if delay > 0:
+            logger.info(f"Sleeping for {delay} seconds")
+            time.sleep(delay)
+
+
+class AdaptiveRateLimiter(TokenBucketLimiter):
+    """
+    Token bucket limiter whose request rate adapts to provider feedback (AIMD).
+
+    While requests succeed, the allowed rate rises by `increase` requests per minute once every `cooldown`
+    seconds, a linear probe whatever the request rate. A throttled request (HTTP 429, or any error with a
+    Retry-After) cuts it by the factor `decrease`, within `min_rpm` and `max_rpm`. Throttles of requests
+    already in flight when the rate was cut are ignored for `cooldown` seconds, so one overload cuts the
+    rate once. A Retry-After also holds back admissions for its delay.
+    The rate converges to just under the provider ceiling, whatever the starting guess; `rpm` holds the
+    current effective rate. The token limit, if any, stays static.
+
+    Usage:
+
+        api.token_limiter = AdaptiveRateLimiter(rpm=60, max_rpm=3500)
+        ...
+        logger.info(f"Effective rate: {api.token_limiter.rpm} rpm")
+    """
+
+    def __init__(
+        self,
+        rpm: float,
+        tpm: Optional[float] = None,
+        min_rpm: float = 1.0,
+        max_rpm: float = 10000.0,
+        increase: float = 1.0,
+        decrease: float = 0.5,
+        cooldown: float = 1.0,
+        burst_requests: Optional[float] = None,
+        burst_tokens: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """
+        Initialize the AdaptiveRateLimiter instance.
+
+        :param rpm: Initial requests per minute.
+        :param tpm: Tokens per minute. Tokens are not limited by default.
+        :param min_rpm: Lowest rate.
+        :param max_rpm: Highest rate.
+        :param increase: Requests per minute added per `cooldown` seconds of successful requests.
+        :param decrease: Factor applied to the rate after a throttled request.
+        :param cooldown: Seconds between two increases, and after a cut during which the rate does not change again.
+        :param burst_requests: Capacity of the request bucket. Defaults to a second of requests at the current rate.
+        :param burst_tokens: Capacity of the token bucket. Defaults to a minute of tokens.
+        :param clock: Time source.
+        """
+        rpm = min(max_rpm, max(min_rpm, rpm))
+        super().__init__(rpm, tpm, burst_requests or 1, burst_tokens, clock)
+        self.min_rpm = min_rpm
+        self.max_rpm = max_rpm
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self._burst_requests = burst_requests
+        self._last_cut = None
+        self._last_increase = None
+        self._set_rpm(rpm)
+
+    def _set_rpm(self, rpm: float):
+        """
+        Change the request rate. The lock must be held, or the limiter not shared yet (Private Method).
+
+        :param rpm: New requests per minute.
+        """
+        self.rpm = min(self.max_rpm, max(self.min_rpm, rpm))
+        self._requests.refill(self.clock())
+        self._requests.rate = self.rpm / 60
+        if self._burst_requests is None:
+            self._requests.capacity = max(1.0, self.rpm / 60)
+        self._requests.level = min(self._requests.level, self._requests.capacity)
+
+    def _cooled_down(self, since: Optional[float], now: float) -> bool:
+        """
+        Check if the cooldown following a change of the rate is over (Private Method).
+
+        :param since: Time of the change, or None if the rate never changed that way.
+        :param now: Current time.
+        :return: True if the rate may change again.
+        """
+        return since is None or now - since >= self.cooldown
+
+    def record(self, error: Optional[BaseException] = None):
+        """
+        Report the outcome of an admitted request, adapting the rate.
+
+        :param error: Error of a failed request, or None if it succeeded. Errors other than throttles are ignored.
+        """
+        if error is None:
+            with self._lock:
+                now = self.clock()
+                if self._cooled_down(self._last_increase, now) and self._cooled_down(
+                    self._last_cut, now
+                ):
+                    self._last_increase = now
+                    self._set_rpm(self.rpm + self.increase)
+            return
+        retry_after = get_retry_after(error)
+        if get_status(error) != 429 and retry_after is None:
+            return
+        with self._lock:
+            now = self.clock()
+            if self._cooled_down(self._last_cut, now):
+                self._last_cut = now
+                self._set_rpm(self.rpm * self.decrease)
+                logger.info(f"Throttled, reducing the rate to {self.rpm:.1f} rpm")
+            if retry_after:
+                self._requests.level = min(
+                    self._requests.level, -retry_after * self._requests.rate
+                )
+
+
+class LimiterStats(NamedTuple):
+    """
+    Statistics of a FairRateLimiter.
+    """
+
+    queue_depth: int
+    """Number of callers currently waiting."""
+
+    max_queue_depth: int
+    """Highest number of callers waiting at once."""
+
+    granted: int
+    """Number of admissions handed out."""
+
+    cancelled: int
+    """Number of callers cancelled while waiting."""
+
+    mean_wait: float
+    """Mean seconds waited by admitted callers."""
+
+    max_wait: float
+    """Longest seconds waited by an admitted caller."""
+
+
+class FairRateLimiter:
+    """
+    Asynchronous rate control class handing out admissions strictly in arrival order.
+
+    Callers that cannot be admitted at once wait in a FIFO queue, and a single timer admits the head of
+    the queue whenever the token bucket (refilled at `rpm` per minute, holding up to `burst` requests)
+    can pay for it. Concurrent callers are therefore spaced by the interval instead of bursting together,
+    and a late caller never overtakes an earlier one. A caller cancelled while waiting leaves the queue,
+    and one cancelled after being admitted but before resuming gives its admission back, so cancellation
+    never leaks slots. The cost of each operation does not depend on the number of waiters.
+
+    Threads can wait too, with wait_if_needed_sync: they are admitted in arrival order among themselves
+    and share the bucket with the coroutines, so the limiter can serve as the token_limiter of a
+    provider called both ways. Tokens are not limited.
+
+    Usage:
+
+        limiter = FairRateLimiter(rpm=600)
+        async with limiter:
+            await api.acompletion(messages)
+    """
+
+    def __init__(
+        self,
+        rpm: float,
+        burst: float = 1,
+        clock: Optional[Callable[[], float]] = None,
+    ):
+        """
+        Initialize the FairRateLimiter instance. The bucket starts full.
+
+        :param rpm: Requests per minute.
+        :param burst: Requests admitted at once after an idle period.
+        :param clock: Time source. Defaults to the time of the running event loop.
+        """
+        self.rpm = rpm
+        self.burst = burst
+        self.clock = clock
+        self._rate = rpm / 60
+        self._level = float(burst)
+        self._updated = None
+        self._waiters = deque()
+        self._loop = None
+        self._timer = None
+        self._depth = 0
+        self._max_depth = 0
+        self._granted = 0
+        self._cancelled = 0
+        self._total_wait = 0.0
+        self._max_wait = 0.0
+        self._lock = threading.Lock()
+        self._turn = threading.Condition(self._lock)
+        self._next_ticket = 0
+        self._serving = 0
+        self._sync_depth = 0
+
+    def _now(self) -> float:
+        """
+        Get the current time (Private Method).
+
+        :return: Current time in seconds.
+        """
+        if self.clock is not None:
+            return self.clock()
+        try:
+            return asyncio.get_running_loop().time()
+        except RuntimeError:
+            # Threads waiting without an event loop use the default time of the event loops.
+            return time.monotonic()
+
+    def _refill(self, now: float):
+        """
+        Add the admissions accrued since the last update (Private Method).
+
+        :param now: Current time.
+        """
+        if self._updated is not None:
+            self._level = min(
+                self.burst, self._level + (now - self._updated) * self._rate
+            )
+        self._updated = now
+
+    def stats(self) -> LimiterStats:
+        """
+        Get the queue and wait statistics.
+
+        :return: Named tuple of queue depth, admissions, cancellations and wait times.
+        """
+        return LimiterStats(
+            self._depth,
+            self._max_depth,
+            self._granted,
+            self._cancelled,
+            self._total_wait / self._granted if self._granted else 0.0,
+            self._max_wait,
+        )
+
+    def _grant(self, amount: float, waited: float):
+        """
+        Hand out an admission (Private Method).
+
+        :param amount: Number of requests admitted.
+        :param waited: Seconds the caller waited.
+        """
+        self._level -= amount
+        self._granted += 1
+        self._total_wait += waited
+        self._max_wait = max(self._max_wait, waited)
+
+    def _dispatch(self):
+        """
+        Admit the waiters at the head of the queue that the bucket can pay for, and schedule the
+        next admission (Private Method).
+        """
+        self._timer = None
+        now = self._now()
+        waiters = self._waiters
+        with self._lock:
+            self._refill(now)
+            while waiters:
+                future, amount, enqueued = waiters[0]
+                if future.done():
+                    waiters.popleft()
+                    continue
+                if self._level < min(amount, self.burst):
+                    break
+                waiters.popleft()
+                self._depth -= 1
+                self._grant(amount, now - enqueued)
+                future.set_result(None)
+            level = self._level
+        if waiters:
+            amount = waiters[0][1]
+            delay = (min(amount, self.burst) - level) / self._rate
+            loop = asyncio.get_running_loop()
+            self._timer = loop.call_at(loop.time() + max(0.0, delay), self._dispatch)
+
+    def _wake(self):
+        """
+        Run the dispatcher at the next loop iteration, unless it is already scheduled (Private Method).
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_soon(self._dispatch)
+
+    async def acquire(self, amount: float = 1):
+        """
+        Wait for admission, in arrival order.
+
+        :param amount: Number of requests admitted. Requests larger than the burst are admitted once the bucket is full.
+        """
+        loop = asyncio.get_running_loop()
+        if loop is not self._loop:
+            # Waiters and timers of a previous event loop can never resume.
+            self._loop = loop
+            self._waiters.clear()
+            self._timer = None
+            with self._lock:
+                self._depth = self._sync_depth
+        now = self._now()
+        with self._lock:
+            self._refill(now)
+            if not self._waiters and self._level >= min(amount, self.burst):
+                self._grant(amount, 0.0)
+                return
+            self._depth += 1
+            self._max_depth = max(self._max_depth, self._depth)
+        future = loop.create_future()
+        self._waiters.append((future, amount, now))
+        if self._timer is None:
+            self._wake()
+        try:
+            await future
+        except asyncio.CancelledError:
+            with self._lock:
+                self._cancelled += 1
+                if future.cancelled():
+                    self._depth -= 1
+                else:
+                    # Admitted but cancelled before resuming: give the admission back.
+                    self._refill(self._now())
+                    self._level = min(self.burst, self._level + amount)
+                    self._granted -= 1
+            if self._waiters:
+                self._wake()
+            raise
+
+    def acquire_sync(self, amount: float = 1):
+        """
+        Block the calling thread until admission, in arrival order among the waiting threads.
+
+        :param amount: Number of requests admitted. Requests larger than the burst are admitted once the bucket is full.
+        """
+        with self._turn:
+            ticket = self._next_ticket
+            self._next_ticket += 1
+            enqueued = now = self._now()
+            self._sync_depth += 1
+            self._depth += 1
+            self._max_depth = max(self._max_depth, self._depth)
+            while True:
+                if ticket == self._serving:
+                    self._refill(now)
+                    needed = min(amount, self.burst)
+                    if self._level >= needed:
+                        break
+                    self._turn.wait((needed - self._level) / self._rate)
+                else:
+                    self._turn.wait()
+                now = self._now()
+            self._sync_depth -= 1
+            self._depth -= 1
+            self._grant(amount, now - enqueued)
+            self._serving += 1
+            self._turn.notify_all()
+
+    async def wait_if_needed(self, num_requests: int = 1, tokens: int = 0):
+        """
+        Asynchronously wait for admission, in arrival order.
+
+        :param num_requests: Number of requests made.
+        :param tokens: Estimated tokens of the requests. Ignored, tokens are not limited.
+        """
+        await self.acquire(num_requests)
+
+    def wait_if_needed_sync(self, num_requests: int = 1, tokens: int = 0):
+        """
+        Block the calling thread until admission, in arrival order among the waiting threads.
+
+        :param num_requests: Number of requests made.
+        :param tokens: Estimated tokens of the requests. Ignored, tokens are not limited.
+        """
+        self.acquire_sync(num_requests)
+
+    def reconcile(self, charged: int, actual: int):
+        """
+        Correct the token charge of admitted requests. Tokens are not limited, so this does nothing.
+
+        :param charged: Tokens charged at admission.
+        :param actual: Tokens actually used.
+        """
+
+    def record(self, error: Optional[BaseException] = None):
+        """
+        Report the outcome of an admitted request. The rate is static, so this does nothing.
+
+        :param error: Error of a failed request, or None if it succeeded.
+        """
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        return None
@@ -0,0 +1,342 @@
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 11:05
+@Author  : Joshua Magady
+@File    : response_cache.py
+@Desc    : This defines the response cache classes for provider completions.
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from pathlib import Path
+from typing import Any, Callable, NamedTuple, Optional, Union
+
+__ALL__ = [
+    "ResponseCacheStats",
+    "BaseResponseCache",
+    "MemoryResponseCache",
+    "SQLiteResponseCache",
+    "make_cache_key",
+]
+
+
+def _normalize_message(message: dict) -> dict:
+    """Normalize a message for hashing (Private Method).
+
+    Args:
+        message (dict): Message dict.
+
+    Returns:
+        dict: Message without empty values and with stripped content.
+    """
+
+    normalized = {k: v for k, v in message.items() if v is not None}
+    if isinstance(normalized.get("content"), str):
+        normalized["content"] = normalized["content"].strip()
+    return normalized
+
+
+def make_cache_key(model: str, messages: list[dict], **params) -> str:
+    """Build the cache key of a request.
+
+    The key is a SHA-256 of the canonical JSON of the model, the normalized
+    messages and the sampling parameters, so equivalent requests share a key
+    regardless of dict ordering or surrounding whitespace.
+
+    Args:
+        model (str): Name of the AI model.
+        messages (list[dict]): List of message dicts.
+        **params: Sampling parameters and other settings affecting the response.
+
+    Returns:
+        str: Hex digest identifying the request.
+    """
+
+    payload = {
+        "model": model,
+        "messages": [_normalize_message(m) for m in messages],
+        "params": params,
+    }
+    canonical = json.dumps(
+        payload, sort_keys=True, separators=(",", ":"), ensure_ascii=False
+    )
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class ResponseCacheStats(NamedTuple):
+    """Statistics of a response cache.
+
+    Attributes:
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups not found or expired.
+        evictions (int): Number of entries evicted by size or TTL.
+        size (int): Current number of cached entries.
+    """
+
+    hits: int
+    """Number of lookups served from the cache."""
+
+    misses: int
+    """Number of lookups not found or expired."""
+
+    evictions: int
+    """Number of entries evicted by size or TTL."""
+
+    size: int
+    """Current number of cached entries."""
+
+
+class BaseResponseCache(ABC):
+    """Abstract cache of provider responses with LRU and TTL eviction.
+
+    Values must be JSON serializable (response dicts or text).
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 1024,
+        ttl: Optional[float] = None,
+        clock: Callable[[], float] = time.time,
+    ):
+        """Initialize the cache.
+
+        Args:
+            maxsize (int, optional): Maximum number of entries. Defaults to 1024.
+            ttl (float, optional): Seconds an entry stays valid. Defaults to no expiry.
+            clock (Callable[[], float], optional): Time source. Defaults to time.time.
+
+        Raises:
+            ValueError: If maxsize is negative.
+        """
+
+        if maxsize < 0:
+            raise ValueError("maxsize must be at least 0")
+
+        self.maxsize = maxsize
+        """Maximum number of entries."""
+
+        self.ttl = ttl
+        """Seconds an entry stays valid, or None for no expiry."""
+
+        self.clock = clock
+        """Time source used for TTL."""
+
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _expired(self, created: float) -> bool:
+        """Check whether an entry created at the given time has expired (Private Method).
+
+        Args:
+            created (float): Creation time of the entry.
+
+        Returns:
+            bool: True if the entry is past its TTL.
+        """
+
+        return self.ttl is not None and self.clock() - created > self.ttl
+
+    @abstractmethod
+    def _get(self, key: str) -> Optional[Any]:
+        """Look up an entry, evicting it if expired. Called with the lock held."""
+
+    @abstractmethod
+    def _set(self, key: str, value: Any):
+        """Store an entry and enforce the size cap. Called with the lock held."""
+
+    @abstractmethod
+    def _size(self) -> int:
+        """Get the number of entries. Called with the lock held."""
+
+    @abstractmethod
+    def _clear(self):
+        """Remove all entries. Called with the lock held."""
+
+    def get(self, key: str) -> Optional[Any]:
+        """Look up a cached response.
+
+        Args:
+            key (str): Cache key from `make_cache_key`.
+
+        Returns:
+            Any: The cached response, or None on a miss.
+        """
+
+        with self._lock:
+            value = self._get(key)
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return value
+
+    def set(self, key: str, value: Any):
+        """Store a response.
+
+        Args:
+            key (str): Cache key from `make_cache_key`.
+            value (Any): JSON serializable response.
+        """
+
+        with self._lock:
+            self._set(key, value)
+
+    def clear(self):
+        """Remove all entries and reset the statistics."""
+
+        with self._lock:
+            self._clear()
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+
+    def stats(self) -> ResponseCacheStats:
+        """Get the cache statistics.
+
+        Returns:
+            ResponseCacheStats: Named tuple with hit/miss counters and size.
+        """
+
+        with self._lock:
+            return ResponseCacheStats(
+                self._hits, self._misses, self._evictions, self._size()
+            )
+
+
+class MemoryResponseCache(BaseResponseCache):
+    """In-memory response cache for a single process."""
+
+    def __init__(self, *args, **kwargs):
+        """Initialize the cache. Accepts the arguments of `BaseResponseCache`."""
+
+        super().__init__(*args, **kwargs)
+        self._entries = OrderedDict()
+
+    def _get(self, key: str) -> Optional[Any]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        created, value = entry
+        if self._expired(created):
+            del self._entries[key]
+            self._evictions += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def _set(self, key: str, value: Any):
+        self._entries[key] = (self.clock(), value)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self._evictions += 1
+
+    def _size(self) -> int:
+        return len(self._entries)
+
+    def _clear(self):
+        self._entries.clear()
+
+
+class SQLiteResponseCache(BaseResponseCache):
+    """On-disk response cache backed by SQLite, shared across runs.
+
+    Entries survive process restarts, so regenerations and retries after a
+    crash are served from disk. The number of entries is counted when the
+    database is opened and tracked as entries are added and removed, so
+    storing a response does not scan the table.
+    """
+
+    def __init__(self, path: Union[str, Path], *args, **kwargs):
+        """Initialize the cache.
+
+        Args:
+            path (str | Path): Path of the SQLite database file.
+            *args: Arguments of `BaseResponseCache`.
+            **kwargs: Keyword arguments of `BaseResponseCache`.
+        """
+
+        super().__init__(*args, **kwargs)
+
+        self.path = Path(path)
+        """Path of the SQLite database file."""
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            "created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed ON responses (accessed)"
+        )
+        self._conn.commit()
+        self._count = self._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def _get(self, key: str) -> Optional[Any]:
+        row = self._conn.execute(
+            "SELECT value, created FROM responses WHERE key = ?", (key,)
+        ).fetchone()
+        if row is None:
+            return None
+        value, created = row
+        if self._expired(created):
+            self._count -= self._conn.execute(
+                "DELETE FROM responses WHERE key = ?", (key,)
+            ).rowcount
+            self._conn.commit()
+            self._evictions += 1
+            return None
+        self._conn.execute(
+            "UPDATE responses SET accessed = ? WHERE key = ?", (self.clock(), key)
+        )
+        self._conn.commit()
+        return json.loads(value)
+
+    def _set(self, key: str, value: Any):
+        now = self.clock()
+        value = json.dumps(value)
+        updated = self._conn.execute(
+            "UPDATE responses SET value = ?, created = ?, accessed = ? WHERE key = ?",
+            (value, now, now, key),
+        ).rowcount
+        if not updated:
+            # Only a new key can grow the table past the cap.
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, created, accessed) "
+                "VALUES (?, ?, ?, ?)",
+                (key, value, now, now),
+            )
+            self._count += 1
+            excess = self._count - self.maxsize
+            if excess > 0:
+                evicted = self._conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed, rowid LIMIT ?)",
+                    (excess,),
+                ).rowcount
+                self._count -= evicted
+                self._evictions += evicted
+        self._conn.commit()
+
+    def _size(self) -> int:
+        return self._count
+
+    def _clear(self):
+        self._conn.execute("DELETE FROM responses")
+        self._conn.commit()
+        self._count = 0
+
+    def close(self):
+        """Close the database connection."""
+
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,524 @@
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 14:10
+@Author  : Joshua Magady
+@File    : retry.py
+@Desc    : This defines the retry engine and circuit breaker for provider calls.
+"""
+import asyncio
+import random
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, NamedTuple, Optional
+
+from metacogitor.exceptions import CircuitOpenException, ContextOverflowException
+from metacogitor.logs import logger
+
+__ALL__ = [
+    "RetryPolicy",
+    "CircuitBreaker",
+    "RetryStats",
+    "RetryEngine",
+    "get_status",
+    "get_retry_after",
+]
+
+SAFE_RETRY_STATUSES = frozenset({408, 425, 429, 503})
+"""Statuses returned before the provider processed the request, always safe to retry."""
+
+UNSAFE_RETRY_STATUSES = frozenset({500, 502, 504})
+"""Statuses where the provider may have processed the request, only retried when idempotent."""
+
+
+def get_status(error: BaseException) -> Optional[int]:
+    """Get the HTTP status of a provider error.
+
+    Supports ProviderException and the status attributes of common HTTP
+    clients (`http_status`, `status_code`, `status`).
+
+    Args:
+        error (BaseException): The error.
+
+    Returns:
+        int: HTTP status, or None if the error carries none.
+    """
+
+    for attribute in ("status", "http_status", "status_code"):
+        status = getattr(error, attribute, None)
+        if isinstance(status, int):
+            return status
+    return None
+
+
+def get_retry_after(error: BaseException) -> Optional[float]:
+    """Get the delay a provider asked to wait before retrying.
+
+    Reads the `retry_after` attribute, or the Retry-After header of errors
+    carrying response headers.
+
+    Args:
+        error (BaseException): The error.
+
+    Returns:
+        float: Seconds to wait, or None if the provider gave no delay.
+    """
+
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is None:
+        headers = getattr(error, "headers", None) or {}
+        try:
+            retry_after = headers.get("retry-after") or headers.get("Retry-After")
+        except AttributeError:
+            return None
+    try:
+        return max(0.0, float(retry_after)) if retry_after is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """Retry policy of provider calls.
+
+    Delays grow exponentially with full jitter: the delay before retry n is
+    drawn uniformly from [0, min(max_delay, base_delay * multiplier ** n)],
+    which spreads the retries of many clients instead of synchronizing them.
+    A Retry-After given by the provider takes precedence, up to
+    max_retry_after.
+    """
+
+    max_attempts: int = 4
+    """Maximum number of attempts, including the first call."""
+
+    base_delay: float = 0.5
+    """Upper bound of the first retry delay, in seconds."""
+
+    max_delay: float = 30.0
+    """Upper bound of any backoff delay, in seconds."""
+
+    multiplier: float = 2.0
+    """Growth factor of the backoff bound per retry."""
+
+    max_retry_after: float = 60.0
+    """Longest Retry-After honoured; longer requests give up instead of blocking."""
+
+    def backoff(self, retry: int, rng: Callable[[], float] = random.random) -> float:
+        """Get the jittered backoff delay before a retry.
+
+        Args:
+            retry (int): Number of the retry, starting at 0.
+            rng (Callable[[], float], optional): Uniform [0, 1) source. Defaults to random.random.
+
+        Returns:
+            float: Delay in seconds.
+        """
+
+        return rng() * min(self.max_delay, self.base_delay * self.multiplier**retry)
+
+    def is_retryable(self, error: BaseException, idempotent: bool = True) -> bool:
+        """Classify an error as retryable.
+
+        Rate limits, timeouts before processing and unavailability are always
+        retried. Errors where the provider may have processed the request
+        (500, 502, 504, timeouts and dropped connections) are only retried for
+        idempotent calls. Client errors are never retried.
+
+        Args:
+            error (BaseException): The error.
+            idempotent (bool, optional): Whether repeating the call is safe. Defaults to True.
+
+        Returns:
+            bool: True if the call should be retried.
+        """
+
+        if isinstance(error, (CircuitOpenException, ContextOverflowException)):
+            return False
+        status = get_status(error)
+        if status is not None:
+            if status in SAFE_RETRY_STATUSES:
+                return True
+            return idempotent and status in UNSAFE_RETRY_STATUSES
+        if isinstance(error, ConnectionRefusedError):
+            return True
+        if isinstance(error, (TimeoutError, asyncio.TimeoutError, ConnectionError)):
+            return idempotent
+        return False
+
+    def delay(
+        self,
+        retry: int,
+        error: BaseException,
+        rng: Callable[[], float] = random.random,
+    ) -> Optional[float]:
+        """Get the delay before a retry.
+
+        Args:
+            retry (int): Number of the retry, starting at 0.
+            error (BaseException): The error of the failed attempt.
+            rng (Callable[[], float], optional): Uniform [0, 1) source. Defaults to random.random.
+
+        Returns:
+            float: Delay in seconds, or None if the requested Retry-After is too long to wait.
+        """
+
+        retry_after = get_retry_after(error)
+        if retry_after is None:
+            return self.backoff(retry, rng)
+        if retry_after > self.max_retry_after:
+            return None
+        return retry_after
+
+
+class CircuitBreaker:
+    """Circuit breaker of one provider endpoint.
+
+    After `failure_threshold` consecutive failures the circuit opens and calls
+    fail fast with CircuitOpenException instead of waiting on a provider that
+    is down. After `reset_timeout` seconds a single probe call is let through
+    (half-open); its success closes the circuit, its failure opens it again.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        """Initialize the circuit breaker.
+
+        Args:
+            failure_threshold (int, optional): Consecutive failures opening the circuit. Defaults to 5.
+            reset_timeout (float, optional): Seconds before a probe call is let through. Defaults to 30.
+            clock (Callable[[], float], optional): Time source. Defaults to time.monotonic.
+        """
+
+        self.failure_threshold = failure_threshold
+        """Consecutive failures opening the circuit."""
+
+        self.reset_timeout = reset_timeout
+        """Seconds the circuit stays open before a probe call is let through."""
+
+        self.clock = clock
+        """Time source."""
+
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+
+    @property
+    def state(self) -> str:
+        """Get the state of the circuit: closed, open or half_open."""
+
+        with self._lock:
+            if (
+                self._state == self.OPEN
+                and self.clock() - self._opened_at >= self.reset_timeout
+            ):
+                return self.HALF_OPEN
+            return self._state
+
+    def allow(self, endpoint: Optional[str] = None):
+        """Check that a call may be sent.
+
+        Args:
+            endpoint (str, optional): Endpoint name used in the error. Defaults to None.
+
+        Raises:
+            CircuitOpenException: If the circuit is open, or half-open with a probe in flight.
+        """
+
+        with self._lock:
+            if self._state == self.CLOSED:
+                return
+            remaining = self._opened_at + self.reset_timeout - self.clock()
+            if remaining <= 0 and not self._probing:
+                self._state = self.HALF_OPEN
+                self._probing = True
+                return
+        raise CircuitOpenException(
+            code=503,
+            message=f"Circuit of {endpoint or 'endpoint'} is open",
+            retry_after=max(0.0, remaining),
+            endpoint=endpoint,
+        )
+
+    def release(self):
+        """Release the probe slot of a call that was cancelled before it completed."""
+
+        with self._lock:
+            self._probing = False
+
+    def record_success(self):
+        """Record a successful call, closing the circuit."""
+
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        """Record a failed call, opening the circuit past the threshold or after a failed probe."""
+
+        with self._lock:
+            self._failures += 1
+            if (
+                self._state == self.HALF_OPEN
+                or self._failures >= self.failure_threshold
+            ):
+                self._state = self.OPEN
+                self._opened_at = self.clock()
+            self._probing = False
+
+
+class RetryStats(NamedTuple):
+    """Statistics of a retry engine.
+
+    Attributes:
+        calls (int): Number of calls made through the engine.
+        retries (int): Number of retried attempts.
+        failures (int): Number of calls that failed after their last attempt.
+        short_circuits (int): Number of calls rejected by an open circuit.
+    """
+
+    calls: int
+    """Number of calls made through the engine."""
+
+    retries: int
+    """Number of retried attempts."""
+
+    failures: int
+    """Number of calls that failed after their last attempt."""
+
+    short_circuits: int
+    """Number of calls rejected by an open circuit."""
+
+
+class RetryEngine:
+    """Retry provider calls with backoff, behind per-endpoint circuit breakers.
+
+    Usage:
+
+        engine = RetryEngine(RetryPolicy(max_attempts=5))
+        rsp = engine.call(lambda: api.completion(messages), endpoint="openai")
+        rsp = await engine.acall(lambda: api.acompletion(messages), endpoint="openai")
+    """
+
+    def __init__(
+        self,
+        policy: Optional[RetryPolicy] = None,
+        failure_threshold: int = 5,
+        reset_timeout: float = 30.0,
+        clock: Callable[[], float] = time.monotonic,
+        rng: Callable[[], float] = random.random,
+    ):
+        """Initialize the retry engine.
+
+        Args:
+            policy (RetryPolicy, optional): Retry policy. Defaults to RetryPolicy().
+            failure_threshold (int, optional): Consecutive failures opening a circuit. Defaults to 5.
+            reset_timeout (float, optional): Seconds before an open circuit lets a probe through. Defaults to 30.
+            clock (Callable[[], float], optional): Time source of the circuit breakers. Defaults to time.monotonic.
+            rng (Callable[[], float], optional): Uniform [0, 1) source of the jitter. Defaults to random.random.
+        """
+
+        self.policy = policy or RetryPolicy()
+        """Retry policy."""
+
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.rng = rng
+
+        self._lock = threading.Lock()
+        self._breakers = {}
+        self._calls = 0
+        self._retries = 0
+        self._failures = 0
+        self._short_circuits = 0
+
+    def breaker(self, endpoint: str) -> CircuitBreaker:
+        """Get the circuit breaker of an endpoint, creating it on first use.
+
+        Args:
+            endpoint (str): Endpoint name.
+
+        Returns:
+            CircuitBreaker: The endpoint's circuit breaker.
+        """
+
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(
+                    self.failure_threshold, self.reset_timeout, self.clock
+                )
+            return breaker
+
+    def stats(self) -> RetryStats:
+        """Get the engine statistics.
+
+        Returns:
+            RetryStats: Named tuple of call, retry and failure counters.
+        """
+
+        with self._lock:
+            return RetryStats(
+                self._calls, self._retries, self._failures, self._short_circuits
+            )
+
+    def _count(self, counter: str):
+        """Increment a statistics counter (Private Method).
+
+        Args:
+            counter (str): Name of the counter attribute.
+        """
+
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _admit(self, breaker: CircuitBreaker, endpoint: str):
+        """Check the circuit before an attempt, counting rejections (Private Method).
+
+        Args:
+            breaker (CircuitBreaker): Circuit breaker of the endpoint.
+            endpoint (str): Endpoint name.
+
+        Raises:
+            CircuitOpenException: If the circuit is open.
+        """
+
+        try:
+            breaker.allow(endpoint)
+        except CircuitOpenException:
+            self._count("_short_circuits")
+            raise
+
+    def _next_delay(
+        self,
+        attempt: int,
+        error: Exception,
+        breaker: CircuitBreaker,
+        endpoint: str,
+        idempotent: bool,
+    ) -> float:
+        """Record a failed attempt and get the delay before the next one (Private Method).
+
+        Args:
+            attempt (int): Number of the failed attempt, starting at 0.
+            error (Exception): Error of the attempt.
+            breaker (CircuitBreaker): Circuit breaker of the endpoint.
+            endpoint (str): Endpoint name.
+            idempotent (bool): Whether repeating the call is safe.
+
+        Returns:
+            float: Seconds to wait before retrying.
+
+        Raises:
+            Exception: The error itself, when the call should not be retried.
+        """
+
+        if not self.policy.is_retryable(error, idempotent):
+            status = get_status(error)
+            if status is None or status >= 500:
+                breaker.record_failure()
+            else:
+                breaker.record_success()  # the endpoint answered
+            self._count("_failures")
+            raise error
+        breaker.record_failure()
+        delay = None
+        if attempt + 1 < self.policy.max_attempts:
+            delay = self.policy.delay(attempt, error, self.rng)
+        if delay is None:
+            self._count("_failures")
+            raise error
+        self._count("_retries")
+        logger.warning(
+            f"Retrying {endpoint} in {delay:.2f}s after attempt {attempt + 1} failed: {error!r}"
+        )
+        return delay
+
+    def call(
+        self,
+        func: Callable[[], Any],
+        endpoint: str = "default",
+        idempotent: bool = True,
+    ) -> Any:
+        """Call a function, retrying failures.
+
+        Args:
+            func (Callable[[], Any]): The provider call.
+            endpoint (str, optional): Endpoint name selecting the circuit breaker. Defaults to "default".
+            idempotent (bool, optional): Whether repeating the call is safe. Defaults to True.
+
+        Returns:
+            Any: Result of the call.
+
+        Raises:
+            CircuitOpenException: If the endpoint's circuit is open.
+            Exception: The last error, when retries are exhausted or the error is not retryable.
+        """
+
+        self._count("_calls")
+        breaker = self.breaker(endpoint)
+        attempt = 0
+        while True:
+            self._admit(breaker, endpoint)
+            try:
+                result = func()
+            except Exception as e:
+                time.sleep(self._next_delay(attempt, e, breaker, endpoint, idempotent))
+                attempt += 1
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return result
+
+    async def acall(
+        self,
+        func: Callable[[], Awaitable[Any]],
+        endpoint: str = "default",
+        idempotent: bool = True,
+    ) -> Any:
+        """Asynchronously call a coroutine function, retrying failures.
+
+        Args:
+            func (Callable[[], Awaitable]): Factory of the provider call.
+            endpoint (str, optional): Endpoint name selecting the circuit breaker. Defaults to "default".
+            idempotent (bool, optional): Whether repeating the call is safe. Defaults to True.
+
+        Returns:
+            Any: Result of the call.
+
+        Raises:
+            CircuitOpenException: If the endpoint's circuit is open.
+            Exception: The last error, when retries are exhausted or the error is not retryable.
+        """
+
+        self._count("_calls")
+        breaker = self.breaker(endpoint)
+        attempt = 0
+        while True:
+            self._admit(breaker, endpoint)
+            try:
+                result = await func()
+            except Exception as e:
+                await asyncio.sleep(
+                    self._next_delay(attempt, e, breaker, endpoint, idempotent)
+                )
+                attempt += 1
+                continue
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return result
@@ -0,0 +1,598 @@
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 19:20
+@Author  : Joshua Magady
+@File    : shared_rate_limiter.py
+@Desc    : This defines the rate limiter shared by worker processes and its bucket stores.
+"""
+import asyncio
+import json
+import os
+import socket
+import socketserver
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import Callable, Optional, Union
+from urllib.parse import urlparse
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover - not available on Windows
+    fcntl = None
+
+from metacogitor.logs import logger
+
+__ALL__ = [
+    "BaseBucketStore",
+    "MemoryBucketStore",
+    "FileBucketStore",
+    "NetworkBucketStore",
+    "BucketStoreServer",
+    "SharedRateLimiter",
+    "make_bucket_store",
+]
+
+Bucket = tuple[str, float, float, float]
+"""Charge of a bucket: key, amount, refill rate per second and capacity."""
+
+
+def _charge(
+    state: Optional[list], amount: float, rate: float, capacity: float, now: float
+) -> tuple[list, float]:
+    """Refill a bucket and charge an amount (Private Method).
+
+    Args:
+        state (list): Level and update time of the bucket, or None for a new (full) bucket.
+        amount (float): Amount charged. Negative amounts are refunds.
+        rate (float): Refill rate per second.
+        capacity (float): Capacity of the bucket.
+        now (float): Current time.
+
+    Returns:
+        tuple[list, float]: The new state, and the seconds to wait before the charge is admitted.
+    """
+
+    level, updated = state if state is not None else (capacity, now)
+    level = min(capacity, level + max(0.0, now - updated) * rate)
+    if amount <= 0:
+        return [min(capacity, level - amount), now], 0.0
+    # Amounts larger than the bucket are admitted once it is full.
+    delay = max(0.0, (min(amount, capacity) - level) / rate)
+    return [level - amount, now], delay
+
+
+class BaseBucketStore(ABC):
+    """Store of token buckets shared by rate limiters.
+
+    Subclasses hold the bucket states somewhere every worker can reach and
+    implement `_take`, which must refill and charge the given buckets
+    atomically: every worker charging the same keys then shares one budget.
+    """
+
+    def __init__(self, clock: Callable[[], float] = time.time):
+        """Initialize the store.
+
+        Args:
+            clock (Callable[[], float], optional): Time source, shared by the workers. Defaults to time.time.
+        """
+
+        self.clock = clock
+        """Time source, shared by the workers."""
+
+    @staticmethod
+    def _apply(states: dict, buckets: list[Bucket], now: float) -> tuple[float, list]:
+        """Charge buckets held in a dict of states (Private Method).
+
+        Args:
+            states (dict): Bucket states by key, updated in place.
+            buckets (list[Bucket]): Charges of the buckets.
+            now (float): Current time.
+
+        Returns:
+            tuple[float, list]: Seconds to wait, and the levels of the buckets after the charges.
+        """
+
+        delay = 0.0
+        levels = []
+        for key, amount, rate, capacity in buckets:
+            states[key], wait = _charge(states.get(key), amount, rate, capacity, now)
+            delay = max(delay, wait)
+            levels.append(states[key][0])
+        return delay, levels
+
+    @abstractmethod
+    def _take(self, buckets: list[Bucket]) -> tuple[float, list]:
+        """Refill and charge buckets atomically (Private Method).
+
+        Args:
+            buckets (list[Bucket]): Charges of the buckets.
+
+        Returns:
+            tuple[float, list]: Seconds to wait, and the levels of the buckets after the charges.
+        """
+
+    def take(self, buckets: list[Bucket]) -> tuple[float, list]:
+        """Refill and charge buckets atomically, creating them full on first use.
+
+        Args:
+            buckets (list[Bucket]): Charges of the buckets: key, amount (negative to refund),
+                refill rate per second and capacity.
+
+        Returns:
+            tuple[float, list]: Seconds to wait before the charges are admitted, and the levels of
+                the buckets after them.
+        """
+
+        return self._take(list(buckets))
+
+    def close(self):
+        """Release the resources of the store."""
+
+
+class MemoryBucketStore(BaseBucketStore):
+    """Bucket store shared by the threads of one process."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def _take(self, buckets: list[Bucket]) -> tuple[float, list]:
+        with self._lock:
+            return self._apply(self._states, buckets, self.clock())
+
+
+class FileBucketStore(BaseBucketStore):
+    """Bucket store shared by the processes of one host through a locked file.
+
+    Each charge locks the file with flock, reads the bucket states, updates
+    them and writes them back. The default file lives in /dev/shm when
+    available, so it never touches the disk.
+    """
+
+    def __init__(self, path: Optional[Union[str, Path]] = None, *args, **kwargs):
+        """Initialize the store.
+
+        Args:
+            path (Union[str, Path], optional): Path of the state file. Defaults to a file in /dev/shm,
+                or in the temporary directory.
+
+        Raises:
+            RuntimeError: If file locking is not supported on the platform.
+        """
+
+        super().__init__(*args, **kwargs)
+        if fcntl is None:
+            raise RuntimeError("FileBucketStore needs fcntl file locking")
+        if path is None:
+            directory = (
+                "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+            )
+            path = Path(directory) / "metacogitor-rate-limits.json"
+        self.path = Path(path)
+        """Path of the state file."""
+
+        self._fd = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _file(self) -> int:
+        """Get the descriptor of the state file, opened once per process (Private Method).
+
+        Locks are held by open files, so a forked worker opens its own.
+
+        Returns:
+            int: File descriptor.
+        """
+
+        if self._pid != os.getpid():
+            self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+            self._pid = os.getpid()
+        return self._fd
+
+    def _take(self, buckets: list[Bucket]) -> tuple[float, list]:
+        with self._lock:
+            fd = self._file()
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                data = os.pread(fd, os.fstat(fd).st_size, 0)
+                try:
+                    states = json.loads(data) if data else {}
+                except ValueError:
+                    logger.warning(f"Resetting corrupt rate limit state {self.path}")
+                    states = {}
+                result = self._apply(states, buckets, self.clock())
+                data = json.dumps(states, separators=(",", ":")).encode()
+                os.pwrite(fd, data, 0)
+                os.ftruncate(fd, len(data))
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        return result
+
+    def close(self):
+        with self._lock:
+            if self._fd is not None and self._pid == os.getpid():
+                os.close(self._fd)
+            self._fd = self._pid = None
+
+
+class NetworkBucketStore(BaseBucketStore):
+    """Bucket store shared by the workers of many hosts through a network server.
+
+    Charges are sent as JSON lines over one persistent connection per
+    process, and the server applies them atomically with its own clock, so
+    the clocks of the workers do not matter. BucketStoreServer is such a
+    server; other stores (e.g. a database) can be plugged in by subclassing
+    BaseBucketStore.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 5.0, *args, **kwargs):
+        """Initialize the store.
+
+        Args:
+            host (str): Host of the server.
+            port (int): Port of the server.
+            timeout (float, optional): Seconds allowed for a round trip. Defaults to 5.
+        """
+
+        super().__init__(*args, **kwargs)
+        self.address = (host, port)
+        """Address of the server."""
+
+        self.timeout = timeout
+        """Seconds allowed for a round trip."""
+
+        self._connection = None
+        self._pid = None
+        self._lock = threading.Lock()
+
+    def _connect(self):
+        """Get the connection of this process, opening it on first use (Private Method).
+
+        Returns:
+            tuple: Socket and its file for reading lines.
+        """
+
+        if self._connection is None or self._pid != os.getpid():
+            sock = socket.create_connection(self.address, timeout=self.timeout)
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            self._connection = sock, sock.makefile("rb")
+            self._pid = os.getpid()
+        return self._connection
+
+    def _take(self, buckets: list[Bucket]) -> tuple[float, list]:
+        request = json.dumps({"take": buckets}).encode() + b"\n"
+        with self._lock:
+            for attempt in range(2):
+                reused = self._connection is not None and self._pid == os.getpid()
+                try:
+                    sock, reader = self._connect()
+                    sock.sendall(request)
+                    line = reader.readline()
+                    if not line:
+                        raise ConnectionError(
+                            "Bucket store server closed the connection"
+                        )
+                    break
+                except TimeoutError:
+                    # The server may have applied the charge: sending it again could charge twice.
+                    self._disconnect()
+                    raise
+                except OSError:
+                    # A reused connection may have been closed by the server while idle.
+                    self._disconnect()
+                    if attempt or not reused:
+                        raise
+        response = json.loads(line)
+        if "error" in response:
+            raise ValueError(response["error"])
+        return response["delay"], response["levels"]
+
+    def _disconnect(self):
+        """Close the connection (Private Method)."""
+
+        if self._connection is not None and self._pid == os.getpid():
+            sock, reader = self._connection
+            reader.close()
+            sock.close()
+        self._connection = self._pid = None
+
+    def close(self):
+        with self._lock:
+            self._disconnect()
+
+
+class _BucketStoreHandler(socketserver.StreamRequestHandler):
+    """Handler of one bucket store connection (Private Class)."""
+
+    def handle(self):
+        store = self.server.store
+        for line in self.rfile:
+            try:
+                delay, levels = store.take(
+                    [tuple(bucket) for bucket in json.loads(line)["take"]]
+                )
+                response = {"delay": delay, "levels": levels}
+            except (ValueError, KeyError, TypeError) as e:
+                response = {"error": repr(e)}
+            self.wfile.write(json.dumps(response).encode() + b"\n")
+            self.wfile.flush()
+
+
+class BucketStoreServer:
+    """Network server of a bucket store, for NetworkBucketStore clients.
+
+    Usage:
+
+        with BucketStoreServer() as server:
+            store = NetworkBucketStore(*server.address)
+    """
+
+    def __init__(
+        self,
+        store: Optional[BaseBucketStore] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        """Initialize the server.
+
+        Args:
+            store (BaseBucketStore, optional): Store served. Defaults to a new MemoryBucketStore.
+            host (str, optional): Host to listen on. Defaults to 127.0.0.1.
+            port (int, optional): Port to listen on. Defaults to a free port.
+        """
+
+        self.store = store or MemoryBucketStore()
+        """Store served."""
+
+        self._server = socketserver.ThreadingTCPServer(
+            (host, port), _BucketStoreHandler
+        )
+        self._server.daemon_threads = True
+        self._server.store = self.store
+        self._thread = None
+
+    @property
+    def address(self) -> tuple[str, int]:
+        """Host and port the server listens on."""
+
+        return self._server.server_address[:2]
+
+    def start(self) -> "BucketStoreServer":
+        """Serve in a background thread.
+
+        Returns:
+            BucketStoreServer: The server.
+        """
+
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """Stop serving."""
+
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.stop()
+
+
+def make_bucket_store(url: str) -> BaseBucketStore:
+    """Build a bucket store from its URL.
+
+    Supported URLs are "memory://", "file://" (default file) or
+    "file:///path/to/file", and "tcp://host:port".
+
+    Args:
+        url (str): URL of the store.
+
+    Returns:
+        BaseBucketStore: The store.
+
+    Raises:
+        ValueError: If the URL scheme is not supported.
+    """
+
+    parsed = urlparse(url)
+    if parsed.scheme == "memory":
+        return MemoryBucketStore()
+    if parsed.scheme == "file":
+        return FileBucketStore(parsed.path or None)
+    if parsed.scheme == "tcp":
+        return NetworkBucketStore(parsed.hostname, parsed.port)
+    raise ValueError(f"Unsupported bucket store {url!r}")
+
+
+class SharedRateLimiter:
+    """Rate limiter enforcing one budget of requests and tokens per minute across workers.
+
+    It works like TokenBucketLimiter, but the buckets live in a bucket store
+    shared by every worker using the same key, so N worker processes (or
+    hosts) together stay within the quota of one API key instead of N times
+    it. Each admission costs one atomic charge of the store.
+
+    Usage:
+
+        limiter = SharedRateLimiter(FileBucketStore(), "openai:sk-...", rpm=3500, tpm=90000)
+        api.token_limiter = limiter
+    """
+
+    def __init__(
+        self,
+        store: BaseBucketStore,
+        key: str,
+        rpm: float,
+        tpm: Optional[float] = None,
+        burst_requests: Optional[float] = None,
+        burst_tokens: Optional[float] = None,
+    ):
+        """Initialize the limiter.
+
+        Args:
+            store (BaseBucketStore): Store shared by the workers.
+            key (str): Name of the shared budget, e.g. one per API key.
+            rpm (float): Requests per minute of all workers together.
+            tpm (float, optional): Tokens per minute of all workers together. Defaults to no limit.
+            burst_requests (float, optional): Capacity of the request bucket. Defaults to a minute of requests.
+            burst_tokens (float, optional): Capacity of the token bucket. Defaults to a minute of tokens.
+        """
+
+        self.store = store
+        """Store shared by the workers."""
+
+        self.key = key
+        """Name of the shared budget."""
+
+        self.rpm = rpm
+        """Requests per minute of all workers together."""
+
+        self.tpm = tpm
+        """Tokens per minute of all workers together."""
+
+        self._requests = (f"{key}:requests", rpm / 60, burst_requests or rpm)
+        self._tokens = (
+            (f"{key}:tokens", tpm / 60, burst_tokens or tpm)
+            if tpm is not None
+            else None
+        )
+
+    @classmethod
+    def from_config(cls, key: Optional[str] = None) -> "SharedRateLimiter":
+        """Build the limiter of the configured API key.
+
+        The store is RATE_LIMIT_STORE (default: the host file store) and the
+        budget is RPM and TPM.
+
+        Args:
+            key (str, optional): Name of the shared budget. Defaults to one derived from the API key.
+
+        Returns:
+            SharedRateLimiter: The limiter.
+        """
+
+        from metacogitor.config import CONFIG
+
+        store = make_bucket_store(CONFIG.rate_limit_store or "file://")
+        if key is None:
+            key = f"openai:{(CONFIG.openai_api_key or '')[-8:]}"
+        tpm = CONFIG.openai_api_tpm
+        return cls(
+            store,
+            key,
+            float(CONFIG.openai_api_rpm),
+            float(tpm) if tpm is not None else None,
+        )
+
+    def _buckets(self, num_requests: float, tokens: float) -> list[Bucket]:
+        """Get the charges of an admission (Private Method).
+
+        Args:
+            num_requests (float): Number of requests.
+            tokens (float): Estimated tokens.
+
+        Returns:
+            list[Bucket]: Charges of the buckets.
+        """
+
+        buckets = [(self._requests[0], num_requests, *self._requests[1:])]
+        if self._tokens is not None:
+            buckets.append((self._tokens[0], tokens, *self._tokens[1:]))
+        return buckets
+
+    def available(self) -> tuple[float, Optional[float]]:
+        """Get the current levels of the shared buckets.
+
+        Returns:
+            tuple[float, Optional[float]]: Requests and tokens that can be admitted now. Tokens are
+                None when not limited.
+        """
+
+        _, levels = self.store.take(self._buckets(0, 0))
+        return levels[0], levels[1] if self._tokens is not None else None
+
+    def reserve(self, num_requests: int = 1, tokens: int = 0) -> float:
+        """Admit requests without waiting: charge them now, and get the time to wait before sending them.
+
+        Args:
+            num_requests (int, optional): Number of requests. Defaults to 1.
+            tokens (int, optional): Estimated tokens of the requests. Defaults to 0.
+
+        Returns:
+            float: Seconds to wait before making the requests.
+        """
+
+        delay, _ = self.store.take(self._buckets(num_requests, tokens))
+        return delay
+
+    def reconcile(self, charged: int, actual: int):
+        """Correct the tokens charged at admission with the actual usage of the response.
+
+        Args:
+            charged (int): Tokens charged at admission.
+            actual (int): Tokens actually used, prompt and completion.
+        """
+
+        if self._tokens is None or charged == actual:
+            return
+        self.store.take([(self._tokens[0], actual - charged, *self._tokens[1:])])
+
+    async def areconcile(self, charged: int, actual: int):
+        """Asynchronously correct the tokens charged at admission with the actual usage of the response.
+
+        The store is charged on a worker thread, as file locks and network
+        round trips block.
+
+        Args:
+            charged (int): Tokens charged at admission.
+            actual (int): Tokens actually used, prompt and completion.
+        """
+
+        if self._tokens is None or charged == actual:
+            return
+        await asyncio.to_thread(self.reconcile, charged, actual)
+
+    def record(self, error: Optional[BaseException] = None):
+        """Report the outcome of an admitted request. The limits are static, so this does nothing.
+
+        Args:
+            error (BaseException, optional): Error of a failed request, or None if it succeeded.
+        """
+
+    async def wait_if_needed(self, num_requests: int = 1, tokens: int = 0):
+        """Asynchronously wait until requests are admitted.
+
+        The store is charged on a worker thread, as file locks and network
+        round trips block.
+
+        Args:
+            num_requests (int, optional): Number of requests. Defaults to 1.
+            tokens (int, optional): Estimated tokens of the requests. Defaults to 0.
+        """
+
+        delay = await asyncio.to_thread(self.reserve, num_requests, tokens)
+        if delay > 0:
+            logger.info(f"Sleeping for {delay} seconds")
+            await asyncio.sleep(delay)
+
+    def wait_if_needed_sync(self, num_requests: int = 1, tokens: int = 0):
+        """Block the calling thread until requests are admitted.
+
+        Args:
+            num_requests (int, optional): Number of requests. Defaults to 1.
+            tokens (int, optional): Estimated tokens of the requests. Defaults to 0.
+        """
+
+        delay = self.reserve(num_requests, tokens)
+        if delay > 0:
+            logger.info(f"Sleeping for {delay} seconds")
+            time.sleep(delay)
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 11:40
+@Author  : Joshua Magady
+@File    : single_flight.py
+@Desc    : This defines the SingleFlight class to coalesce identical in-flight calls.
+"""
+
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+__ALL__ = ["SingleFlight"]
+
+
+class SingleFlight:
+    """Coalesce concurrent asynchronous calls that share a key.
+
+    The first caller for a key starts the call; callers arriving while it is
+    in flight await the same result. Cancelling one waiter does not cancel the
+    call for the others; the call is only cancelled once every waiter is gone.
+
+    Usage:
+
+        single_flight = SingleFlight()
+        rsp = await single_flight.do(key, lambda: fetch(key))
+    """
+
+    def __init__(self):
+        """Initialize the in-flight registry."""
+
+        self._calls = {}
+        self.coalesced = 0
+        """Number of calls served by joining an in-flight call."""
+
+    def in_flight(self) -> int:
+        """Get the number of calls currently in flight.
+
+        Returns:
+            int: Number of distinct in-flight keys.
+        """
+
+        return len(self._calls)
+
+    async def do(self, key: Hashable, func: Callable[[], Awaitable[Any]]) -> Any:
+        """Run `func`, or join the identical call already in flight.
+
+        Args:
+            key (Hashable): Key identifying identical calls.
+            func (Callable[[], Awaitable]): Factory of the awaitable to run.
+
+        Returns:
+            Any: Result of the call.
+
+        Raises:
+            Exception: Whatever the call raised, for every waiter.
+        """
+
+        loop_key = (asyncio.get_running_loop(), key)
+        call = self._calls.get(loop_key)
+        if call is None:
+            task = asyncio.ensure_future(func())
+            call = self._calls[loop_key] = [task, 0]
+            task.add_done_callback(lambda t: self._finish(loop_key, t))
+        else:
+            self.coalesced += 1
+
+        task = call[0]
+        call[1] += 1
+        try:
+            return await asyncio.shield(task)
+        except asyncio.CancelledError:
+            if not task.done() and call[1] == 1:
+                # Forget the call at once: a caller arriving before the task
+                # finishes cancelling must start a new call, not join this one.
+                if self._calls.get(loop_key) is call:
+                    del self._calls[loop_key]
+                task.cancel()
+            raise
+        finally:
+            call[1] -= 1
+
+    def _finish(self, loop_key: tuple, task: asyncio.Future):
+        """Forget a finished call (Private Method).
+
+        Args:
+            loop_key (tuple): Registry key of the call.
+            task (asyncio.Future): The finished task.
+        """
+
+        if self._calls.get(loop_key, [None])[0] is task:
+            del self._calls[loop_key]
+        if not task.cancelled():
+            task.exception()  # mark as retrieved when no waiter is left
@@ -7,6 +7,7 @@
 @Desc    : Ensure only one instance of a class.
 """
 import abc
+import threading
 
 __ALL__ = ["Singleton"]
 
@@ -22,6 +23,9 @@ class Singleton(abc.ABCMeta, type):
     _instances = {}
     """Private dictionary to store class instances."""
 
+    _lock = threading.RLock()
+    """Private lock making the creation of instances thread-safe."""
+
     def __call__(cls, *args, **kwargs):
         """Call method for the singleton metaclass.
 
@@ -37,5 +41,9 @@ class Singleton(abc.ABCMeta, type):
             class instance: The singleton instance for the class.
         """
         if cls not in cls._instances:
-            cls._instances[cls] = super(Singleton, cls).__call__(*args, **kwargs)
+            with cls._lock:
+                if cls not in cls._instances:
+                    cls._instances[cls] = super(Singleton, cls).__call__(
+                        *args, **kwargs
+                    )
         return cls._instances[cls]
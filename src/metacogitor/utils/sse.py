@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""
+@Time    : 2026/10/17 16:10
+@Author  : Joshua Magady
+@File    : sse.py
+@Desc    : This defines the incremental Server-Sent Events decoder.
+"""
+
+__ALL__ = ["SSEDecoder"]
+
+
+class SSEDecoder:
+    """Incremental decoder of a Server-Sent Events stream.
+
+    Bytes are fed as they arrive from the network, in chunks of any size;
+    the data of every event completed by a chunk is returned immediately, so
+    deltas are not held back until the response ends. Only the data field
+    is kept, as used by OpenAI compatible streaming APIs.
+
+    Usage:
+
+        decoder = SSEDecoder()
+        async for chunk in response.content.iter_any():
+            for data in decoder.feed(chunk):
+                ...
+    """
+
+    def __init__(self):
+        """Initialize the decoder."""
+
+        self._buffer = b""
+        self._data = []
+
+    def feed(self, chunk: bytes) -> list[str]:
+        """Decode a chunk of the stream.
+
+        Args:
+            chunk (bytes): Bytes received.
+
+        Returns:
+            list[str]: Data of the events completed by the chunk.
+        """
+
+        self._buffer += chunk
+        events = []
+        *lines, self._buffer = self._buffer.split(b"\n")
+        for line in lines:
+            line = line.rstrip(b"\r").decode("utf-8")
+            if not line:
+                if self._data:
+                    events.append("\n".join(self._data))
+                    self._data = []
+            elif line.startswith(":"):
+                continue
+            else:
+                name, _, value = line.partition(":")
+                if name == "data":
+                    self._data.append(value[1:] if value.startswith(" ") else value)
+        return events
+
+    def flush(self) -> list[str]:
+        """Decode the end of the stream.
+
+        Returns:
+            list[str]: Data of the last event, if the stream did not end with a blank line.
+        """
+
+        events = self.feed(b"\n\n") if self._buffer or self._data else []
+        self._buffer = b""
+        return events
@@ -9,14 +9,37 @@ ref1: https://github.com/openai/openai-cookbook/blob/main/examples/How_to_count_
 ref2: https://github.com/Significant-Gravitas/Auto-GPT/blob/master/autogpt/llm/token_counter.py
 ref3: https://github.com/hwchase17/langchain/blob/master/langchain/chat_models/openai.py
 """
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import NamedTuple, Optional
+
 import tiktoken
 
 
 __ALL__ = [
     "TOKEN_COSTS",
     "TOKEN_MAX",
+    "DEFAULT_ENCODING",
+    "MESSAGE_TOKEN_CACHE",
+    "TokenCacheStats",
+    "MessageTokenCache",
+    "get_encoding",
+    "get_token_cache_stats",
+    "clear_token_cache",
     "count_string_tokens",
     "count_message_tokens",
+    "get_token_executor",
+    "count_string_tokens_batch",
+    "count_message_tokens_batch",
+    "TokenLedger",
+    "EstimatorProfile",
+    "ESTIMATOR_PROFILES",
+    "EstimatorStats",
+    "TokenEstimator",
+    "TOKEN_ESTIMATOR",
     "get_max_completion_tokens",
 ]
 
@@ -50,25 +73,245 @@ TOKEN_MAX = {
 }
 """Dict of max tokens allowed for different AI models."""
 
+DEFAULT_ENCODING = "cl100k_base"
+"""Encoding used when a model is not known to tiktoken."""
 
-def count_message_tokens(messages, model="gpt-3.5-turbo-0613"):
-    """Count number of tokens for a list of messages.
+_ENCODERS = {}
+"""Process-wide registry of resolved encodings, keyed by model name."""
+
+_ENCODERS_LOCK = threading.Lock()
+"""Lock guarding the encoder registry."""
+
+DEFAULT_NUM_THREADS = os.cpu_count() or 1
+"""Default number of worker threads used for batched token counting."""
+
+BATCH_MIN_PARALLEL = 64
+"""Batches with fewer texts than this are encoded inline, without the thread pool."""
+
+_TOKEN_EXECUTOR = None
+"""Shared thread pool for batched token counting, created on first use."""
+
+
+def get_encoding(model_name: str, fallback: bool = False) -> tiktoken.Encoding:
+    """Get the tiktoken encoding for a model, resolving it only once per process.
 
     Args:
-        messages (list): List of message dicts.
-        model (str, optional): AI model to use. Defaults to "gpt-3.5-turbo-0613".
+        model_name (str): Name of the AI model.
+        fallback (bool, optional): Use the default encoding for unknown models
+            instead of raising. Defaults to False.
 
     Returns:
-        int: Total number of tokens.
+        tiktoken.Encoding: The encoding for the model.
+
+    Raises:
+        KeyError: If the model is unknown and fallback is disabled.
+    """
+
+    encoding = _ENCODERS.get(model_name)
+    if encoding is not None:
+        return encoding
+
+    with _ENCODERS_LOCK:
+        encoding = _ENCODERS.get(model_name)
+        if encoding is not None:
+            return encoding
+        try:
+            encoding = tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            if not fallback:
+                raise
+            print(f"Warning: model not found. Using {DEFAULT_ENCODING} encoding.")
+            encoding = tiktoken.get_encoding(DEFAULT_ENCODING)
+        _ENCODERS[model_name] = encoding
+        return encoding
+
+
+class TokenCacheStats(NamedTuple):
+    """Statistics of the per-message token count cache.
+
+    Attributes:
+        hits (int): Number of lookups served from the cache.
+        misses (int): Number of lookups that required encoding.
+        evictions (int): Number of entries evicted to respect the size bound.
+        size (int): Current number of cached entries.
+        maxsize (int): Maximum number of cached entries.
+    """
+
+    hits: int
+    """Number of lookups served from the cache."""
+
+    misses: int
+    """Number of lookups that required encoding."""
+
+    evictions: int
+    """Number of entries evicted to respect the size bound."""
+
+    size: int
+    """Current number of cached entries."""
+
+    maxsize: int
+    """Maximum number of cached entries."""
+
+
+class MessageTokenCache:
+    """Bounded LRU cache of per-message token counts.
+
+    Entries are keyed by a digest of the encoding name and the message content,
+    so the cache never holds on to the message text itself. Only the encoded
+    length of the message values is stored; the per-message overhead, which
+    depends on the model, is added by the caller.
+    """
+
+    def __init__(self, maxsize: int = 4096):
+        """Initialize the cache.
+
+        Args:
+            maxsize (int, optional): Maximum number of entries. Defaults to 4096.
+        """
+
+        self.maxsize = maxsize
+        """Maximum number of cached entries."""
+
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @staticmethod
+    def make_key(encoding_name: str, message: dict) -> bytes:
+        """Build the content hash used as the cache key for a message.
+
+        Args:
+            encoding_name (str): Name of the encoding used to count.
+            message (dict): Message dict.
+
+        Returns:
+            bytes: Digest of the encoding name and message items.
+        """
+
+        digest = hashlib.blake2b(encoding_name.encode(), digest_size=16)
+        for key, value in message.items():
+            digest.update(b"\x00")
+            digest.update(key.encode())
+            digest.update(b"\x01")
+            digest.update(value.encode())
+        return digest.digest()
+
+    def get(self, key: bytes):
+        """Look up a cached token count, marking it as recently used.
+
+        Args:
+            key (bytes): Cache key from `make_key`.
+
+        Returns:
+            int | None: The cached count, or None on a miss.
+        """
+
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return value
+
+    def put(self, key: bytes, value: int):
+        """Store a token count, evicting the least recently used entry if full.
+
+        Args:
+            key (bytes): Cache key from `make_key`.
+            value (int): Token count to store.
+        """
+
+        if self.maxsize <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def stats(self) -> TokenCacheStats:
+        """Get the cache statistics.
+
+        Returns:
+            TokenCacheStats: Named tuple with hit/miss counters and size.
+        """
+
+        with self._lock:
+            return TokenCacheStats(
+                self._hits,
+                self._misses,
+                self._evictions,
+                len(self._entries),
+                self.maxsize,
+            )
+
+    def clear(self):
+        """Remove all entries and reset the statistics."""
+
+        with self._lock:
+            self._entries.clear()
+            self._hits = 0
+            self._misses = 0
+            self._evictions = 0
+
+
+MESSAGE_TOKEN_CACHE = MessageTokenCache()
+"""Process-wide cache of per-message token counts."""
+
+
+def get_token_cache_stats() -> TokenCacheStats:
+    """Get the statistics of the process-wide message token cache.
+
+    Returns:
+        TokenCacheStats: Named tuple with hit/miss counters and size.
+    """
+
+    return MESSAGE_TOKEN_CACHE.stats()
+
+
+def clear_token_cache():
+    """Clear the process-wide message token cache."""
+
+    MESSAGE_TOKEN_CACHE.clear()
+
+
+def _count_message_value_tokens(message: dict, encoding: tiktoken.Encoding) -> int:
+    """Count the encoded tokens of all values in a message, using the cache.
+
+    Args:
+        message (dict): Message dict.
+        encoding (tiktoken.Encoding): Encoding to count with.
+
+    Returns:
+        int: Total number of tokens of the message values.
+    """
+
+    key = MESSAGE_TOKEN_CACHE.make_key(encoding.name, message)
+    num_tokens = MESSAGE_TOKEN_CACHE.get(key)
+    if num_tokens is None:
+        num_tokens = sum(len(encoding.encode(value)) for value in message.values())
+        MESSAGE_TOKEN_CACHE.put(key, num_tokens)
+    return num_tokens
+
+
+def _message_format(model: str) -> tuple[tiktoken.Encoding, int, int]:
+    """Resolve the encoding and per-message overhead used to count chat messages.
+
+    Args:
+        model (str): AI model to use.
+
+    Returns:
+        tuple: The encoding, tokens per message and tokens per name.
 
     Raises:
         NotImplementedError: If model is not implemented.
     """
-    try:
-        encoding = tiktoken.encoding_for_model(model)
-    except KeyError:
-        print("Warning: model not found. Using cl100k_base encoding.")
-        encoding = tiktoken.get_encoding("cl100k_base")
+    encoding = get_encoding(model, fallback=True)
     if model in {
         "gpt-3.5-turbo-0613",
         "gpt-3.5-turbo-16k-0613",
@@ -88,23 +331,42 @@ def count_message_tokens(messages, model="gpt-3.5-turbo-0613"):
         print(
             "Warning: gpt-3.5-turbo may update over time. Returning num tokens assuming gpt-3.5-turbo-0613."
         )
-        return count_message_tokens(messages, model="gpt-3.5-turbo-0613")
+        return _message_format("gpt-3.5-turbo-0613")
     elif "gpt-4" in model:
         print(
             "Warning: gpt-4 may update over time. Returning num tokens assuming gpt-4-0613."
         )
-        return count_message_tokens(messages, model="gpt-4-0613")
+        return _message_format("gpt-4-0613")
     else:
         raise NotImplementedError(
             f"""num_tokens_from_messages() is not implemented for model {model}. See https://github.com/openai/openai-python/blob/main/chatml.md for information on how messages are converted to tokens."""
         )
+    return encoding, tokens_per_message, tokens_per_name
+
+
+def count_message_tokens(messages, model="gpt-3.5-turbo-0613"):
+    """Count number of tokens for a list of messages.
+
+    Args:
+        messages (list): List of message dicts.
+        model (str, optional): AI model to use. Defaults to "gpt-3.5-turbo-0613".
+
+    Returns:
+        int: Total number of tokens.
+
+    Raises:
+        NotImplementedError: If model is not implemented.
+    """
+    if isinstance(messages, TokenLedger) and messages.model == model:
+        return messages.total_tokens
+
+    encoding, tokens_per_message, tokens_per_name = _message_format(model)
     num_tokens = 0
     for message in messages:
         num_tokens += tokens_per_message
-        for key, value in message.items():
-            num_tokens += len(encoding.encode(value))
-            if key == "name":
-                num_tokens += tokens_per_name
+        num_tokens += _count_message_value_tokens(message, encoding)
+        if "name" in message:
+            num_tokens += tokens_per_name
     num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
     return num_tokens
 
@@ -120,32 +382,717 @@ def count_string_tokens(string: str, model_name: str) -> int:
         int: Number of tokens in the string.
     """
 
-    encoding = tiktoken.encoding_for_model(model_name)
+    encoding = get_encoding(model_name)
     """Get encoding for the model."""
 
     return len(encoding.encode(string))
     """Encode string and return length as token count."""
 
 
-def get_max_completion_tokens(messages: list[dict], model: str, default: int) -> int:
+def get_token_executor() -> ThreadPoolExecutor:
+    """Get the shared thread pool used for batched token counting.
+
+    The pool is created lazily with `DEFAULT_NUM_THREADS` workers and reused
+    for the lifetime of the process. tiktoken releases the GIL while encoding,
+    so the workers run in parallel.
+
+    Returns:
+        ThreadPoolExecutor: The shared executor.
+    """
+
+    global _TOKEN_EXECUTOR
+    if _TOKEN_EXECUTOR is None:
+        with _ENCODERS_LOCK:
+            if _TOKEN_EXECUTOR is None:
+                _TOKEN_EXECUTOR = ThreadPoolExecutor(
+                    max_workers=DEFAULT_NUM_THREADS,
+                    thread_name_prefix="token_counter",
+                )
+    return _TOKEN_EXECUTOR
+
+
+def _encode_lengths(
+    texts: list[str],
+    encoding: tiktoken.Encoding,
+    num_threads: int,
+    executor: Optional[Executor],
+) -> list[int]:
+    """Encode texts on a thread pool and return their token counts.
+
+    Args:
+        texts (list[str]): Texts to encode.
+        encoding (tiktoken.Encoding): Encoding to use.
+        num_threads (int): Number of chunks to split the work into.
+        executor (Executor, optional): Executor to run on. Defaults to the shared pool.
+
+    Returns:
+        list[int]: Token count of each text, in input order.
+    """
+
+    def encode_chunk(chunk):
+        return [len(encoding.encode(text)) for text in chunk]
+
+    if num_threads <= 1 or len(texts) < BATCH_MIN_PARALLEL:
+        return encode_chunk(texts)
+
+    executor = executor or get_token_executor()
+    chunk_size = -(-len(texts) // num_threads)
+    chunks = [texts[i : i + chunk_size] for i in range(0, len(texts), chunk_size)]
+    lengths = []
+    for chunk_lengths in executor.map(encode_chunk, chunks):
+        lengths.extend(chunk_lengths)
+    return lengths
+
+
+def count_string_tokens_batch(
+    strings: list[str],
+    model_name: str,
+    num_threads: int = DEFAULT_NUM_THREADS,
+    executor: Optional[Executor] = None,
+) -> list[int]:
+    """Count number of tokens of many text strings in parallel.
+
+    Args:
+        strings (list[str]): The text strings.
+        model_name (str): Name of encoding to use.
+        num_threads (int, optional): Number of parallel workers. Defaults to the CPU count.
+        executor (Executor, optional): Executor to run on. Defaults to the shared pool.
+
+    Returns:
+        list[int]: Number of tokens of each string, in input order.
+    """
+
+    encoding = get_encoding(model_name)
+    return _encode_lengths(list(strings), encoding, num_threads, executor)
+
+
+def count_message_tokens_batch(
+    conversations: list[list[dict]],
+    model: str = "gpt-3.5-turbo-0613",
+    num_threads: int = DEFAULT_NUM_THREADS,
+    executor: Optional[Executor] = None,
+) -> list[int]:
+    """Count number of tokens for many lists of messages in parallel.
+
+    Messages already in the message token cache are not re-encoded, and
+    identical messages shared between conversations are encoded only once.
+    Results are identical to calling `count_message_tokens` on each list.
+
+    Args:
+        conversations (list[list[dict]]): Lists of message dicts.
+        model (str, optional): AI model to use. Defaults to "gpt-3.5-turbo-0613".
+        num_threads (int, optional): Number of parallel workers. Defaults to the CPU count.
+        executor (Executor, optional): Executor to run on. Defaults to the shared pool.
+
+    Returns:
+        list[int]: Total number of tokens of each list, in input order.
+
+    Raises:
+        NotImplementedError: If model is not implemented.
+    """
+
+    encoding, tokens_per_message, tokens_per_name = _message_format(model)
+
+    # Resolve cached messages first and collect the values still to encode.
+    keys = [
+        [MESSAGE_TOKEN_CACHE.make_key(encoding.name, message) for message in messages]
+        for messages in conversations
+    ]
+    message_tokens = {}
+    pending = {}
+    for messages, message_keys in zip(conversations, keys):
+        for message, key in zip(messages, message_keys):
+            if key in message_tokens or key in pending:
+                continue
+            num_tokens = MESSAGE_TOKEN_CACHE.get(key)
+            if num_tokens is None:
+                pending[key] = list(message.values())
+            else:
+                message_tokens[key] = num_tokens
+
+    texts = [value for values in pending.values() for value in values]
+    lengths = iter(_encode_lengths(texts, encoding, num_threads, executor))
+    for key, values in pending.items():
+        num_tokens = sum(next(lengths) for _ in values)
+        MESSAGE_TOKEN_CACHE.put(key, num_tokens)
+        message_tokens[key] = num_tokens
+
+    counts = []
+    for messages, message_keys in zip(conversations, keys):
+        num_tokens = 0
+        for message, key in zip(messages, message_keys):
+            num_tokens += tokens_per_message
+            num_tokens += message_tokens[key]
+            if "name" in message:
+                num_tokens += tokens_per_name
+        num_tokens += 3  # every reply is primed with <|start|>assistant<|message|>
+        counts.append(num_tokens)
+    return counts
+
+
+class TokenLedger(list):
+    """List of message dicts that keeps running prefix-sum token counts.
+
+    The ledger is a drop-in replacement for the plain list used as conversation
+    context, so it can be passed anywhere a list of messages is expected.
+    Appending is O(1); new messages are counted lazily, once, the next time a
+    token query is made. Mutations before the end of the list (insert, pop,
+    slice deletion, truncation, ...) only discard the prefix sums from the
+    mutated position onwards. Message dicts must not be modified in place
+    after they were counted.
+
+    Usage:
+
+        context = TokenLedger([{"role": "system", "content": "..."}], model="gpt-4")
+        context.append({"role": "user", "content": "..."})
+        context.total_tokens  # same as count_message_tokens(context, "gpt-4")
+    """
+
+    def __init__(self, messages=(), model: str = "gpt-3.5-turbo-0613"):
+        """Initialize the ledger.
+
+        Args:
+            messages (list, optional): Initial message dicts. Defaults to empty.
+            model (str, optional): AI model to count for. Defaults to "gpt-3.5-turbo-0613".
+        """
+
+        super().__init__(messages)
+
+        self.model = model
+        """AI model the token counts are computed for."""
+
+        self._prefix = [0]
+        self._format = None
+
+    def _invalidate(self, index: int):
+        """Discard the prefix sums of the messages from index onwards (Private Method).
+
+        Args:
+            index (int): Index of the first changed message.
+        """
+
+        del self._prefix[max(index, 0) + 1 :]
+
+    def _normalize(self, index) -> int:
+        """Get the first position affected by an index or slice (Private Method).
+
+        Args:
+            index (int | slice): Index or slice being mutated.
+
+        Returns:
+            int: The smallest affected position.
+        """
+
+        if isinstance(index, slice):
+            start, _, step = index.indices(len(self))
+            return start if step == 1 else 0
+        return index + len(self) if index < 0 else index
+
+    def _sync(self):
+        """Count the messages appended since the last token query (Private Method)."""
+
+        if len(self._prefix) > len(self):
+            return
+        if self._format is None:
+            self._format = _message_format(self.model)
+        encoding, tokens_per_message, tokens_per_name = self._format
+        prefix = self._prefix
+        for message in self[len(prefix) - 1 :]:
+            num_tokens = tokens_per_message
+            num_tokens += _count_message_value_tokens(message, encoding)
+            if "name" in message:
+                num_tokens += tokens_per_name
+            prefix.append(prefix[-1] + num_tokens)
+
+    @property
+    def prefix_sums(self) -> list[int]:
+        """Get the running token counts of the conversation.
+
+        Returns:
+            list[int]: Item i is the number of tokens of the first i messages,
+            excluding the reply priming tokens.
+        """
+
+        self._sync()
+        return self._prefix
+
+    @property
+    def total_tokens(self) -> int:
+        """Get the number of prompt tokens of the whole conversation.
+
+        Returns:
+            int: Total number of tokens, as counted by `count_message_tokens`.
+        """
+
+        self._sync()
+        return (
+            self._prefix[-1] + 3
+        )  # every reply is primed with <|start|>assistant<|message|>
+
+    def tokens_between(self, start: int, end: int) -> int:
+        """Get the number of tokens of the messages in `self[start:end]`.
+
+        Args:
+            start (int): Index of the first message.
+            end (int): Index after the last message.
+
+        Returns:
+            int: Number of tokens of the messages, excluding reply priming.
+        """
+
+        self._sync()
+        return self._prefix[end] - self._prefix[start]
+
+    def remaining_tokens(self, max_tokens: Optional[int] = None) -> int:
+        """Get the number of tokens left in the model's context window.
+
+        Args:
+            max_tokens (int, optional): Context window size. Defaults to TOKEN_MAX of the model.
+
+        Returns:
+            int: Number of tokens left for the completion.
+        """
+
+        if max_tokens is None:
+            max_tokens = TOKEN_MAX[self.model]
+        return max_tokens - self.total_tokens
+
+    def truncate(self, length: int):
+        """Keep only the first `length` messages.
+
+        Args:
+            length (int): Number of messages to keep.
+        """
+
+        del self[length:]
+
+    def insert(self, index, message):
+        """Insert a message, discarding the prefix sums after it."""
+
+        self._invalidate(self._normalize(index))
+        super().insert(index, message)
+
+    def pop(self, index=-1):
+        """Remove and return a message, discarding the prefix sums after it."""
+
+        self._invalidate(self._normalize(index))
+        return super().pop(index)
+
+    def remove(self, message):
+        """Remove the first occurrence of a message, discarding the prefix sums after it."""
+
+        self._invalidate(self.index(message))
+        super().remove(message)
+
+    def clear(self):
+        """Remove all messages."""
+
+        self._invalidate(0)
+        super().clear()
+
+    def sort(self, *args, **kwargs):
+        """Sort the messages in place, discarding all prefix sums."""
+
+        self._invalidate(0)
+        super().sort(*args, **kwargs)
+
+    def reverse(self):
+        """Reverse the messages in place, discarding all prefix sums."""
+
+        self._invalidate(0)
+        super().reverse()
+
+    def __setitem__(self, index, value):
+        """Replace messages, discarding the prefix sums after the first one."""
+
+        self._invalidate(self._normalize(index))
+        super().__setitem__(index, value)
+
+    def __delitem__(self, index):
+        """Delete messages, discarding the prefix sums after the first one."""
+
+        self._invalidate(self._normalize(index))
+        super().__delitem__(index)
+
+    def __imul__(self, times):
+        """Repeat the messages in place, discarding all prefix sums if emptied."""
+
+        if times < 1:
+            self._invalidate(0)
+        return super().__imul__(times)
+
+
+class EstimatorProfile(NamedTuple):
+    """Calibration of the approximate token estimator for one encoding.
+
+    Attributes:
+        bytes_per_token (float): Median UTF-8 bytes per token, used for the estimate.
+        min_bytes_per_token (float): Worst-case UTF-8 bytes per token of natural text, used for the upper bound.
+    """
+
+    bytes_per_token: float
+    """Median UTF-8 bytes per token, used for the estimate."""
+
+    min_bytes_per_token: float = 1.0
+    """Worst-case UTF-8 bytes per token of natural text, used for the upper bound."""
+
+
+ESTIMATOR_PROFILES = {
+    "cl100k_base": EstimatorProfile(4.3, 1.4),
+    "o200k_base": EstimatorProfile(4.3, 1.4),
+    "p50k_base": EstimatorProfile(3.7, 1.3),
+    "r50k_base": EstimatorProfile(3.7, 1.3),
+}
+"""Dict of estimator calibrations, keyed by encoding name.
+
+Measured on random 100-4000 byte slices of English prose and Python source,
+and on generated JSON documents. For 90% of the prose and code samples the
+estimate is within -30%/+20% of the exact count; JSON and number-heavy text
+is underestimated by up to 45%. Use `TokenEstimator.calibrate` for traffic
+that differs from these samples (e.g. non-Latin scripts).
+
+No ratio bounds the count of every text: spaced digits and punctuation reach
+one token per byte. The upper bound of natural text (ASCII, mostly letters,
+with vowels, few digits) uses the worst ratio measured on adversarial
+pronounceable and random-word texts passing that check, rounded down. The
+upper bound of any other text is its UTF-8 length, since byte-level BPE never
+produces more tokens than bytes.
+"""
+
+_LETTERS = frozenset(b"ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz")
+_NON_LETTERS = bytes(b for b in range(256) if b not in _LETTERS)
+_NON_VOWELS = bytes(b for b in range(256) if b not in b"aeiouAEIOU")
+_NON_DIGITS = bytes(b for b in range(256) if b not in b"0123456789")
+
+
+def _is_natural(raw: bytes) -> bool:
+    """Check if UTF-8 text looks like natural language (Private Method).
+
+    Natural text is ASCII, at least 65% letters, of which at least 30% are
+    vowels, and at most 5% digits. This excludes numbers, base64, hashes,
+    symbols and non-Latin scripts, which tokenize far more densely.
+
+    Args:
+        raw (bytes): The text.
+
+    Returns:
+        bool: True if the natural text ratio bounds its token count.
+    """
+
+    if not raw.isascii():
+        return False
+    size = len(raw)
+    letters = len(raw.translate(None, _NON_LETTERS))
+    return (
+        letters >= 0.65 * size
+        and len(raw.translate(None, _NON_VOWELS)) >= 0.3 * letters
+        and len(raw.translate(None, _NON_DIGITS)) <= 0.05 * size
+    )
+
+
+class EstimatorStats(NamedTuple):
+    """Statistics of the approximate token estimator.
+
+    Attributes:
+        estimates (int): Number of queries answered from the estimate.
+        fallbacks (int): Number of queries that fell back to exact counting.
+    """
+
+    estimates: int
+    """Number of queries answered from the estimate."""
+
+    fallbacks: int
+    """Number of queries that fell back to exact counting."""
+
+    @property
+    def fallback_rate(self) -> float:
+        """Get the fraction of queries that fell back to exact counting.
+
+        Returns:
+            float: Fallback rate between 0 and 1.
+        """
+
+        total = self.estimates + self.fallbacks
+        return self.fallbacks / total if total else 0.0
+
+
+class TokenEstimator:
+    """Fast approximate token counter with exact fallback near limits.
+
+    The estimate is derived from the UTF-8 length of the message values using
+    a per-encoding calibration (see `ESTIMATOR_PROFILES`). A query is answered
+    from the estimate only when the upper bound, plus a safety margin, stays
+    below the limit; otherwise the exact tiktoken count is used.
+    """
+
+    def __init__(self, safety_margin: int = 64, profiles: Optional[dict] = None):
+        """Initialize the estimator.
+
+        Args:
+            safety_margin (int, optional): Tokens kept between the upper bound and
+                the limit before falling back to exact counting. Defaults to 64.
+            profiles (dict, optional): Calibrations keyed by encoding name.
+                Defaults to a copy of `ESTIMATOR_PROFILES`.
+        """
+
+        self.safety_margin = safety_margin
+        """Tokens kept between the upper bound and the limit."""
+
+        self.profiles = dict(ESTIMATOR_PROFILES if profiles is None else profiles)
+        """Calibrations keyed by encoding name."""
+
+        self._lock = threading.Lock()
+        self._estimates = 0
+        self._fallbacks = 0
+
+    def _profile(self, encoding: tiktoken.Encoding) -> EstimatorProfile:
+        """Get the calibration for an encoding (Private Method).
+
+        Args:
+            encoding (tiktoken.Encoding): Encoding to get the calibration for.
+
+        Returns:
+            EstimatorProfile: The calibration, or the default encoding's one.
+        """
+
+        return self.profiles.get(encoding.name) or self.profiles[DEFAULT_ENCODING]
+
+    @staticmethod
+    def _estimate_value(raw: bytes, profile: EstimatorProfile) -> tuple[int, int]:
+        """Estimate the tokens of a string from its UTF-8 length (Private Method).
+
+        Args:
+            raw (bytes): UTF-8 encoding of the string.
+            profile (EstimatorProfile): Calibration to use.
+
+        Returns:
+            tuple[int, int]: The estimate and its upper bound.
+        """
+
+        num_bytes = len(raw)
+        estimate = -(-num_bytes // profile.bytes_per_token)
+        if not _is_natural(raw):
+            return int(estimate), num_bytes
+        upper = -(-num_bytes // profile.min_bytes_per_token)
+        return int(estimate), int(min(num_bytes, upper))
+
+    def estimate_string_tokens(self, string: str, model_name: str) -> int:
+        """Estimate number of tokens in a text string without encoding it.
+
+        Args:
+            string (str): The text string.
+            model_name (str): Name of encoding to use.
+
+        Returns:
+            int: Estimated number of tokens.
+        """
+
+        profile = self._profile(get_encoding(model_name, fallback=True))
+        return self._estimate_value(string.encode(), profile)[0]
+
+    def estimate_message_tokens(
+        self, messages, model="gpt-3.5-turbo-0613"
+    ) -> tuple[int, int]:
+        """Estimate number of tokens for a list of messages without encoding them.
+
+        Args:
+            messages (list): List of message dicts.
+            model (str, optional): AI model to use. Defaults to "gpt-3.5-turbo-0613".
+
+        Returns:
+            tuple[int, int]: The estimate and its upper bound.
+
+        Raises:
+            NotImplementedError: If model is not implemented.
+        """
+
+        encoding, tokens_per_message, tokens_per_name = _message_format(model)
+        profile = self._profile(encoding)
+        estimate = upper = 3  # every reply is primed with <|start|>assistant<|message|>
+        for message in messages:
+            estimate += tokens_per_message
+            upper += tokens_per_message
+            for value in message.values():
+                value_estimate, value_upper = self._estimate_value(
+                    value.encode(), profile
+                )
+                estimate += value_estimate
+                upper += value_upper
+            if "name" in message:
+                estimate += tokens_per_name
+                upper += tokens_per_name
+        return estimate, upper
+
+    def _record(self, fallback: bool):
+        """Count a query towards the statistics (Private Method).
+
+        Args:
+            fallback (bool): Whether the query fell back to exact counting.
+        """
+
+        with self._lock:
+            if fallback:
+                self._fallbacks += 1
+            else:
+                self._estimates += 1
+
+    def count_message_tokens(
+        self, messages, model="gpt-3.5-turbo-0613", limit: Optional[int] = None
+    ) -> int:
+        """Count number of tokens for a list of messages, estimating when far from the limit.
+
+        Args:
+            messages (list): List of message dicts.
+            model (str, optional): AI model to use. Defaults to "gpt-3.5-turbo-0613".
+            limit (int, optional): Token limit the count is checked against.
+                Defaults to TOKEN_MAX of the model, or always exact if unknown.
+
+        Returns:
+            int: Estimated number of tokens, or the exact number near the limit.
+
+        Raises:
+            NotImplementedError: If model is not implemented.
+        """
+
+        if limit is None:
+            limit = TOKEN_MAX.get(model)
+        if limit is not None and not isinstance(messages, TokenLedger):
+            estimate, upper = self.estimate_message_tokens(messages, model)
+            if upper + self.safety_margin <= limit:
+                self._record(fallback=False)
+                return estimate
+        self._record(fallback=True)
+        return count_message_tokens(messages, model)
+
+    def get_max_completion_tokens(
+        self,
+        messages: list[dict],
+        model: str,
+        default: int,
+        budget: int = 0,
+        tolerance: float = 0.1,
+    ) -> int:
+        """Get max completion tokens, estimating when far from the model limit.
+
+        When the estimate is used, the result is computed from the upper bound
+        and therefore never exceeds the exact value. The estimate is only used
+        when the upper bound gives away at most `tolerance` of the window
+        compared to the estimate, so loose bounds (dense text) count exactly.
+
+        Args:
+            messages (list[dict]): List of message dicts.
+            model (str): Name of the AI model.
+            default (int): Default value if model not found.
+            budget (int, optional): Completion tokens the caller wants to reserve.
+                Exact counting is used when the estimate cannot guarantee them. Defaults to 0.
+            tolerance (float, optional): Largest share of the model window the upper bound
+                may exceed the estimate by. Defaults to 0.1.
+
+        Returns:
+            int: Max number of completion tokens.
+        """
+
+        if model not in TOKEN_MAX:
+            return default
+        if not isinstance(messages, TokenLedger):
+            estimate, upper = self.estimate_message_tokens(messages, model)
+            max_tokens = TOKEN_MAX[model] - upper - 1
+            if (
+                max_tokens - self.safety_margin >= budget
+                and upper - estimate <= tolerance * TOKEN_MAX[model]
+            ):
+                self._record(fallback=False)
+                return max_tokens
+        self._record(fallback=True)
+        return get_max_completion_tokens(messages, model, default)
+
+    def calibrate(self, encoding_name: str, samples: list[str]) -> EstimatorProfile:
+        """Calibrate the estimate for an encoding from sample texts.
+
+        Only the estimate is calibrated; the upper bound does not depend on the samples.
+
+        Args:
+            encoding_name (str): Name of the tiktoken encoding.
+            samples (list[str]): Representative texts.
+
+        Returns:
+            EstimatorProfile: The new calibration, also stored in `profiles`.
+        """
+
+        encoding = tiktoken.get_encoding(encoding_name)
+        ratios = sorted(
+            len(sample.encode()) / num_tokens
+            for sample, num_tokens in zip(
+                samples,
+                (len(tokens) for tokens in encoding.encode_ordinary_batch(samples)),
+            )
+            if num_tokens
+        )
+        if not ratios:
+            raise ValueError("No non-empty samples to calibrate with")
+        bound = self.profiles.get(encoding_name, EstimatorProfile(0.0))
+        profile = EstimatorProfile(ratios[len(ratios) // 2], bound.min_bytes_per_token)
+        self.profiles[encoding_name] = profile
+        return profile
+
+    def stats(self) -> EstimatorStats:
+        """Get the estimator statistics.
+
+        Returns:
+            EstimatorStats: Named tuple with estimate and fallback counters.
+        """
+
+        with self._lock:
+            return EstimatorStats(self._estimates, self._fallbacks)
+
+    def reset_stats(self):
+        """Reset the estimator statistics."""
+
+        with self._lock:
+            self._estimates = 0
+            self._fallbacks = 0
+
+
+TOKEN_ESTIMATOR = TokenEstimator()
+"""Process-wide approximate token estimator."""
+
+
+def get_max_completion_tokens(
+    messages: list[dict],
+    model: str,
+    default: int,
+    estimate: bool = False,
+    budget: int = 0,
+) -> int:
     """Get max completion tokens for a model and list of messages.
 
     Args:
         messages (list[dict]): List of message dicts.
         model (str): Name of the AI model.
         default (int): Default value if model not found.
+        estimate (bool, optional): Use `TOKEN_ESTIMATOR`, which only counts exactly
+            near the model limit. Defaults to False.
+        budget (int, optional): Completion tokens to guarantee in estimate mode. Defaults to 0.
 
     Returns:
         int: Max number of completion tokens.
 
     """
 
+    if estimate:
+        return TOKEN_ESTIMATOR.get_max_completion_tokens(
+            messages, model, default, budget
+        )
+
     if model not in TOKEN_MAX:
         """If model not found, return default."""
         return default
 
-    # Calculate tokens used by messages
-    used_tokens = count_message_tokens(messages)
+    # Calculate tokens used by messages, reusing the running count of a ledger of the same model
+    if isinstance(messages, TokenLedger) and messages.model == model:
+        used_tokens = messages.total_tokens
+    else:
+        used_tokens = count_message_tokens(messages)
 
     # Subtract used tokens from model's max
     max_tokens = TOKEN_MAX[model] - used_tokens - 1
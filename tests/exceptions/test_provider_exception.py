@@ -0,0 +1,31 @@
+import pytest
+from metacogitor.exceptions import (
+    BaseError,
+    CircuitOpenException,
+    ProviderException,
+)
+
+
+def test_provider_exception():
+    err = ProviderException(
+        code=429, message="Rate limited", retry_after=2.0, endpoint="openai"
+    )
+
+    assert isinstance(err, BaseError)
+    assert err.status == 429
+    assert err.retry_after == 2.0
+    assert err.endpoint == "openai"
+    assert str(err) == "429 - Rate limited"
+
+
+def test_circuit_open_exception():
+    err = CircuitOpenException(code=503, message="Circuit is open", retry_after=5)
+    assert err.error.code == 503
+    assert err.retry_after == 5
+
+
+def test_invalid_error_details():
+    with pytest.raises(ValueError) as exc_info:
+        ProviderException(code="abc")
+
+    assert "Invalid error details" in str(exc_info.value)
@@ -1,6 +1,29 @@
+import asyncio
+import threading
+import time
+from contextlib import aclosing
+
 import pytest
-from metacogitor.providers import BaseGPTAPI
+from metacogitor.providers import BaseGPTAPI, CodeStats, StreamStats
 from metacogitor.logs import logger
+from metacogitor.config import CONFIG
+from metacogitor.exceptions import ProviderException
+from metacogitor.utils import (
+    TOKEN_MAX,
+    AdaptiveRateLimiter,
+    CostManager,
+    Hedger,
+    MemoryBucketStore,
+    MemoryResponseCache,
+    RateLimiter,
+    RetryEngine,
+    RetryPolicy,
+    SharedRateLimiter,
+    TokenBucketLimiter,
+    TokenLedger,
+    count_message_tokens,
+    cost_scope,
+)
 
 
 class MockGPTAPI(BaseGPTAPI):
@@ -70,6 +93,587 @@ async def test_aask_code(mock_chatbot):
     assert isinstance(code, str)
 
 
+def test_ask_batch_context_is_token_ledger(mock_chatbot):
+    contexts = []
+    completion = mock_chatbot.completion
+
+    def recording_completion(messages):
+        contexts.append(messages)
+        return completion(messages)
+
+    mock_chatbot.completion = recording_completion
+    mock_chatbot.ask_batch(["How are you?", "What's your name?"])
+
+    assert all(isinstance(context, TokenLedger) for context in contexts)
+    assert contexts[-1].total_tokens == count_message_tokens(list(contexts[-1]))
+
+
+def test_ask_batch_fits_context(mock_chatbot):
+    sent = []
+    completion = mock_chatbot.completion
+
+    def recording_completion(messages):
+        sent.append(messages)
+        return completion(messages)
+
+    mock_chatbot.completion = recording_completion
+    mock_chatbot.fit_context = True
+    mock_chatbot.ask_batch(["word " * 600] * 4)
+
+    assert all(
+        count_message_tokens(messages)
+        <= TOKEN_MAX[mock_chatbot.model] - CONFIG.max_tokens_rsp
+        for messages in sent
+    )
+    assert len(sent[-1]) < 8
+
+
+class SlowGPTAPI(MockGPTAPI):
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    async def acompletion_text(self, messages, stream=False):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            content = messages[-1]["content"]
+            await asyncio.sleep(0.01 * (len(content) % 5))
+            if content.startswith("fail"):
+                raise RuntimeError(content)
+            return content
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.mark.asyncio
+async def test_aask_many_preserves_order_and_bounds_concurrency():
+    chatbot = SlowGPTAPI()
+    msgs = [f"question {i}" * (i % 3 + 1) for i in range(20)]
+    responses = await chatbot.aask_many(msgs, concurrency=3)
+    assert responses == msgs
+    assert chatbot.max_in_flight == 3
+
+
+@pytest.mark.asyncio
+async def test_aask_many_captures_errors():
+    chatbot = SlowGPTAPI()
+    responses = await chatbot.aask_many(["ok", "fail 1", "ok again"])
+    assert responses[0] == "ok"
+    assert isinstance(responses[1], RuntimeError)
+    assert responses[2] == "ok again"
+
+    with pytest.raises(RuntimeError):
+        await chatbot.aask_many(["ok", "fail 1"], return_exceptions=False)
+
+
+@pytest.mark.asyncio
+async def test_aask_many_as_completed():
+    chatbot = SlowGPTAPI()
+    msgs = ["a" * 4, "b", "c" * 2]
+    completed = [item async for item in chatbot.aask_many_as_completed(msgs)]
+    assert sorted(completed) == [(0, msgs[0]), (1, msgs[1]), (2, msgs[2])]
+    assert completed[0] == (1, "b")
+
+
+@pytest.mark.asyncio
+async def test_aask_many_as_completed_streams_generators():
+    chatbot = SlowGPTAPI()
+    msgs = (str(i) for i in range(50))
+    completed = [
+        item async for item in chatbot.aask_many_as_completed(msgs, concurrency=4)
+    ]
+    assert sorted(completed, key=lambda item: item[0]) == [
+        (i, str(i)) for i in range(50)
+    ]
+
+
+@pytest.mark.asyncio
+async def test_aask_many_uses_rate_limiter():
+    chatbot = SlowGPTAPI()
+    rate_limiter = RateLimiter(rpm=6000)
+    start = time.time()
+    await chatbot.aask_many(["a", "b", "c"], rate_limiter=rate_limiter)
+    assert time.time() - start >= 2 * rate_limiter.interval
+
+
+class CountingGPTAPI(MockGPTAPI):
+    def __init__(self):
+        self.calls = 0
+
+    def completion(self, messages):
+        self.calls += 1
+        return super().completion(messages)
+
+    async def acompletion_text(self, messages, stream=False):
+        self.calls += 1
+        return await super().acompletion_text(messages, stream)
+
+
+@pytest.mark.asyncio
+async def test_response_cache():
+    chatbot = CountingGPTAPI()
+    chatbot.response_cache = MemoryResponseCache()
+
+    assert chatbot.ask("hello") == chatbot.ask("hello")
+    assert await chatbot.aask("hello") == await chatbot.aask("hello")
+    assert chatbot.calls == 2
+    stats = chatbot.response_cache.stats()
+    assert stats.hits == 2
+    assert stats.misses == 2
+
+
+@pytest.mark.asyncio
+async def test_coalesce_requests():
+    chatbot = SlowGPTAPI()
+    chatbot.coalesce_requests = True
+    calls = 0
+    acompletion_text = chatbot.acompletion_text
+
+    async def counting_acompletion_text(messages, stream=False):
+        nonlocal calls
+        calls += 1
+        return await acompletion_text(messages, stream)
+
+    chatbot.acompletion_text = counting_acompletion_text
+    responses = await asyncio.gather(*[chatbot.aask("same question") for _ in range(5)])
+
+    assert responses == ["same question"] * 5
+    assert calls == 1
+
+
+class ContextGPTAPI(MockGPTAPI):
+    def __init__(self):
+        self.sent = []
+
+    def completion(self, messages):
+        self.sent.append(list(messages))
+        return super().completion(messages[-1:] * 2)
+
+    async def acompletion_text(self, messages, stream=False):
+        self.sent.append(list(messages))
+        return messages[-1]["content"]
+
+
+def test_ask_batch_continues_conversation():
+    chatbot = ContextGPTAPI()
+    conversation = chatbot.new_conversation()
+    assert chatbot.ask_batch(["a", "b"], conversation=conversation) == "a\nb"
+    assert chatbot.ask_batch(["c"], conversation=conversation) == "c"
+    assert [m.content for m in conversation] == [
+        chatbot.system_prompt,
+        "a",
+        "a",
+        "b",
+        "b",
+        "c",
+        "c",
+    ]
+    assert chatbot.sent[-1] == conversation.to_dicts()[:-1]
+
+
+@pytest.mark.asyncio
+async def test_aask_batch_continues_conversation():
+    chatbot = ContextGPTAPI()
+    conversation = chatbot.new_conversation(["Be brief."])
+    assert await chatbot.aask_batch(["a"], conversation=conversation) == "a"
+    assert await chatbot.aask_batch(["b"], conversation=conversation) == "b"
+    assert chatbot.sent[-1] == [
+        {"role": "system", "content": "Be brief."},
+        {"role": "user", "content": "a"},
+        {"role": "assistant", "content": "a"},
+        {"role": "user", "content": "b"},
+    ]
+
+
+@pytest.mark.asyncio
+async def test_aask_branches_forked_conversations():
+    chatbot = ContextGPTAPI()
+    root = chatbot.new_conversation()
+    await chatbot.aask("root", conversation=root)
+    branches = [root.fork() for _ in range(3)]
+    answers = await asyncio.gather(
+        *[chatbot.aask(f"branch {i}", conversation=b) for i, b in enumerate(branches)]
+    )
+
+    assert answers == ["branch 0", "branch 1", "branch 2"]
+    assert len(root) == 3
+    for i, branch in enumerate(branches):
+        contents = [m.content for m in branch][1:]
+        assert contents == ["root", "root", f"branch {i}", f"branch {i}"]
+    assert chatbot.sent[-1][:-1] == root.to_dicts()
+
+
+class ThreadedGPTAPI(MockGPTAPI):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def completion(self, messages):
+        with self.lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            content = messages[-1]["content"]
+            time.sleep(0.01 * (len(content) % 5))
+            if content.startswith("fail"):
+                raise RuntimeError(content)
+            return {"choices": [{"message": {"content": content}}]}
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+def test_ask_many_preserves_order_and_bounds_concurrency():
+    with ThreadedGPTAPI() as chatbot:
+        msgs = [f"question {i}" * (i % 3 + 1) for i in range(20)]
+        assert chatbot.ask_many(msgs, concurrency=3) == msgs
+        assert chatbot.max_in_flight == 3
+    assert chatbot._executor is None
+
+
+def test_ask_many_captures_errors():
+    with ThreadedGPTAPI() as chatbot:
+        responses = chatbot.ask_many(["ok", "fail 1", "ok again"])
+        assert responses[0] == "ok"
+        assert isinstance(responses[1], RuntimeError)
+        assert responses[2] == "ok again"
+        with pytest.raises(RuntimeError):
+            chatbot.ask_many(["fail 2"], return_exceptions=False)
+
+
+def test_ask_many_as_completed_cancels_on_close():
+    chatbot = ThreadedGPTAPI()
+    completed = chatbot.ask_many_as_completed(["a", "b", "c", "d"], concurrency=1)
+    assert next(completed) == (0, "a")
+    completed.close()
+    chatbot.shutdown()
+    assert chatbot.max_in_flight == 1
+
+
+def test_ask_many_rate_limiter():
+    chatbot = ThreadedGPTAPI()
+    rate_limiter = RateLimiter(rpm=6000)  # 0.011s interval
+    start = time.perf_counter()
+    chatbot.ask_many(["a"] * 5, rate_limiter=rate_limiter)
+    assert time.perf_counter() - start >= 4 * rate_limiter.interval
+    chatbot.shutdown()
+
+
+class TransientGPTAPI(MockGPTAPI):
+    def __init__(self, failures):
+        self.failures = failures
+        self.calls = 0
+
+    def _fail(self):
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise ProviderException(code=429, message="Rate limited", retry_after=0)
+
+    def completion(self, messages):
+        self._fail()
+        return super().completion(messages[-1:] * 2)
+
+    async def acompletion_text(self, messages, stream=False):
+        self._fail()
+        return messages[-1]["content"]
+
+
+def test_ask_batch_retries_transient_errors():
+    chatbot = TransientGPTAPI(failures=2)
+    chatbot.retry_engine = RetryEngine(RetryPolicy(base_delay=0.001))
+    assert chatbot.ask_batch(["a", "b"]) == "a\nb"
+    assert chatbot.calls == 4
+
+
+@pytest.mark.asyncio
+async def test_aask_batch_retries_transient_errors():
+    chatbot = TransientGPTAPI(failures=1)
+    chatbot.retry_engine = RetryEngine(RetryPolicy(base_delay=0.001))
+    assert await chatbot.aask_batch(["a", "b"]) == "a\nb"
+    assert chatbot.retry_engine.stats().retries == 1
+
+
+def test_ask_without_retry_engine_fails():
+    with pytest.raises(ProviderException):
+        TransientGPTAPI(failures=1).ask("a")
+
+
+class StragglerGPTAPI(MockGPTAPI):
+    model = "gpt-3.5-turbo"
+
+    def __init__(self):
+        self.calls = 0
+
+    async def acompletion_text(self, messages, stream=False):
+        self.calls += 1
+        await asyncio.sleep(1 if self.calls == 1 else 0.001)
+        return messages[-1]["content"]
+
+
+@pytest.mark.asyncio
+async def test_hedged_acompletion_text_records_cancelled_loser():
+    cost_manager = CostManager()
+    cost_manager.reset()
+    chatbot = StragglerGPTAPI()
+    chatbot.hedger = Hedger(min_samples=1, budget=1)
+    chatbot.hedger.record_latency(0.01)
+    messages = [{"role": "user", "content": "hello"}]
+
+    assert await chatbot._acompletion_text(messages) == "hello"
+    assert chatbot.calls == 2
+    assert cost_manager.get_total_hedges() == 1
+    assert cost_manager.get_total_prompt_tokens() == count_message_tokens(
+        messages, chatbot.model
+    )
+    cost_manager.reset()
+
+
+@pytest.mark.asyncio
+async def test_hedged_aask_streams_winner():
+    CostManager().reset()
+    chatbot = StragglerGPTAPI()
+    chatbot.hedger = Hedger(min_samples=1, budget=1)
+    chatbot.hedger.record_latency(0.01)
+
+    assert await chatbot.aask("hello") == "hello"
+    assert chatbot.hedger.stats().hedge_wins == 1
+    assert chatbot.last_stream_stats.time_to_first_token < 1
+    CostManager().reset()
+
+
+class BilledGPTAPI(MockGPTAPI):
+    model = "gpt-3.5-turbo"
+
+    def completion(self, messages):
+        CostManager().update_cost(10, 1, self.model)
+        return super().completion(messages)
+
+
+def test_ask_many_attributes_costs_to_caller_scope():
+    cost_manager = CostManager()
+    cost_manager.reset()
+    with BilledGPTAPI() as chatbot, cost_scope(role="Engineer", tenant="acme"):
+        chatbot.ask_many(["a", "b", "c"])
+    snapshot = cost_manager.snapshot()
+    assert snapshot.by_key[("gpt-3.5-turbo", "Engineer", "acme")].requests == 3
+    cost_manager.reset()
+
+
+class StreamingGPTAPI(MockGPTAPI):
+    def __init__(self):
+        self.pulled = 0
+
+    async def acompletion_stream(self, messages):
+        for i, word in enumerate(messages[-1]["content"].split()):
+            await asyncio.sleep(0.01)
+            self.pulled += 1
+            yield word if i == 0 else " " + word
+
+
+@pytest.mark.asyncio
+async def test_astream_yields_deltas_and_records_stats():
+    chatbot = StreamingGPTAPI()
+    deltas = [delta async for delta in chatbot.astream("one two three")]
+
+    assert deltas == ["one", " two", " three"]
+    stats = chatbot.last_stream_stats
+    assert isinstance(stats, StreamStats)
+    assert 0 < stats.time_to_first_token <= stats.duration
+    assert stats.completion_tokens == 3
+    assert stats.tokens_per_second > 0
+
+
+@pytest.mark.asyncio
+async def test_astream_backpressure():
+    chatbot = StreamingGPTAPI()
+    async with aclosing(chatbot.astream("one two three four")) as deltas:
+        async for _ in deltas:
+            break
+    assert chatbot.pulled == 1
+    assert chatbot.last_stream_stats.completion_tokens == 1
+
+
+@pytest.mark.asyncio
+async def test_aask_consumes_stream():
+    chatbot = StreamingGPTAPI()
+    assert await chatbot.aask("one two") == "one two"
+    assert chatbot.last_stream_stats.completion_tokens == 2
+
+
+@pytest.mark.asyncio
+async def test_astream_default_falls_back_to_acompletion_text(mock_chatbot):
+    deltas = [delta async for delta in mock_chatbot.astream("hello")]
+    assert deltas == ["hello"]
+
+
+CODE_ANSWER = (
+    "Sure, here it is:\n```python\nprint('hello')\n```\n"
+    "This prints hello. It is a common first program in many languages."
+)
+
+
+class CodeStreamingGPTAPI(MockGPTAPI):
+    def __init__(self):
+        self.pulled = 0
+        self.closed = False
+
+    async def acompletion_stream(self, messages):
+        try:
+            for i in range(0, len(CODE_ANSWER), 4):
+                await asyncio.sleep(0)
+                self.pulled += 1
+                yield CODE_ANSWER[i : i + 4]
+        finally:
+            self.closed = True
+
+    def completion(self, messages):
+        return {"choices": [{"message": {"content": CODE_ANSWER}}]}
+
+
+@pytest.mark.asyncio
+async def test_astream_reports_its_own_stats():
+    chatbot = StreamingGPTAPI()
+    short, long = [], []
+
+    async def collect(msg, stats):
+        messages = chatbot._question_msgs(msg)
+        async with aclosing(chatbot._astream(messages, stats.append)) as deltas:
+            return "".join([delta async for delta in deltas])
+
+    await asyncio.gather(collect("one", short), collect("one two three four", long))
+    assert short[0].completion_tokens == 1
+    assert long[0].completion_tokens == 4
+
+
+@pytest.mark.asyncio
+async def test_aask_code_stops_stream_when_block_closes():
+    chatbot = CodeStreamingGPTAPI()
+    code = await chatbot.aask_code(["Say hello in Python"])
+
+    assert code == "print('hello')"
+    assert chatbot.closed
+    assert chatbot.pulled < len(CODE_ANSWER) // 4
+    stats = chatbot.last_code_stats
+    assert isinstance(stats, CodeStats)
+    assert stats.stopped_early
+    assert stats.completion_tokens == chatbot.last_stream_stats.completion_tokens
+    assert 0 < stats.code_tokens < stats.completion_tokens
+    assert stats.tokens_saved == CONFIG.max_tokens_rsp - stats.completion_tokens
+
+
+@pytest.mark.asyncio
+async def test_aask_code_by_language_and_without_block(mock_chatbot):
+    chatbot = CodeStreamingGPTAPI()
+    assert await chatbot.aask_code(["Say hello in Rust"], lang="rust") == CODE_ANSWER
+    assert not chatbot.last_code_stats.stopped_early
+    assert chatbot.last_code_stats.tokens_saved == 0
+    assert await mock_chatbot.aask_code(["plain answer"]) == "plain answer"
+
+
+def test_ask_code_extracts_code():
+    assert CodeStreamingGPTAPI().ask_code(["Say hello in Python"]) == "print('hello')"
+
+
+class UsageGPTAPI(MockGPTAPI):
+    model = "gpt-3.5-turbo-0613"
+
+    async def acompletion(self, messages):
+        return {
+            "choices": [{"message": {"content": "ok"}}],
+            "usage": {"total_tokens": 1000},
+        }
+
+
+@pytest.mark.asyncio
+async def test_token_limiter_charges_estimate_and_reconciles_usage():
+    chatbot = UsageGPTAPI()
+    chatbot.token_limiter = TokenBucketLimiter(rpm=1000, tpm=100000, clock=lambda: 0.0)
+    messages = chatbot._question_msgs("hello")
+    estimate = count_message_tokens(messages, chatbot.model)
+
+    await chatbot._acompletion(messages)
+    assert chatbot.token_limiter.available()[1] == pytest.approx(100000 - 1000, abs=5)
+
+    await chatbot._acompletion_text(messages)
+    used = estimate + 1  # "hello" is replayed as a one token answer
+    assert chatbot.token_limiter.available()[1] == pytest.approx(
+        100000 - 1000 - used, abs=5
+    )
+
+
+@pytest.mark.asyncio
+async def test_token_limiter_reconciles_streams():
+    chatbot = StreamingGPTAPI()
+    chatbot.token_limiter = TokenBucketLimiter(rpm=1000, tpm=100000, clock=lambda: 0.0)
+    messages = chatbot._question_msgs("one two three")
+    estimate = count_message_tokens(messages, chatbot.model)
+    assert await chatbot.aask("one two three") == "one two three"
+    assert chatbot.token_limiter.available()[1] == pytest.approx(
+        100000 - estimate - 3, abs=5
+    )
+
+
+def test_token_limiter_admits_sync_calls(mock_chatbot):
+    mock_chatbot.token_limiter = TokenBucketLimiter(
+        rpm=1000, tpm=100000, clock=lambda: 0.0
+    )
+    assert mock_chatbot.ask_batch(["hello"]) == "hello"
+    assert mock_chatbot.token_limiter.available()[0] == pytest.approx(999, abs=1)
+
+
+class ThrottlingGPTAPI(MockGPTAPI):
+    model = "gpt-3.5-turbo-0613"
+
+    def __init__(self, throttled):
+        self.throttled = throttled
+
+    async def acompletion(self, messages):
+        if self.throttled:
+            self.throttled -= 1
+            raise ProviderException(code=429, message="Rate limited")
+        return {"choices": [{"message": {"content": "ok"}}]}
+
+
+@pytest.mark.asyncio
+async def test_adaptive_limiter_adapts_to_provider_feedback():
+    chatbot = ThrottlingGPTAPI(throttled=1)
+    now = [0.0]
+    chatbot.token_limiter = AdaptiveRateLimiter(rpm=600, clock=lambda: now[0])
+    messages = chatbot._question_msgs("hello")
+    with pytest.raises(ProviderException):
+        await chatbot._acompletion(messages)
+    assert chatbot.token_limiter.rpm == 300
+    now[0] = 1.0
+    await chatbot._acompletion(messages)
+    assert chatbot.token_limiter.rpm == 301
+
+
+class FailingReconcileStore(MemoryBucketStore):
+    def __init__(self):
+        super().__init__()
+        self.threads = []
+
+    def _take(self, buckets):
+        self.threads.append(threading.get_ident())
+        if len(self.threads) % 2 == 0:
+            raise TimeoutError("bucket store timed out")
+        return super()._take(buckets)
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("api_class", [UsageGPTAPI, StreamingGPTAPI])
+async def test_shared_limiter_reconciles_off_the_loop_and_logs_errors(api_class):
+    chatbot = api_class()
+    store = FailingReconcileStore()
+    chatbot.token_limiter = SharedRateLimiter(store, "api", rpm=1000, tpm=100000)
+    assert await chatbot.aask("one two three")
+    # Admission and reconciliation both ran on worker threads; the failed reconcile was logged.
+    assert len(store.threads) == 2
+    assert threading.get_ident() not in store.threads
+
+
 # Add more tests for other methods and scenarios
 
 # Run tests
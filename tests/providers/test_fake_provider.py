@@ -0,0 +1,133 @@
+import asyncio
+import json
+import random
+import time
+import urllib.error
+import urllib.request
+
+import pytest
+from metacogitor.exceptions import ProviderException
+from metacogitor.providers import FakeGPTAPI, FakeProviderServer, LatencyDistribution
+from metacogitor.utils import RetryEngine, RetryPolicy
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+def post(url, body):
+    request = urllib.request.Request(
+        url + "/chat/completions",
+        data=json.dumps(body).encode(),
+        headers={"Content-Type": "application/json"},
+    )
+    return urllib.request.urlopen(request)
+
+
+@pytest.mark.parametrize(
+    "distribution,low,high",
+    [
+        (LatencyDistribution("constant", mean=0.5), 0.5, 0.5),
+        (LatencyDistribution("uniform", low=0.1, high=0.2), 0.1, 0.2),
+        (LatencyDistribution("normal", mean=0.1, sigma=1), 0, float("inf")),
+        (LatencyDistribution("lognormal", mean=0.1, sigma=0.05), 0, float("inf")),
+    ],
+)
+def test_latency_distributions(distribution, low, high):
+    rng = random.Random(0)
+    samples = [distribution.sample(rng) for _ in range(2000)]
+    assert all(low <= sample <= high for sample in samples)
+    if distribution.kind == "lognormal":
+        assert sum(samples) / len(samples) == pytest.approx(0.1, rel=0.1)
+
+
+def test_unknown_latency_distribution():
+    with pytest.raises(ValueError):
+        LatencyDistribution("pareto").sample(random.Random(0))
+
+
+def test_replies_are_deterministic():
+    first = FakeGPTAPI(seed=1, update_costs=False)
+    second = FakeGPTAPI(seed=1, update_costs=False)
+    assert first.ask("hello") == second.ask("hello") == first.ask("hello")
+    assert first.ask("hello") != FakeGPTAPI(seed=2, update_costs=False).ask("hello")
+
+
+def test_completion_reports_usage():
+    rsp = FakeGPTAPI(completion_tokens=(5, 5), update_costs=False).completion(MESSAGES)
+    assert rsp["usage"]["completion_tokens"] == 5
+    assert rsp["usage"]["prompt_tokens"] > 0
+    assert len(rsp["choices"][0]["message"]["content"].split()) == 5
+
+
+@pytest.mark.asyncio
+async def test_async_and_streaming_agree():
+    api = FakeGPTAPI(tokens_per_second=2000, update_costs=False)
+    text = api.get_choice_text(await api.acompletion(MESSAGES))
+    deltas = [delta async for delta in api.acompletion_stream(MESSAGES)]
+    assert "".join(deltas) == text
+    assert await api.acompletion_text(MESSAGES, stream=True) == text
+    assert len(deltas) > 1
+
+
+@pytest.mark.asyncio
+async def test_token_rate_and_time_to_first_token():
+    api = FakeGPTAPI(
+        time_to_first_token=LatencyDistribution("constant", mean=0.05),
+        tokens_per_second=200,
+        completion_tokens=(11, 11),
+        update_costs=False,
+    )
+    start = time.perf_counter()
+    assert len(await api.aask("hello")) > 0
+    assert time.perf_counter() - start >= 0.05 + 10 / 200
+    assert api.last_stream_stats.time_to_first_token >= 0.05
+
+
+def test_error_injection_is_transient_and_retried():
+    api = FakeGPTAPI(error_rate=0.5, retry_after=0, update_costs=False)
+    with pytest.raises(ProviderException) as exc_info:
+        for i in range(20):
+            api.completion([{"role": "user", "content": str(i)}])
+    assert exc_info.value.status == 429
+
+    api.retry_engine = RetryEngine(RetryPolicy(max_attempts=20))
+    assert len(api.ask_many([str(i) for i in range(20)])) == 20
+    api.shutdown()
+
+
+def test_attempt_counts_are_bounded():
+    api = FakeGPTAPI(error_rate=0.5, max_tracked_prompts=8, update_costs=False)
+    for i in range(100):
+        try:
+            api.completion([{"role": "user", "content": str(i)}])
+        except ProviderException:
+            pass
+    assert len(api._attempts) == 8
+    assert api.requests == 100
+
+
+def test_http_server():
+    api = FakeGPTAPI(tokens_per_second=2000, update_costs=False)
+    with FakeProviderServer(api) as server:
+        rsp = json.loads(post(server.url, {"messages": MESSAGES}).read())
+        assert rsp == {**rsp, "object": "chat.completion"}
+        text = rsp["choices"][0]["message"]["content"]
+
+        stream = post(server.url, {"messages": MESSAGES, "stream": True})
+        assert stream.headers["Content-Type"] == "text/event-stream"
+        events = [
+            line[len("data: ") :]
+            for line in stream.read().decode().splitlines()
+            if line.startswith("data: ")
+        ]
+        assert events[-1] == "[DONE]"
+        deltas = [json.loads(e)["choices"][0]["delta"]["content"] for e in events[:-1]]
+        assert "".join(deltas) == text
+
+
+def test_http_server_errors():
+    api = FakeGPTAPI(error_rate=1, error_status=503, retry_after=2, update_costs=False)
+    with FakeProviderServer(api) as server:
+        with pytest.raises(urllib.error.HTTPError) as exc_info:
+            post(server.url, {"messages": MESSAGES, "stream": True})
+        assert exc_info.value.code == 503
+        assert exc_info.value.headers["Retry-After"] == "2"
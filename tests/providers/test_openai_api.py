@@ -0,0 +1,200 @@
+import asyncio
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+from metacogitor.exceptions import ProviderException
+from metacogitor.providers import (
+    FakeGPTAPI,
+    FakeProviderServer,
+    OpenAIGPTAPI,
+)
+from metacogitor.utils import CostManager, RetryPolicy, SSEDecoder
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+@pytest.fixture
+def fake():
+    return FakeGPTAPI(model="gpt-3.5-turbo", tokens_per_second=5000, update_costs=False)
+
+
+@pytest.fixture
+def server(fake):
+    with FakeProviderServer(fake) as server:
+        yield server
+
+
+@pytest.fixture
+def api(server):
+    api = OpenAIGPTAPI(model="gpt-3.5-turbo", api_key="test", api_base=server.url)
+    yield api
+    api.close()
+
+
+def test_sse_decoder_handles_split_events():
+    decoder = SSEDecoder()
+    stream = (
+        b'data: {"a": 1}\r\n\r\n: comment\n\ndata: line 1\ndata: line 2\n\ndata: [DONE]'
+    )
+    events = []
+    for i in range(0, len(stream), 3):
+        events += decoder.feed(stream[i : i + 3])
+    events += decoder.flush()
+    assert events == ['{"a": 1}', "line 1\nline 2", "[DONE]"]
+
+
+def test_azure_url_and_headers():
+    api = OpenAIGPTAPI(
+        api_key="key",
+        api_base="https://example.openai.azure.com/",
+        api_type="azure",
+        api_version="2023-05-15",
+        deployment_id="gpt35",
+    )
+    assert api.url == (
+        "https://example.openai.azure.com/openai/deployments/gpt35"
+        "/chat/completions?api-version=2023-05-15"
+    )
+    assert api._headers() == {"api-key": "key"}
+    assert "model" not in api._payload(MESSAGES)
+
+
+def test_completion_reuses_connection(api, server, fake):
+    expected = fake.get_choice_text(fake.completion(MESSAGES))
+    for _ in range(5):
+        assert api.ask("hello") == api.ask("hello")
+    assert api.get_choice_text(api.completion(MESSAGES)) == expected
+    assert server.connections == 1
+
+
+@pytest.mark.asyncio
+async def test_acompletion_and_stream_reuse_connections(api, server, fake):
+    expected = fake.get_choice_text(fake.completion(MESSAGES))
+    assert api.get_choice_text(await api.acompletion(MESSAGES)) == expected
+    deltas = [delta async for delta in api.acompletion_stream(MESSAGES)]
+    assert len(deltas) > 1
+    assert "".join(deltas) == expected
+    answers = await asyncio.gather(*[api.aask(f"question {i}") for i in range(4)])
+    assert len(set(answers)) == 4
+    for _ in range(5):
+        await api.acompletion_text(MESSAGES, stream=True)
+    assert server.connections <= 4
+    await api.aclose()
+
+
+@pytest.mark.asyncio
+async def test_usage_is_reported_to_cost_manager(api):
+    cost_manager = CostManager()
+    cost_manager.reset()
+    rsp = await api.acompletion(MESSAGES)
+    assert cost_manager.get_total_completion_tokens() == (
+        rsp["usage"]["completion_tokens"]
+    )
+
+    cost_manager.reset()
+    text = await api.acompletion_text(MESSAGES, stream=True)
+    assert cost_manager.get_total_prompt_tokens() == rsp["usage"]["prompt_tokens"]
+    assert cost_manager.get_total_completion_tokens() > 0
+    assert text == api.get_choice_text(rsp)
+    cost_manager.reset()
+    await api.aclose()
+
+
+class StallingHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        self.wfile.flush()
+        time.sleep(1)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_stream_cancelled_before_output_is_not_billed():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), StallingHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    api = OpenAIGPTAPI(
+        model="gpt-3.5-turbo",
+        api_key="test",
+        api_base=f"http://127.0.0.1:{httpd.server_address[1]}",
+    )
+    cost_manager = CostManager()
+    cost_manager.reset()
+    stream = api.acompletion_stream(MESSAGES)
+    first_delta = asyncio.ensure_future(stream.__anext__())
+    await asyncio.sleep(0.3)
+    first_delta.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first_delta
+    # A hedged loser is billed once, by the hedger.
+    assert cost_manager.get_total_prompt_tokens() == 0
+    await api.aclose()
+    httpd.shutdown()
+    httpd.server_close()
+
+
+class DisconnectingHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.close_connection = True
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_transport_errors_are_retryable_provider_exceptions():
+    httpd = ThreadingHTTPServer(("127.0.0.1", 0), DisconnectingHandler)
+    threading.Thread(target=httpd.serve_forever, daemon=True).start()
+    port = httpd.server_address[1]
+    api = OpenAIGPTAPI(
+        model="gpt-3.5-turbo", api_key="test", api_base=f"http://127.0.0.1:{port}"
+    )
+    policy = RetryPolicy()
+    calls = [
+        api.acompletion(MESSAGES),
+        api.acompletion_stream(MESSAGES).__anext__(),
+        asyncio.to_thread(api.completion, MESSAGES),
+    ]
+    for call in calls:
+        with pytest.raises(ProviderException) as exc_info:
+            await call
+        # The provider may have processed the request before dropping it.
+        assert exc_info.value.status == 502
+        assert policy.is_retryable(exc_info.value)
+        assert not policy.is_retryable(exc_info.value, idempotent=False)
+    await api.aclose()
+    api.close()
+    httpd.shutdown()
+    httpd.server_close()
+
+    refused = OpenAIGPTAPI(
+        model="gpt-3.5-turbo", api_key="test", api_base=f"http://127.0.0.1:{port}"
+    )
+    with pytest.raises(ProviderException) as exc_info:
+        await refused.acompletion(MESSAGES)
+    assert exc_info.value.status == 503
+    assert policy.is_retryable(exc_info.value, idempotent=False)
+    await refused.aclose()
+
+
+@pytest.mark.asyncio
+async def test_errors_raise_provider_exception(fake, api):
+    fake.error_rate = 1
+    fake.retry_after = 3
+    with pytest.raises(ProviderException) as exc_info:
+        await api.acompletion(MESSAGES)
+    assert exc_info.value.status == 429
+    assert exc_info.value.retry_after == 3
+    assert exc_info.value.endpoint == api.url
+    with pytest.raises(ProviderException):
+        [delta async for delta in api.acompletion_stream(MESSAGES)]
+    with pytest.raises(ProviderException):
+        api.completion(MESSAGES)
+    await api.aclose()
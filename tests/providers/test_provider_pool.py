@@ -0,0 +1,139 @@
+import asyncio
+
+import pytest
+from metacogitor.exceptions import ProviderException
+from metacogitor.providers import (
+    FakeGPTAPI,
+    LatencyDistribution,
+    PoolMember,
+    ProviderPool,
+)
+
+MESSAGES = [{"role": "user", "content": "hello"}]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def fake(latency=0.0, **kwargs):
+    return FakeGPTAPI(
+        time_to_first_token=LatencyDistribution("constant", mean=latency),
+        completion_tokens=(3, 3),
+        update_costs=False,
+        **kwargs,
+    )
+
+
+def test_pool_needs_members():
+    with pytest.raises(ValueError):
+        ProviderPool([])
+
+
+def test_pool_names_members_and_takes_model():
+    pool = ProviderPool([fake(), PoolMember(fake(), name="azure-east")])
+    assert [stats.name for stats in pool.stats()] == ["FakeGPTAPI-0", "azure-east"]
+    assert pool.model == pool.members[0].provider.model
+
+
+@pytest.mark.asyncio
+async def test_least_outstanding_routing_spreads_concurrent_requests():
+    members = [fake(0.05), fake(0.05), fake(0.05)]
+    pool = ProviderPool(members)
+    await asyncio.gather(*[pool.acompletion(MESSAGES) for _ in range(9)])
+    assert [member.requests for member in members] == [3, 3, 3]
+    assert all(stats.outstanding == 0 for stats in pool.stats())
+
+
+def test_latency_breaks_ties():
+    slow, fast = fake(0.05), fake(0.0)
+    pool = ProviderPool([slow, fast])
+    for _ in range(5):
+        pool.completion(MESSAGES)
+    assert slow.requests == 1
+    assert fast.requests == 4
+    assert pool.stats()[0].latency > pool.stats()[1].latency
+
+
+@pytest.mark.asyncio
+async def test_throttled_member_is_ejected_and_fails_over():
+    clock = FakeClock()
+    throttled = fake(error_rate=1.0, error_status=429, retry_after=20)
+    healthy = fake()
+    pool = ProviderPool([throttled, healthy], ejection_time=5, clock=clock)
+
+    assert await pool.aask("hello")
+    assert throttled.requests == 1
+    assert healthy.requests == 1
+    assert pool.stats()[0].ejected
+    assert pool.stats()[0].ejections == 1
+
+    for _ in range(3):
+        await pool.aask("again")
+    assert throttled.requests == 1
+
+    clock.now = 21
+    assert not pool.stats()[0].ejected
+    await pool.acompletion([{"role": "user", "content": "later"}])
+    assert throttled.requests == 2
+    # Consecutive throttles keep the longest of the backoff and Retry-After.
+    assert pool.members[0].ejected_until == 21 + 20
+
+
+def test_consecutive_throttles_back_off():
+    clock = FakeClock()
+    throttled = fake(error_rate=1.0, error_status=429)
+    pool = ProviderPool([throttled], ejection_time=1, max_ejection_time=3, clock=clock)
+    ejections = []
+    for _ in range(4):
+        clock.now = pool.members[0].ejected_until
+        with pytest.raises(ProviderException):
+            pool.completion(MESSAGES)
+        ejections.append(pool.members[0].ejected_until - clock.now)
+    assert ejections == [1, 2, 3, 3]
+
+
+@pytest.mark.asyncio
+async def test_other_errors_do_not_eject():
+    failing = fake(error_rate=1.0, error_status=500)
+    pool = ProviderPool([failing, fake(0.1)])
+    with pytest.raises(ProviderException):
+        await pool.acompletion(MESSAGES)
+    stats = pool.stats()[0]
+    assert stats.failures == 1
+    assert not stats.ejected
+    assert stats.outstanding == 0
+
+
+@pytest.mark.asyncio
+async def test_stream_fails_over_and_releases_members():
+    throttled = fake(error_rate=1.0, error_status=429)
+    healthy = fake()
+    pool = ProviderPool([throttled, healthy])
+    deltas = [delta async for delta in pool.astream("hello")]
+    assert len(deltas) == 3
+    assert pool.stats()[0].ejected
+    assert [stats.outstanding for stats in pool.stats()] == [0, 0]
+
+
+@pytest.mark.asyncio
+async def test_cancelled_request_releases_member():
+    pool = ProviderPool([fake(1.0)])
+    task = asyncio.ensure_future(pool.acompletion(MESSAGES))
+    await asyncio.sleep(0.01)
+    assert pool.stats()[0].outstanding == 1
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert pool.stats()[0].outstanding == 0
+    assert pool.stats()[0].failures == 0
+
+
+def test_members_have_their_own_rate_limiter():
+    pool = ProviderPool([PoolMember(fake(), rpm=60), PoolMember(fake())])
+    assert pool.members[0].rate_limiter.rpm == 60
+    assert pool.members[1].rate_limiter is None
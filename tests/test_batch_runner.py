@@ -0,0 +1,151 @@
+import asyncio
+import json
+
+import pytest
+from metacogitor.batch_runner import (
+    BatchRunner,
+    load_completed,
+    main,
+    read_items,
+    repair_output,
+)
+from metacogitor.providers import FakeGPTAPI
+
+
+def write_prompts(path, count):
+    with open(path, "w", encoding="utf-8") as file:
+        for i in range(count):
+            file.write(
+                json.dumps({"id": f"item-{i}", "prompt": f"question {i}"}) + "\n"
+            )
+
+
+def read_results(path):
+    with open(path, encoding="utf-8") as file:
+        return [json.loads(line) for line in file]
+
+
+def fake(**kwargs):
+    return FakeGPTAPI(completion_tokens=(3, 3), **kwargs)
+
+
+def test_read_items(tmp_path):
+    path = tmp_path / "input.jsonl"
+    path.write_text(
+        '{"prompt": "a"}\n\n{"id": 7, "messages": [{"role": "user", "content": "b"}]}\n'
+    )
+    items = list(read_items(path))
+    assert [item.id for item in items] == [1, 7]
+    assert items[0].prompt == "a"
+    assert items[1].messages == [{"role": "user", "content": "b"}]
+
+
+def test_read_items_rejects_invalid_lines(tmp_path):
+    path = tmp_path / "input.jsonl"
+    path.write_text('{"text": "a"}\n')
+    with pytest.raises(ValueError):
+        list(read_items(path))
+
+
+def test_run_writes_every_result(tmp_path):
+    write_prompts(tmp_path / "input.jsonl", 20)
+    api = fake()
+    progress = BatchRunner(api, concurrency=4).run(
+        tmp_path / "input.jsonl", tmp_path / "output.jsonl"
+    )
+    results = read_results(tmp_path / "output.jsonl")
+    assert sorted(r["id"] for r in results) == sorted(f"item-{i}" for i in range(20))
+    assert all(r["response"] for r in results)
+    assert progress.total == progress.completed == 20
+    assert progress.failed == progress.skipped == 0
+    assert progress.eta == 0
+    assert progress.cost > 0
+    assert progress.throughput > 0
+    assert "20/20 done" in str(progress)
+
+
+def test_run_resumes_from_output(tmp_path):
+    write_prompts(tmp_path / "input.jsonl", 10)
+    with open(tmp_path / "output.jsonl", "w", encoding="utf-8") as file:
+        for i in range(4):
+            file.write(json.dumps({"id": f"item-{i}", "response": "done"}) + "\n")
+        file.write('{"id": "item-4", "respo')  # cut short by a crash
+    assert len(load_completed(tmp_path / "output.jsonl")) == 4
+
+    api = fake(update_costs=False)
+    progress = BatchRunner(api).run(tmp_path / "input.jsonl", tmp_path / "output.jsonl")
+    assert api.requests == 6
+    assert progress.skipped == 4
+    assert progress.completed == 6
+    results = read_results(tmp_path / "output.jsonl")
+    assert sorted(r["id"] for r in results) == sorted(f"item-{i}" for i in range(10))
+
+
+def test_invalid_results_are_skipped_and_only_a_partial_line_is_truncated(tmp_path):
+    path = tmp_path / "output.jsonl"
+    lines = [
+        json.dumps({"id": "item-0", "response": "done"}),
+        "not json",
+        json.dumps({"response": "no id"}),
+        json.dumps({"id": "item-3", "response": "done"}),
+    ]
+    path.write_text("\n".join(lines) + '\n{"id": "item-4", "respo')
+    completed = load_completed(path)
+    assert completed == {json.dumps("item-0"), json.dumps("item-3")}
+    assert path.read_text().endswith('"respo')
+
+    assert repair_output(path) == len('{"id": "item-4", "respo')
+    assert path.read_text() == "\n".join(lines) + "\n"
+    assert repair_output(path) == 0
+    assert load_completed(path) == completed
+
+
+def test_failed_items_are_retried_by_next_run(tmp_path):
+    write_prompts(tmp_path / "input.jsonl", 5)
+    api = fake(update_costs=False, error_rate=1.0)
+    progress = BatchRunner(api).run(tmp_path / "input.jsonl", tmp_path / "output.jsonl")
+    assert progress.failed == 5
+    assert len(read_results(tmp_path / "output.jsonl.errors.jsonl")) == 5
+
+    api.error_rate = 0.0
+    progress = BatchRunner(api).run(tmp_path / "input.jsonl", tmp_path / "output.jsonl")
+    assert progress.completed == 5
+    assert len(read_results(tmp_path / "output.jsonl")) == 5
+
+
+def test_concurrency_is_bounded(tmp_path):
+    write_prompts(tmp_path / "input.jsonl", 12)
+    in_flight = 0
+    peak = 0
+
+    class TrackingGPTAPI(FakeGPTAPI):
+        async def acompletion_stream(self, messages):
+            nonlocal in_flight, peak
+            in_flight += 1
+            peak = max(peak, in_flight)
+            try:
+                await asyncio.sleep(0.01)
+                async for delta in super().acompletion_stream(messages):
+                    yield delta
+            finally:
+                in_flight -= 1
+
+    BatchRunner(TrackingGPTAPI(update_costs=False), concurrency=3).run(
+        tmp_path / "input.jsonl", tmp_path / "output.jsonl"
+    )
+    assert peak == 3
+
+
+def test_main(tmp_path, capsys):
+    write_prompts(tmp_path / "input.jsonl", 3)
+    main(
+        [
+            str(tmp_path / "input.jsonl"),
+            str(tmp_path / "output.jsonl"),
+            "--fake",
+            "--concurrency",
+            "2",
+        ]
+    )
+    assert len(read_results(tmp_path / "output.jsonl")) == 3
+    assert "3/3 done" in capsys.readouterr().out
@@ -0,0 +1,105 @@
+import asyncio
+from contextlib import aclosing
+
+import pytest
+from metacogitor.utils import amap_as_completed
+
+
+class Tracker:
+    def __init__(self):
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.pulled = 0
+        self.cancelled = 0
+
+    def items(self, count):
+        for i in range(count):
+            self.pulled += 1
+            yield i
+
+    async def square(self, item):
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            await asyncio.sleep(0.001 * (item % 3))
+            return item * item
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        finally:
+            self.in_flight -= 1
+
+
+@pytest.mark.asyncio
+async def test_amap_streams_items_with_bounded_concurrency():
+    tracker = Tracker()
+    results = {}
+    async for index, result in amap_as_completed(
+        tracker.square, tracker.items(200), concurrency=4
+    ):
+        # Items are pulled only when a slot frees up, never ahead of the results.
+        assert tracker.pulled <= len(results) + 4 + 1
+        results[index] = result
+    assert results == {i: i * i for i in range(200)}
+    assert tracker.max_in_flight == 4
+
+
+@pytest.mark.asyncio
+async def test_amap_accepts_async_iterables():
+    async def items():
+        for i in range(10):
+            await asyncio.sleep(0)
+            yield i
+
+    tracker = Tracker()
+    results = dict([r async for r in amap_as_completed(tracker.square, items(), 3)])
+    assert results == {i: i * i for i in range(10)}
+
+
+@pytest.mark.asyncio
+async def test_amap_yields_or_raises_exceptions():
+    async def check(item):
+        if item == 2:
+            raise ValueError(item)
+        return item
+
+    results = dict([r async for r in amap_as_completed(check, range(5))])
+    assert isinstance(results.pop(2), ValueError)
+    assert results == {0: 0, 1: 1, 3: 3, 4: 4}
+
+    with pytest.raises(ValueError):
+        async for _ in amap_as_completed(check, range(5), return_exceptions=False):
+            pass
+
+
+@pytest.mark.asyncio
+async def test_amap_waits_on_rate_limiter_and_cancels_on_close():
+    class CountingLimiter:
+        calls = 0
+
+        async def wait_if_needed(self, num_requests):
+            self.calls += num_requests
+
+    limiter = CountingLimiter()
+    tracker = Tracker()
+
+    async def slow(item):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            tracker.cancelled += 1
+            raise
+
+    async with aclosing(
+        amap_as_completed(
+            lambda item: tracker.square(0) if item == 0 else slow(item),
+            tracker.items(1000000),
+            concurrency=5,
+            rate_limiter=limiter,
+        )
+    ) as results:
+        assert await results.__anext__() == (0, 0)
+    await asyncio.sleep(0)
+    assert limiter.calls == 5
+    assert tracker.pulled == 5
+    assert tracker.cancelled == 4
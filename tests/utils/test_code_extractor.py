@@ -0,0 +1,56 @@
+import pytest
+from metacogitor.utils import CodeBlockExtractor, extract_code
+
+ANSWER = """Here is the code:
+
+```python
+def add(a, b):
+    return a + b
+```
+
+It adds two numbers. Let me know if you need anything else."""
+
+
+def test_extract_code():
+    assert extract_code(ANSWER) == "def add(a, b):\n    return a + b"
+
+
+def test_extract_code_without_block():
+    assert extract_code("no code here") is None
+
+
+def test_extract_code_by_language():
+    text = "```bash\npip install x\n```\n```python\nimport x\n```\n"
+    assert extract_code(text) == "pip install x"
+    assert extract_code(text, "python") == "import x"
+    assert extract_code(text, "rust") is None
+
+
+def test_longer_fences_nest_shorter_ones():
+    text = "````markdown\n```python\nx = 1\n```\n````\nafter"
+    assert extract_code(text) == "```python\nx = 1\n```"
+
+
+def test_unclosed_block_ends_with_stream():
+    assert extract_code("```\nx = 1\ny = 2") == "x = 1\ny = 2"
+
+
+@pytest.mark.parametrize("size", [1, 2, 5, 17])
+def test_feed_reports_close_as_soon_as_fence_line_ends(size):
+    extractor = CodeBlockExtractor()
+    deltas = [ANSWER[i : i + size] for i in range(0, len(ANSWER), size)]
+    for count, delta in enumerate(deltas, 1):
+        if extractor.feed(delta):
+            break
+    assert extractor.done
+    closed_at = ANSWER.index("```\n\nIt") + len("```\n")
+    assert len(extractor.text) - size < closed_at <= len(extractor.text)
+    assert count < len(deltas)
+    assert extractor.finish() == "def add(a, b):\n    return a + b"
+
+
+def test_feed_after_done_is_ignored():
+    extractor = CodeBlockExtractor()
+    assert extractor.feed("```\nx\n```\n")
+    assert extractor.feed("more prose")
+    assert extractor.text == "```\nx\n```\n"
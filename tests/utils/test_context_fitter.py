@@ -0,0 +1,63 @@
+import pytest
+
+from metacogitor.exceptions import ContextOverflowException
+from metacogitor.utils import TokenLedger, count_message_tokens, fit_messages
+
+
+SYSTEM = {"role": "system", "content": "You are a helpful assistant."}
+
+
+def _conversation(turns):
+    messages = [SYSTEM]
+    for i in range(turns):
+        messages.append({"role": "user", "content": f"question number {i} " * 5})
+        messages.append({"role": "assistant", "content": f"answer number {i} " * 5})
+    messages.append({"role": "user", "content": "final question"})
+    return messages
+
+
+def test_fit_messages_keeps_everything_when_it_fits():
+    messages = _conversation(3)
+    assert fit_messages(messages) == messages
+
+
+def test_fit_messages_keeps_largest_suffix():
+    messages = _conversation(200)
+    max_tokens = 1000
+    fitted = fit_messages(messages, max_tokens=max_tokens, reserve=100)
+
+    assert fitted[0] == SYSTEM
+    assert fitted[-1] == messages[-1]
+    assert fitted[1:] == messages[len(messages) - len(fitted) + 1 :]
+    assert count_message_tokens(fitted) <= max_tokens - 100
+    # One more message of history would not fit
+    longer = [SYSTEM] + messages[len(messages) - len(fitted) :]
+    assert count_message_tokens(longer) > max_tokens - 100
+
+
+def test_fit_messages_reuses_ledger():
+    ledger = TokenLedger(_conversation(50))
+    fitted = fit_messages(ledger, max_tokens=500)
+    assert count_message_tokens(fitted) <= 500
+
+
+def test_fit_messages_priority():
+    messages = _conversation(20)
+    messages[3]["pinned"] = "yes"
+    fitted = fit_messages(
+        messages,
+        max_tokens=300,
+        priority=lambda message: 1 if "pinned" in message else 0,
+    )
+    assert messages[3] in fitted
+    assert fitted[0] == SYSTEM
+    assert fitted[-1] == messages[-1]
+    assert count_message_tokens(fitted) <= 300
+    positions = [messages.index(message) for message in fitted]
+    assert positions == sorted(positions)
+
+
+def test_fit_messages_overflow():
+    messages = [SYSTEM, {"role": "user", "content": "word " * 5000}]
+    with pytest.raises(ContextOverflowException):
+        fit_messages(messages)
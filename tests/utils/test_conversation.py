@@ -0,0 +1,86 @@
+import sys
+
+import pytest
+from metacogitor.utils import ChatMessage, Conversation, shared_system_prefix
+
+
+def test_chat_message_is_compact_and_immutable():
+    message = ChatMessage("user", "hello")
+    assert not hasattr(message, "__dict__")
+    assert message.to_dict() == {"role": "user", "content": "hello"}
+    with pytest.raises(AttributeError):
+        message.content = "changed"
+
+
+def test_chat_message_interns_roles():
+    role = "".join(["tool", "_call"])
+    assert ChatMessage(role, "a").role is sys.intern("tool_call")
+
+
+def test_chat_message_round_trip_with_name():
+    message = {"role": "user", "content": "hi", "name": "bob"}
+    assert ChatMessage.from_dict(message).to_dict() == message
+
+
+def test_conversations_share_system_prefix():
+    first = Conversation(["You are a helpful assistant."])
+    second = Conversation(["You are a helpful assistant."])
+    assert first.prefix is second.prefix
+    assert shared_system_prefix(("You are a helpful assistant.",)) is first.prefix
+
+
+def test_conversation_to_dicts():
+    conversation = Conversation(["system prompt"])
+    conversation.add_user("question")
+    conversation.add_assistant("answer")
+    conversation.append("user", "follow up", name="bob")
+
+    assert len(conversation) == 4
+    assert conversation[0].role == "system"
+    assert conversation[-1].content == "follow up"
+    assert conversation.to_dicts() == [
+        {"role": "system", "content": "system prompt"},
+        {"role": "user", "content": "question"},
+        {"role": "assistant", "content": "answer"},
+        {"role": "user", "content": "follow up", "name": "bob"},
+    ]
+    with pytest.raises(IndexError):
+        conversation[4]
+    with pytest.raises(IndexError):
+        conversation[-5]
+
+
+def test_conversation_from_dicts():
+    messages = [
+        {"role": "system", "content": "a"},
+        {"role": "system", "content": "b"},
+        {"role": "user", "content": "c"},
+    ]
+    conversation = Conversation.from_dicts(messages)
+    assert len(conversation.prefix) == 2
+    assert conversation.to_dicts() == messages
+
+
+def test_fork_shares_history_and_isolates_appends():
+    conversation = Conversation(["system prompt"])
+    conversation.add_user("root")
+    branch = conversation.fork()
+    branch.add_assistant("branch answer")
+    conversation.add_assistant("main answer")
+
+    assert [m.content for m in conversation] == ["system prompt", "root", "main answer"]
+    assert [m.content for m in branch] == ["system prompt", "root", "branch answer"]
+    assert branch[1] is conversation[1]
+    assert branch._tail.parent is conversation._tail.parent
+
+
+def test_fork_is_constant_time():
+    conversation = Conversation()
+    for i in range(10000):
+        conversation.add_user(str(i))
+    forks = [conversation.fork() for _ in range(1000)]
+    for i, fork in enumerate(forks):
+        fork.add_assistant(str(i))
+    assert len(forks[-1]) == 10001
+    assert forks[-1][-1].content == "999"
+    assert forks[0][-2] is forks[-1][-2]
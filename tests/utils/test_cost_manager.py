@@ -1,4 +1,10 @@
-from metacogitor.utils import CostManager, Costs
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from metacogitor.config import CONFIG
+from metacogitor.utils import CostManager, Costs, cost_scope
 from metacogitor.utils import TOKEN_MAX
 import pytest
 
@@ -76,3 +82,105 @@ def test_get_costs(cost_manager):
     assert costs.total_prompt_tokens == 200
     assert costs.total_completion_tokens == 400
     assert costs.total_cost > 0
+
+
+def test_record_hedge(cost_manager):
+    cost_manager.reset()
+    cost_manager.record_hedge(100, 0, "gpt-4")
+    assert cost_manager.get_total_hedges() == 1
+    assert cost_manager.get_total_prompt_tokens() == 100
+    assert cost_manager.get_total_cost() > 0
+
+    cost_manager.record_hedge(100, 0, "unknown-model")
+    assert cost_manager.get_total_hedges() == 2
+    assert cost_manager.get_total_prompt_tokens() == 100
+    cost_manager.reset()
+    assert cost_manager.get_total_hedges() == 0
+
+
+def test_concurrent_updates_are_not_lost(cost_manager):
+    cost_manager.reset()
+
+    def update():
+        for _ in range(1000):
+            cost_manager.update_cost(1, 2, "gpt-3.5-turbo")
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        for _ in range(8):
+            executor.submit(update)
+    costs = cost_manager.get_costs()
+    assert costs.total_prompt_tokens == 8000
+    assert costs.total_completion_tokens == 16000
+    assert cost_manager.snapshot().total.requests == 8000
+    cost_manager.reset()
+
+
+def test_update_cost_does_not_take_the_shards_lock(cost_manager):
+    cost_manager.reset()
+    cost_manager.update_cost(1, 2, "gpt-3.5-turbo")
+    locked = threading.Event()
+    release = threading.Event()
+
+    def hold():
+        with cost_manager._shards_lock:
+            locked.set()
+            release.wait(5)
+
+    thread = threading.Thread(target=hold)
+    thread.start()
+    locked.wait()
+    try:
+        # The shard of this thread is registered, so logging is all that could block.
+        start = time.monotonic()
+        cost_manager.update_cost(1, 2, "gpt-3.5-turbo")
+        assert time.monotonic() - start < 1
+    finally:
+        release.set()
+        thread.join()
+    assert cost_manager.get_total_prompt_tokens() == 2
+    cost_manager.reset()
+
+
+def test_exited_threads_fold_into_base_shard(cost_manager):
+    cost_manager.reset()
+    for _ in range(20):
+        thread = threading.Thread(
+            target=cost_manager.update_cost, args=(1, 2, "gpt-3.5-turbo")
+        )
+        thread.start()
+        thread.join()
+    assert len(cost_manager._shards) <= 2
+    snapshot = cost_manager.snapshot()
+    assert snapshot.total.prompt_tokens == 20
+    assert snapshot.by_model["gpt-3.5-turbo"].requests == 20
+    assert CONFIG.total_cost == cost_manager.get_total_cost() > 0
+    cost_manager.reset()
+
+
+@pytest.mark.asyncio
+async def test_snapshot_breaks_down_by_model_role_and_tenant(cost_manager):
+    cost_manager.reset()
+
+    async def call(model):
+        await asyncio.sleep(0)
+        cost_manager.update_cost(100, 10, model)
+
+    with cost_scope(tenant="acme"):
+        with cost_scope(role="Engineer"):
+            await asyncio.gather(call("gpt-4"), call("gpt-3.5-turbo"))
+        await asyncio.create_task(call("gpt-4"))
+    cost_manager.update_cost(100, 10, "gpt-4", role="Reviewer", tenant="globex")
+
+    snapshot = cost_manager.snapshot()
+    assert snapshot.total.requests == 4
+    assert snapshot.total.prompt_tokens == 400
+    assert snapshot.by_model["gpt-4"].requests == 3
+    assert set(snapshot.by_role) == {"Engineer", "Reviewer", None}
+    assert snapshot.by_role["Engineer"].requests == 2
+    assert snapshot.by_tenant["acme"].requests == 3
+    assert snapshot.by_key[("gpt-4", "Reviewer", "globex")].completion_tokens == 10
+    assert snapshot.total.cost == pytest.approx(
+        sum(b.cost for b in snapshot.by_model.values())
+    )
+    cost_manager.reset()
+    assert cost_manager.snapshot().by_model == {}
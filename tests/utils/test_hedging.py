@@ -0,0 +1,113 @@
+import asyncio
+
+import pytest
+from metacogitor.utils import Hedger
+
+
+def warmed(latency=0.01, **kwargs):
+    hedger = Hedger(min_samples=5, **kwargs)
+    for _ in range(5):
+        hedger.record_latency(latency)
+    return hedger
+
+
+class Requests:
+    def __init__(self, delays, errors=()):
+        self.delays = list(delays)
+        self.errors = set(errors)
+        self.started = []
+        self.cancelled = []
+
+    async def __call__(self, attempt):
+        self.started.append(attempt)
+        try:
+            await asyncio.sleep(self.delays[attempt])
+        except asyncio.CancelledError:
+            self.cancelled.append(attempt)
+            raise
+        if attempt in self.errors:
+            raise RuntimeError(attempt)
+        return f"answer {attempt}"
+
+
+def test_delay_is_percentile_of_recent_latencies():
+    hedger = Hedger(percentile=90, min_samples=10, window=10)
+    for i in range(9):
+        hedger.record_latency(i)
+    assert hedger.delay() is None
+    for i in range(9, 20):
+        hedger.record_latency(i)
+    assert hedger.delay() == 18  # p90 of 10..19
+    assert Hedger(min_samples=1, min_delay=5).delay() is None
+
+
+@pytest.mark.asyncio
+async def test_no_hedge_before_warm_up():
+    requests = Requests([0.01, 0])
+    assert await Hedger(budget=1).race(requests) == (0, "answer 0")
+    assert requests.started == [0]
+
+
+@pytest.mark.asyncio
+async def test_hedge_wins_and_loser_is_cancelled():
+    hedger = warmed(budget=1)
+    requests = Requests([1, 0.001])
+    losers = []
+    assert await hedger.race(requests, on_cancel=losers.append) == (1, "answer 1")
+    assert requests.cancelled == [0]
+    assert losers == [0]
+    assert hedger.stats() == (1, 1, 1, 1)
+
+
+@pytest.mark.asyncio
+async def test_primary_can_still_win_after_hedging():
+    hedger = warmed(budget=1)
+    requests = Requests([0.02, 1])
+    assert await hedger.race(requests) == (0, "answer 0")
+    assert requests.cancelled == [1]
+
+
+@pytest.mark.asyncio
+async def test_hedge_backs_up_a_failed_primary():
+    hedger = warmed(budget=1)
+    requests = Requests([0.03, 0.05], errors={0})
+    assert await hedger.race(requests) == (1, "answer 1")
+
+    requests = Requests([0.03, 0.05], errors={0, 1})
+    with pytest.raises(RuntimeError):
+        await hedger.race(requests)
+
+
+@pytest.mark.asyncio
+async def test_budget_caps_hedges():
+    hedger = warmed(latency=0.001, budget=0.25, percentile=0)
+    for _ in range(20):
+        await hedger.race(Requests([0.01, 0.01]))
+    stats = hedger.stats()
+    assert stats.requests == 20
+    assert stats.hedges == 5
+
+
+@pytest.mark.asyncio
+async def test_stream_races_first_delta():
+    hedger = warmed(budget=1)
+    closed = []
+
+    def factory():
+        attempt = len(closed)
+        closed.append(False)
+
+        async def stream():
+            try:
+                await asyncio.sleep(1 if attempt == 0 else 0.001)
+                for delta in ("a", "b"):
+                    yield f"{delta}{attempt}"
+            finally:
+                closed[attempt] = True
+
+        return stream()
+
+    deltas = [delta async for delta in hedger.stream(factory)]
+    assert deltas == ["a1", "b1"]
+    assert closed == [True, True]
+    assert hedger.stats().hedge_wins == 1
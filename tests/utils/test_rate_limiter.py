@@ -1,6 +1,16 @@
+import asyncio
+
 import pytest
-from metacogitor.utils import RateLimiter
+from metacogitor.exceptions import ProviderException
+from metacogitor.providers import FakeGPTAPI
+from metacogitor.utils import (
+    AdaptiveRateLimiter,
+    FairRateLimiter,
+    RateLimiter,
+    TokenBucketLimiter,
+)
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 
 @pytest.fixture
@@ -44,3 +54,246 @@ async def test_wait_if_needed(rate_limiter):
     end_time = time.time()
     elapsed = end_time - start_time
     assert elapsed >= rate_limiter.interval
+
+
+def test_wait_if_needed_sync_spaces_threads():
+    rate_limiter = RateLimiter(rpm=6000)
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: rate_limiter.wait_if_needed_sync(1), range(4)))
+        start_time = time.time()
+        calls = list(
+            executor.map(
+                lambda _: (rate_limiter.wait_if_needed_sync(1), time.time())[1],
+                range(4),
+            )
+        )
+    assert max(calls) - start_time >= 3 * rate_limiter.interval
+
+
+def test_reserve_spaces_callers_without_waiting():
+    rate_limiter = RateLimiter(rpm=60)
+    delays = [rate_limiter.reserve(1) for _ in range(3)]
+    assert delays[0] == 0
+    assert delays[1] == pytest.approx(rate_limiter.interval, abs=0.01)
+    assert delays[2] == pytest.approx(2 * rate_limiter.interval, abs=0.01)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_token_bucket_allows_burst_then_paces_at_rpm():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(rpm=60, burst_requests=3, clock=clock)
+    assert [limiter.reserve(1) for _ in range(3)] == [0, 0, 0]
+    # No padding: the next request waits exactly one interval of 60 / rpm.
+    assert limiter.reserve(1) == pytest.approx(1.0)
+    assert limiter.reserve(1) == pytest.approx(2.0)
+    clock.now = 10
+    assert limiter.available()[0] == pytest.approx(3)
+
+
+def test_token_bucket_enforces_tpm():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(rpm=1000, tpm=600, clock=clock)
+    assert limiter.reserve(1, tokens=500) == 0
+    assert limiter.reserve(1, tokens=200) == pytest.approx(10.0)
+    assert limiter.available()[1] == pytest.approx(-100)
+
+
+def test_token_bucket_admits_requests_larger_than_capacity():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(rpm=1000, tpm=600, clock=clock)
+    assert limiter.reserve(1, tokens=900) == 0
+    assert limiter.reserve(1, tokens=60) == pytest.approx(36.0)
+
+
+def test_token_bucket_reconciles_actual_usage():
+    clock = FakeClock()
+    limiter = TokenBucketLimiter(rpm=1000, tpm=600, clock=clock)
+    limiter.reserve(1, tokens=500)
+    limiter.reconcile(500, 100)
+    assert limiter.available()[1] == pytest.approx(500)
+    limiter.reconcile(0, 400)
+    assert limiter.available()[1] == pytest.approx(100)
+    limiter.reconcile(1000, 0)
+    assert limiter.available()[1] == pytest.approx(600)
+
+
+def test_adaptive_limiter_increases_additively_and_decreases_multiplicatively():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(rpm=60, min_rpm=10, max_rpm=100, clock=clock)
+    # However many requests succeed, the rate rises once per cooldown.
+    for _ in range(30):
+        limiter.record()
+    assert limiter.rpm == 61
+    for _ in range(29):
+        clock.now += 1
+        limiter.record()
+        limiter.record()
+    assert limiter.rpm == 90
+    limiter.record(ProviderException(code=429, message="Rate limited"))
+    assert limiter.rpm == 45
+    # Throttles of requests sent before the cut do not cut the rate again.
+    limiter.record(ProviderException(code=429, message="Rate limited"))
+    assert limiter.rpm == 45
+    # Nor do successes raise it before the cooldown is over.
+    limiter.record()
+    assert limiter.rpm == 45
+    for _ in range(3):
+        clock.now += 1
+        limiter.record(ProviderException(code=429, message="Rate limited"))
+    assert limiter.rpm == 10
+    for _ in range(200):
+        clock.now += 1
+        limiter.record()
+    assert limiter.rpm == 100
+
+
+def test_adaptive_limiter_ignores_other_errors():
+    limiter = AdaptiveRateLimiter(rpm=60, clock=FakeClock())
+    limiter.record(ProviderException(code=500, message="Server error"))
+    limiter.record(ValueError("bad answer"))
+    assert limiter.rpm == 60
+
+
+def test_adaptive_limiter_paces_at_effective_rate_and_honors_retry_after():
+    clock = FakeClock()
+    limiter = AdaptiveRateLimiter(rpm=120, clock=clock)
+    assert limiter.reserve(1) == 0
+    assert limiter.reserve(1) == pytest.approx(0.5)
+    clock.now = 10
+    limiter.record(ProviderException(code=429, message="Slow down", retry_after=5))
+    assert limiter.rpm == 60
+    assert limiter.reserve(1) == pytest.approx(6.0)
+
+
+@pytest.mark.asyncio
+async def test_token_bucket_wait_if_needed():
+    limiter = TokenBucketLimiter(rpm=6000, burst_requests=1)
+    start_time = time.monotonic()
+    await limiter.wait_if_needed(1)
+    await limiter.wait_if_needed(1)
+    assert time.monotonic() - start_time >= 0.009
+
+
+@pytest.mark.asyncio
+async def test_wait_if_needed_spaces_concurrent_coroutines():
+    rate_limiter = RateLimiter(rpm=6000)
+    await rate_limiter.wait_if_needed(1)
+    start_time = time.time()
+    await asyncio.gather(*[rate_limiter.wait_if_needed(1) for _ in range(3)])
+    assert time.time() - start_time >= 2 * rate_limiter.interval
+
+
+@pytest.mark.asyncio
+async def test_fair_limiter_admits_in_arrival_order():
+    limiter = FairRateLimiter(rpm=600000, burst=10)
+    order = []
+
+    async def waiter(index):
+        await limiter.acquire()
+        order.append(index)
+
+    await asyncio.gather(*[waiter(i) for i in range(1500)])
+    assert order == list(range(1500))
+    stats = limiter.stats()
+    assert stats.granted == 1500
+    assert stats.queue_depth == 0
+    assert stats.max_queue_depth > 1400
+    assert 0 < stats.mean_wait <= stats.max_wait
+
+
+@pytest.mark.asyncio
+async def test_fair_limiter_paces_admissions():
+    limiter = FairRateLimiter(rpm=6000)
+    start_time = asyncio.get_running_loop().time()
+    times = []
+
+    async def waiter():
+        async with limiter:
+            times.append(asyncio.get_running_loop().time() - start_time)
+
+    await asyncio.gather(*[waiter() for _ in range(5)])
+    assert times[0] < 0.005
+    for earlier, later in zip(times, times[1:]):
+        assert later - earlier >= 0.009
+
+
+@pytest.mark.asyncio
+async def test_fair_limiter_cancellation_does_not_leak_slots():
+    limiter = FairRateLimiter(rpm=60000)
+    loop = asyncio.get_running_loop()
+    start_time = loop.time()
+    tasks = [asyncio.ensure_future(limiter.acquire()) for _ in range(1000)]
+    await asyncio.sleep(0)
+    stats = limiter.stats()
+    assert stats.queue_depth + stats.granted == 1000
+    assert stats.queue_depth > 900
+    for index, task in enumerate(tasks):
+        if index % 10:
+            task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+    stats = limiter.stats()
+    assert stats.granted + stats.cancelled == 1000
+    assert stats.cancelled >= 890
+    assert stats.queue_depth == 0
+    # About 100 admissions at 1ms intervals: cancelled waiters did not hold slots.
+    assert loop.time() - start_time < 0.5
+
+
+@pytest.mark.asyncio
+async def test_fair_limiter_admitted_then_cancelled_gives_slot_back():
+    limiter = FairRateLimiter(rpm=60, burst=1)
+    await limiter.acquire()
+    first = asyncio.ensure_future(limiter.acquire())
+    second = asyncio.ensure_future(limiter.acquire())
+    await asyncio.sleep(0)
+    # Admit the first waiter, then cancel it before it resumes.
+    limiter._level = 1.0
+    limiter._dispatch()
+    first.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await first
+    await asyncio.wait_for(second, timeout=0.5)
+    assert limiter.stats().granted == 2
+
+
+def test_fair_limiter_survives_event_loops():
+    limiter = FairRateLimiter(rpm=60000)
+    for _ in range(2):
+        asyncio.run(asyncio.wait_for(limiter.acquire(), timeout=1))
+        asyncio.run(asyncio.wait_for(limiter.acquire(), timeout=1))
+
+
+def test_fair_limiter_admits_threads_in_order():
+    limiter = FairRateLimiter(rpm=1200)
+    admitted = []
+
+    def wait(index):
+        limiter.wait_if_needed_sync(1)
+        admitted.append((index, time.monotonic()))
+
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        for i in range(4):
+            executor.submit(wait, i)
+            time.sleep(0.01)
+    assert [index for index, _ in admitted] == [0, 1, 2, 3]
+    assert admitted[-1][1] - start >= 3 * 0.05 - 0.01
+    assert limiter.stats().granted == 4
+    assert limiter.stats().queue_depth == 0
+
+
+def test_fair_limiter_limits_sync_provider_calls():
+    api = FakeGPTAPI(model="gpt-3.5-turbo", update_costs=False)
+    api.token_limiter = FairRateLimiter(rpm=1200)
+    start = time.monotonic()
+    for _ in range(3):
+        assert api.ask("hello")
+    assert time.monotonic() - start >= 2 * 0.05 - 0.01
+    assert api.token_limiter.stats().granted == 3
@@ -0,0 +1,134 @@
+import pytest
+
+from metacogitor.utils import (
+    MemoryResponseCache,
+    ResponseCacheStats,
+    SQLiteResponseCache,
+    make_cache_key,
+)
+
+
+MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "hello"},
+]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def make_cache(request, tmp_path, clock):
+    def factory(**kwargs):
+        kwargs.setdefault("clock", clock)
+        if request.param == "memory":
+            return MemoryResponseCache(**kwargs)
+        return SQLiteResponseCache(tmp_path / "cache.db", **kwargs)
+
+    return factory
+
+
+def test_make_cache_key_is_canonical():
+    reordered = [{"content": m["content"] + "\n", "role": m["role"]} for m in MESSAGES]
+    assert make_cache_key("gpt-4", MESSAGES) == make_cache_key("gpt-4", reordered)
+    assert make_cache_key("gpt-4", MESSAGES, temperature=0) == make_cache_key(
+        "gpt-4", MESSAGES, temperature=0
+    )
+
+
+@pytest.mark.parametrize(
+    "other",
+    [
+        ("gpt-3.5-turbo", MESSAGES, {}),
+        ("gpt-4", MESSAGES[:1], {}),
+        ("gpt-4", MESSAGES, {"temperature": 1}),
+    ],
+)
+def test_make_cache_key_differs(other):
+    model, messages, params = other
+    assert make_cache_key("gpt-4", MESSAGES) != make_cache_key(
+        model, messages, **params
+    )
+
+
+def test_cache_hit_and_miss(make_cache):
+    cache = make_cache()
+    rsp = {"choices": [{"message": {"content": "hi"}}]}
+    assert cache.get("key") is None
+    cache.set("key", rsp)
+    assert cache.get("key") == rsp
+    assert cache.stats() == ResponseCacheStats(1, 1, 0, 1)
+
+
+def test_cache_lru_eviction(make_cache, clock):
+    cache = make_cache(maxsize=2)
+    cache.set("a", "1")
+    clock.now += 1
+    cache.set("b", "2")
+    clock.now += 1
+    assert cache.get("a") == "1"  # "b" is now least recently used
+    clock.now += 1
+    cache.set("c", "3")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "1"
+    assert cache.get("c") == "3"
+    assert cache.stats().evictions == 1
+
+
+def test_cache_rejects_negative_maxsize(make_cache):
+    with pytest.raises(ValueError):
+        make_cache(maxsize=-1)
+    cache = make_cache(maxsize=0)
+    cache.set("a", "1")
+    assert cache.get("a") is None
+    assert cache.stats().size == 0
+
+
+def test_cache_replacing_an_entry_does_not_evict(make_cache, clock):
+    cache = make_cache(maxsize=2)
+    cache.set("a", "1")
+    cache.set("b", "2")
+    for value in "345":
+        clock.now += 1
+        cache.set("b", value)
+    assert cache.get("a") == "1"
+    assert cache.get("b") == "5"
+    assert cache.stats().size == 2
+    assert cache.stats().evictions == 0
+
+
+def test_cache_ttl(make_cache, clock):
+    cache = make_cache(ttl=10)
+    cache.set("a", "1")
+    clock.now += 5
+    assert cache.get("a") == "1"
+    clock.now += 6
+    assert cache.get("a") is None
+    assert cache.stats().size == 0
+
+
+def test_sqlite_cache_persists(tmp_path):
+    cache = SQLiteResponseCache(tmp_path / "cache.db")
+    cache.set("a", {"text": "persisted"})
+    cache.close()
+
+    reopened = SQLiteResponseCache(tmp_path / "cache.db", maxsize=1)
+    assert reopened.stats().size == 1
+    assert reopened.get("a") == {"text": "persisted"}
+    reopened.set("b", {"text": "newer"})
+    assert reopened.get("a") is None
+    assert reopened.stats().size == 1
+    reopened.clear()
+    assert reopened.stats() == ResponseCacheStats(0, 0, 0, 0)
+    reopened.close()
@@ -0,0 +1,188 @@
+import asyncio
+
+import pytest
+from metacogitor.exceptions import CircuitOpenException, ProviderException
+from metacogitor.utils import (
+    CircuitBreaker,
+    RetryEngine,
+    RetryPolicy,
+    get_retry_after,
+    get_status,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class Flaky:
+    def __init__(self, errors, result="ok"):
+        self.errors = list(errors)
+        self.result = result
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return self.result
+
+    async def acall(self):
+        return self()
+
+
+def provider_error(status, retry_after=None):
+    return ProviderException(
+        code=status, message=f"HTTP {status}", retry_after=retry_after
+    )
+
+
+FAST = RetryPolicy(max_attempts=4, base_delay=0.001, max_delay=0.002)
+
+
+def test_backoff_uses_full_jitter():
+    policy = RetryPolicy(base_delay=1, max_delay=5, multiplier=2)
+    assert policy.backoff(0, rng=lambda: 0.999) < 1
+    assert policy.backoff(2, rng=lambda: 0.5) == 2
+    assert policy.backoff(10, rng=lambda: 0.5) == 2.5
+    assert policy.backoff(3, rng=lambda: 0.0) == 0
+
+
+@pytest.mark.parametrize(
+    "error,idempotent,expected",
+    [
+        (provider_error(429), False, True),
+        (provider_error(503), False, True),
+        (provider_error(500), True, True),
+        (provider_error(500), False, False),
+        (provider_error(400), True, False),
+        (provider_error(401), True, False),
+        (TimeoutError(), True, True),
+        (TimeoutError(), False, False),
+        (ConnectionRefusedError(), False, True),
+        (ValueError(), True, False),
+    ],
+)
+def test_retry_classification(error, idempotent, expected):
+    assert RetryPolicy().is_retryable(error, idempotent) is expected
+
+
+def test_retry_after_is_read_from_attribute_and_headers():
+    assert get_retry_after(provider_error(429, retry_after=3)) == 3
+
+    class HTTPError(Exception):
+        http_status = 429
+        headers = {"Retry-After": "1.5"}
+
+    assert get_retry_after(HTTPError()) == 1.5
+    assert get_status(HTTPError()) == 429
+    assert get_retry_after(ValueError()) is None
+
+
+def test_retry_after_takes_precedence_up_to_limit():
+    policy = RetryPolicy(max_retry_after=10)
+    assert policy.delay(0, provider_error(429, retry_after=7)) == 7
+    assert policy.delay(0, provider_error(429, retry_after=11)) is None
+
+
+def test_call_retries_transient_errors():
+    engine = RetryEngine(FAST)
+    func = Flaky([provider_error(429), provider_error(502)])
+    assert engine.call(func) == "ok"
+    assert func.calls == 3
+    assert engine.stats().retries == 2
+
+
+def test_call_does_not_retry_client_errors():
+    engine = RetryEngine(FAST)
+    func = Flaky([provider_error(400)])
+    with pytest.raises(ProviderException):
+        engine.call(func)
+    assert func.calls == 1
+    assert engine.breaker("default").state == CircuitBreaker.CLOSED
+
+
+def test_call_gives_up_after_max_attempts():
+    engine = RetryEngine(FAST)
+    func = Flaky([provider_error(503)] * 10)
+    with pytest.raises(ProviderException):
+        engine.call(func)
+    assert func.calls == 4
+    assert engine.stats().failures == 1
+
+
+def test_circuit_opens_and_half_opens():
+    clock = FakeClock()
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10, clock=clock)
+    breaker.record_failure()
+    breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+    with pytest.raises(CircuitOpenException) as exc_info:
+        breaker.allow("openai")
+    assert exc_info.value.retry_after == 10
+    assert exc_info.value.endpoint == "openai"
+
+    clock.now = 10
+    breaker.allow()  # the probe
+    with pytest.raises(CircuitOpenException):
+        breaker.allow()  # only one probe at a time
+    breaker.record_failure()
+    assert breaker.state == CircuitBreaker.OPEN
+
+    clock.now = 20
+    breaker.allow()
+    breaker.record_success()
+    assert breaker.state == CircuitBreaker.CLOSED
+
+
+def test_circuit_is_per_endpoint_and_fails_fast():
+    engine = RetryEngine(FAST, failure_threshold=2, clock=FakeClock())
+    down = Flaky([provider_error(503)] * 10)
+    with pytest.raises(CircuitOpenException):
+        engine.call(down, endpoint="down")
+    assert down.calls == 2
+    with pytest.raises(CircuitOpenException):
+        engine.call(down, endpoint="down")
+    assert down.calls == 2
+    assert engine.call(Flaky([]), endpoint="up") == "ok"
+    assert engine.stats().short_circuits == 2
+
+
+@pytest.mark.asyncio
+async def test_acall_retries_and_fails_fast_when_open():
+    engine = RetryEngine(FAST, failure_threshold=3, clock=FakeClock())
+    func = Flaky([provider_error(429)])
+    assert await engine.acall(func.acall) == "ok"
+
+    down = Flaky([provider_error(500)] * 100)
+    results = await asyncio.gather(
+        *[engine.acall(down.acall, endpoint="down") for _ in range(20)],
+        return_exceptions=True,
+    )
+    assert all(
+        isinstance(r, (CircuitOpenException, ProviderException)) for r in results
+    )
+    assert down.calls < 20 * FAST.max_attempts
+
+
+@pytest.mark.asyncio
+async def test_cancelled_probe_releases_circuit():
+    clock = FakeClock()
+    engine = RetryEngine(FAST, failure_threshold=1, reset_timeout=1, clock=clock)
+    with pytest.raises(ProviderException):
+        await engine.acall(Flaky([provider_error(400)]).acall)
+    with pytest.raises(CircuitOpenException):
+        await engine.acall(Flaky([provider_error(500)] * 10).acall)
+
+    clock.now = 1
+    probe = asyncio.ensure_future(engine.acall(lambda: asyncio.sleep(10)))
+    await asyncio.sleep(0)
+    probe.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await probe
+    assert await engine.acall(Flaky([]).acall) == "ok"
@@ -0,0 +1,170 @@
+import asyncio
+import multiprocessing
+import socket
+import threading
+import time
+
+import pytest
+from metacogitor.utils import (
+    BucketStoreServer,
+    FileBucketStore,
+    MemoryBucketStore,
+    NetworkBucketStore,
+    SharedRateLimiter,
+    make_bucket_store,
+)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_memory_store_refills_and_charges():
+    clock = FakeClock()
+    store = MemoryBucketStore(clock=clock)
+    bucket = ("key", 1, 1.0, 2)
+    assert store.take([bucket])[0] == 0
+    assert store.take([bucket])[0] == 0
+    assert store.take([bucket])[0] == pytest.approx(1.0)
+    clock.now += 10
+    assert store.take([("key", 0, 1.0, 2)])[1] == [pytest.approx(2)]
+
+
+def test_limiter_shares_budget_between_instances():
+    store = MemoryBucketStore(clock=FakeClock())
+    first = SharedRateLimiter(store, "api", rpm=60, burst_requests=2)
+    second = SharedRateLimiter(store, "api", rpm=60, burst_requests=2)
+    other = SharedRateLimiter(store, "other", rpm=60, burst_requests=2)
+    assert first.reserve() == 0
+    assert second.reserve() == 0
+    assert first.reserve() == pytest.approx(1.0)
+    assert second.reserve() == pytest.approx(2.0)
+    assert other.reserve() == 0
+
+
+def test_limiter_charges_and_reconciles_tokens():
+    store = MemoryBucketStore(clock=FakeClock())
+    limiter = SharedRateLimiter(store, "api", rpm=1000, tpm=600)
+    assert limiter.reserve(1, 500) == 0
+    assert limiter.reserve(1, 200) == pytest.approx(10.0)
+    limiter.reconcile(700, 100)
+    assert limiter.available()[1] == pytest.approx(500)
+    limiter.reconcile(0, 100)
+    assert limiter.available() == (pytest.approx(998), pytest.approx(400))
+
+
+def reserve_many(path, count, results):
+    limiter = SharedRateLimiter(FileBucketStore(path), "api", rpm=60, burst_requests=10)
+    results.put([limiter.reserve() for _ in range(count)])
+
+
+def test_file_store_coordinates_processes(tmp_path):
+    path = tmp_path / "limits.json"
+    context = multiprocessing.get_context("fork")
+    results = context.Queue()
+    workers = [
+        context.Process(target=reserve_many, args=(path, 5, results)) for _ in range(4)
+    ]
+    for worker in workers:
+        worker.start()
+    delays = sorted(sum([results.get(timeout=10) for _ in workers], []))
+    for worker in workers:
+        worker.join()
+    # 20 requests against a budget of 10 at once and 1 per second after.
+    assert delays[:10] == [0] * 10
+    assert delays[10:] == [pytest.approx(i, abs=0.5) for i in range(1, 11)]
+
+
+def test_file_store_recovers_from_corrupt_state(tmp_path):
+    path = tmp_path / "limits.json"
+    path.write_text("{not json")
+    store = FileBucketStore(path)
+    assert store.take([("key", 1, 1.0, 2)])[0] == 0
+    store.close()
+
+
+def test_network_store_shares_budget():
+    with BucketStoreServer(MemoryBucketStore(clock=FakeClock())) as server:
+        first = SharedRateLimiter(
+            NetworkBucketStore(*server.address), "api", rpm=60, burst_requests=1
+        )
+        second = SharedRateLimiter(
+            NetworkBucketStore(*server.address), "api", rpm=60, burst_requests=1
+        )
+        assert first.reserve() == 0
+        assert second.reserve() == pytest.approx(1.0)
+        assert first.reserve() == pytest.approx(2.0)
+        first.store.close()
+        # A closed store reconnects on next use.
+        assert first.reserve() == pytest.approx(3.0)
+        second.store.close()
+
+
+def test_network_store_does_not_resend_after_timeout():
+    server = socket.create_server(("127.0.0.1", 0))
+    received = []
+
+    def serve(conn):
+        with conn:
+            received.append(conn.makefile("rb").readline())
+            time.sleep(0.5)
+
+    def accept():
+        for _ in range(2):
+            try:
+                conn, _ = server.accept()
+            except OSError:
+                return
+            threading.Thread(target=serve, args=(conn,)).start()
+
+    threading.Thread(target=accept, daemon=True).start()
+    store = NetworkBucketStore(*server.getsockname(), timeout=0.2)
+    with pytest.raises(TimeoutError):
+        store.take([("key", 1, 1.0, 2)])
+    time.sleep(0.2)
+    server.close()
+    assert len(received) == 1
+
+
+@pytest.mark.asyncio
+async def test_limiter_charges_store_off_the_event_loop():
+    class SlowStore(MemoryBucketStore):
+        def _take(self, buckets):
+            time.sleep(0.2)
+            return super()._take(buckets)
+
+    limiter = SharedRateLimiter(SlowStore(), "api", rpm=60)
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            await asyncio.sleep(0.01)
+            ticks += 1
+
+    ticker = asyncio.ensure_future(tick())
+    await limiter.wait_if_needed()
+    ticker.cancel()
+    assert ticks > 5
+
+
+def test_network_store_reports_bad_requests():
+    with BucketStoreServer() as server:
+        store = NetworkBucketStore(*server.address)
+        with pytest.raises(ValueError):
+            store.take([("key", 1, 1.0)])
+        store.close()
+
+
+def test_make_bucket_store(tmp_path):
+    assert isinstance(make_bucket_store("memory://"), MemoryBucketStore)
+    store = make_bucket_store(f"file://{tmp_path}/limits.json")
+    assert isinstance(store, FileBucketStore)
+    assert str(store.path) == f"{tmp_path}/limits.json"
+    assert isinstance(make_bucket_store("tcp://127.0.0.1:9"), NetworkBucketStore)
+    with pytest.raises(ValueError):
+        make_bucket_store("redis://localhost")
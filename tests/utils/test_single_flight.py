@@ -0,0 +1,111 @@
+import asyncio
+
+import pytest
+
+from metacogitor.utils import SingleFlight
+
+
+@pytest.fixture
+def single_flight():
+    return SingleFlight()
+
+
+@pytest.mark.asyncio
+async def test_identical_calls_share_result(single_flight):
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        await asyncio.sleep(0.01)
+        return "result"
+
+    results = await asyncio.gather(*[single_flight.do("key", fetch) for _ in range(5)])
+    assert results == ["result"] * 5
+    assert calls == 1
+    assert single_flight.coalesced == 4
+    assert single_flight.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_different_keys_do_not_share(single_flight):
+    async def fetch(value):
+        await asyncio.sleep(0.01)
+        return value
+
+    results = await asyncio.gather(
+        single_flight.do("a", lambda: fetch("a")),
+        single_flight.do("b", lambda: fetch("b")),
+    )
+    assert results == ["a", "b"]
+    assert single_flight.coalesced == 0
+
+
+@pytest.mark.asyncio
+async def test_errors_reach_every_waiter(single_flight):
+    async def fail():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("boom")
+
+    results = await asyncio.gather(
+        single_flight.do("key", fail),
+        single_flight.do("key", fail),
+        return_exceptions=True,
+    )
+    assert all(isinstance(result, RuntimeError) for result in results)
+
+
+@pytest.mark.asyncio
+async def test_cancelling_one_waiter_keeps_others(single_flight):
+    started = asyncio.Event()
+
+    async def fetch():
+        started.set()
+        await asyncio.sleep(0.05)
+        return "result"
+
+    first = asyncio.ensure_future(single_flight.do("key", fetch))
+    second = asyncio.ensure_future(single_flight.do("key", fetch))
+    await started.wait()
+    first.cancel()
+
+    assert await second == "result"
+    assert first.cancelled()
+
+
+@pytest.mark.asyncio
+async def test_cancelling_all_waiters_cancels_call(single_flight):
+    finished = False
+
+    async def fetch():
+        nonlocal finished
+        await asyncio.sleep(0.05)
+        finished = True
+
+    waiter = asyncio.ensure_future(single_flight.do("key", fetch))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.sleep(0.1)
+    assert not finished
+    assert single_flight.in_flight() == 0
+
+
+@pytest.mark.asyncio
+async def test_caller_after_last_waiter_left_starts_new_call(single_flight):
+    calls = 0
+
+    async def fetch():
+        nonlocal calls
+        calls += 1
+        try:
+            await asyncio.sleep(0.05)
+        except asyncio.CancelledError:
+            await asyncio.sleep(0.01)  # slow cleanup keeps the task alive
+            raise
+        return calls
+
+    waiter = asyncio.ensure_future(single_flight.do("key", fetch))
+    await asyncio.sleep(0)
+    waiter.cancel()
+    await asyncio.sleep(0)
+    assert await single_flight.do("key", fetch) == 2
@@ -0,0 +1,287 @@
+import base64
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import tiktoken
+
+from metacogitor.utils import (
+    TOKEN_MAX,
+    EstimatorStats,
+    MessageTokenCache,
+    TokenEstimator,
+    TokenLedger,
+    clear_token_cache,
+    count_message_tokens,
+    count_message_tokens_batch,
+    count_string_tokens,
+    count_string_tokens_batch,
+    get_encoding,
+    get_max_completion_tokens,
+    get_token_cache_stats,
+)
+
+
+MESSAGES = [
+    {"role": "system", "content": "You are a helpful assistant."},
+    {"role": "user", "content": "hello, show me python hello world code"},
+    {"role": "assistant", "content": "print('hello world')", "name": "coder"},
+]
+
+
+def _reference_count(messages):
+    encoding = tiktoken.encoding_for_model("gpt-3.5-turbo-0613")
+    num_tokens = 0
+    for message in messages:
+        num_tokens += 3
+        for key, value in message.items():
+            num_tokens += len(encoding.encode(value))
+            if key == "name":
+                num_tokens += 1
+    return num_tokens + 3
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    clear_token_cache()
+    yield
+    clear_token_cache()
+
+
+def test_get_encoding_is_cached():
+    assert get_encoding("gpt-4") is get_encoding("gpt-4")
+
+
+def test_get_encoding_unknown_model():
+    with pytest.raises(KeyError):
+        get_encoding("not-a-model")
+    assert get_encoding("not-a-model", fallback=True).name == "cl100k_base"
+
+
+def test_count_string_tokens():
+    encoding = tiktoken.encoding_for_model("gpt-4")
+    assert count_string_tokens("hello world", "gpt-4") == len(
+        encoding.encode("hello world")
+    )
+
+
+def test_count_message_tokens_matches_reference():
+    assert count_message_tokens(MESSAGES) == _reference_count(MESSAGES)
+
+
+def test_count_message_tokens_uses_cache():
+    first = count_message_tokens(MESSAGES)
+    stats = get_token_cache_stats()
+    assert stats.misses == len(MESSAGES)
+    assert stats.hits == 0
+
+    second = count_message_tokens(MESSAGES)
+    stats = get_token_cache_stats()
+    assert first == second
+    assert stats.hits == len(MESSAGES)
+    assert stats.size == len(MESSAGES)
+
+
+def test_message_token_cache_lru_eviction():
+    cache = MessageTokenCache(maxsize=2)
+    keys = [cache.make_key("cl100k_base", {"content": str(i)}) for i in range(3)]
+    cache.put(keys[0], 1)
+    cache.put(keys[1], 2)
+    assert cache.get(keys[0]) == 1  # keys[1] is now least recently used
+    cache.put(keys[2], 3)
+
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) == 1
+    assert cache.get(keys[2]) == 3
+    stats = cache.stats()
+    assert stats.evictions == 1
+    assert stats.size == 2
+
+
+def test_message_token_cache_key_depends_on_encoding():
+    message = {"role": "user", "content": "hi"}
+    assert MessageTokenCache.make_key("cl100k_base", message) != (
+        MessageTokenCache.make_key("p50k_base", message)
+    )
+
+
+def test_count_string_tokens_batch_matches_scalar():
+    strings = [f"string number {i} " * (i % 7 + 1) for i in range(200)]
+    counts = count_string_tokens_batch(strings, "gpt-4", num_threads=4)
+    assert counts == [count_string_tokens(s, "gpt-4") for s in strings]
+
+
+def test_count_string_tokens_batch_custom_executor():
+    strings = ["hello world"] * 100
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        counts = count_string_tokens_batch(
+            strings, "gpt-4", num_threads=2, executor=executor
+        )
+    assert counts == [count_string_tokens("hello world", "gpt-4")] * 100
+
+
+@pytest.mark.parametrize("model", ["gpt-3.5-turbo-0613", "gpt-3.5-turbo-0301"])
+def test_count_message_tokens_batch_matches_scalar(model):
+    conversations = [
+        MESSAGES[: i % len(MESSAGES) + 1]
+        + [{"role": "user", "content": f"question {i}"}]
+        for i in range(100)
+    ]
+    counts = count_message_tokens_batch(conversations, model, num_threads=4)
+    clear_token_cache()
+    assert counts == [count_message_tokens(c, model) for c in conversations]
+
+
+def test_count_message_tokens_batch_fills_cache():
+    count_message_tokens_batch([MESSAGES, MESSAGES])
+    assert get_token_cache_stats().size == len(MESSAGES)
+    count_message_tokens(MESSAGES)
+    assert get_token_cache_stats().hits == len(MESSAGES)
+
+
+def test_token_ledger_matches_count_message_tokens():
+    ledger = TokenLedger(MESSAGES[:1])
+    for message in MESSAGES[1:]:
+        ledger.append(message)
+        assert ledger.total_tokens == _reference_count(list(ledger))
+    assert count_message_tokens(ledger) == _reference_count(MESSAGES)
+
+
+def test_token_ledger_counts_each_message_once():
+    ledger = TokenLedger(MESSAGES)
+    ledger.total_tokens
+    ledger.total_tokens
+    ledger.append({"role": "user", "content": "another question"})
+    ledger.total_tokens
+    assert get_token_cache_stats().misses == len(MESSAGES) + 1
+    assert get_token_cache_stats().hits == 0
+
+
+def test_get_max_completion_tokens_ignores_ledger_of_other_model():
+    ledger = TokenLedger(MESSAGES, model="gpt-3.5-turbo-0301")
+    exact = get_max_completion_tokens(list(ledger), "gpt-4", 0)
+    assert TOKEN_MAX["gpt-4"] - ledger.total_tokens - 1 != exact
+    assert get_max_completion_tokens(ledger, "gpt-4", 0) == exact
+
+
+def test_token_ledger_prefix_sums():
+    ledger = TokenLedger(MESSAGES)
+    assert ledger.prefix_sums[0] == 0
+    assert len(ledger.prefix_sums) == len(MESSAGES) + 1
+    assert ledger.tokens_between(0, len(MESSAGES)) + 3 == ledger.total_tokens
+    assert ledger.tokens_between(1, 2) == _reference_count(MESSAGES[1:2]) - 3
+
+
+@pytest.mark.parametrize(
+    "mutate",
+    [
+        lambda ledger: ledger.truncate(1),
+        lambda ledger: ledger.pop(),
+        lambda ledger: ledger.pop(0),
+        lambda ledger: ledger.insert(1, {"role": "user", "content": "inserted"}),
+        lambda ledger: ledger.remove(MESSAGES[1]),
+        lambda ledger: ledger.__setitem__(-1, {"role": "user", "content": "x"}),
+        lambda ledger: ledger.__delitem__(slice(1, 2)),
+        lambda ledger: ledger.reverse(),
+        lambda ledger: ledger.clear(),
+        lambda ledger: ledger.__imul__(0),
+    ],
+)
+def test_token_ledger_mutations(mutate):
+    ledger = TokenLedger(MESSAGES)
+    ledger.total_tokens
+    mutate(ledger)
+    assert ledger.total_tokens == _reference_count(list(ledger))
+
+
+def test_token_ledger_remaining_tokens():
+    ledger = TokenLedger(MESSAGES, model="gpt-3.5-turbo-0613")
+    assert ledger.remaining_tokens() == 4096 - _reference_count(MESSAGES)
+    assert get_max_completion_tokens(ledger, "gpt-3.5-turbo-0613", 0) == (
+        ledger.remaining_tokens() - 1
+    )
+
+
+@pytest.fixture
+def estimator():
+    return TokenEstimator(safety_margin=16)
+
+
+def test_estimator_upper_bound_covers_exact(estimator):
+    texts = [
+        "The quick brown fox jumps over the lazy dog. " * 20,
+        "def add(a, b):\n    return a + b\n" * 30,
+        '{"key": [1, 2, 3], "other": null}' * 25,
+        " ".join(str(i % 10) for i in range(1000)),
+        base64.b64encode(bytes(range(256)) * 4).decode(),
+        "!?;:.,-_()[]{}<>" * 80,
+        "\U0001F600\U0001F680\u2764\ufe0f" * 60,
+        "la mo ri tu ke an zo pi " * 60,
+    ]
+    for text in texts:
+        messages = [{"role": "user", "content": text}]
+        estimate, upper = estimator.estimate_message_tokens(messages)
+        exact = count_message_tokens(messages)
+        assert estimate <= upper
+        assert exact <= upper
+
+
+def test_estimator_estimate_error_on_prose(estimator):
+    messages = [{"role": "user", "content": "The quick brown fox jumps over. " * 20}]
+    estimate, _ = estimator.estimate_message_tokens(messages)
+    exact = count_message_tokens(messages)
+    assert abs(estimate - exact) / exact < 0.3
+
+
+def test_estimator_far_from_limit_uses_estimate(estimator):
+    tokens = estimator.count_message_tokens(MESSAGES, limit=4096)
+    assert tokens == estimator.estimate_message_tokens(MESSAGES)[0]
+    assert estimator.stats() == EstimatorStats(1, 0)
+
+
+def test_estimator_near_limit_falls_back(estimator):
+    _, upper = estimator.estimate_message_tokens(MESSAGES)
+    tokens = estimator.count_message_tokens(MESSAGES, limit=upper)
+    assert tokens == count_message_tokens(MESSAGES)
+    stats = estimator.stats()
+    assert stats.fallbacks == 1
+    assert stats.fallback_rate == 1.0
+
+
+def test_estimator_max_completion_tokens(estimator):
+    exact = get_max_completion_tokens(MESSAGES, "gpt-4", 0)
+    estimated = estimator.get_max_completion_tokens(MESSAGES, "gpt-4", 0, budget=1000)
+    assert estimated <= exact
+    assert estimator.stats().estimates == 1
+
+    near = estimator.get_max_completion_tokens(MESSAGES, "gpt-4", 0, budget=exact)
+    assert near == exact
+    assert estimator.stats().fallbacks == 1
+
+    assert estimator.get_max_completion_tokens(MESSAGES, "unknown", 42) == 42
+
+
+def test_estimator_max_completion_tokens_mid_size_prompt(estimator):
+    prose = (
+        "Rate limits are enforced per organization and per model, so a burst "
+        "of parallel requests can exhaust the quota long before the budget. "
+        "Retries should back off exponentially and honour the retry-after header. "
+    )
+    messages = [{"role": "user", "content": prose * 16}]
+    window = TOKEN_MAX["gpt-3.5-turbo"]
+    exact = get_max_completion_tokens(messages, "gpt-3.5-turbo", 0)
+    estimated = estimator.get_max_completion_tokens(messages, "gpt-3.5-turbo", 0)
+    assert estimated <= exact
+    assert exact - estimated <= 0.1 * window
+
+
+def test_get_max_completion_tokens_estimate_mode():
+    exact = get_max_completion_tokens(MESSAGES, "gpt-4", 0)
+    assert get_max_completion_tokens(MESSAGES, "gpt-4", 0, estimate=True) <= exact
+
+
+def test_estimator_calibrate(estimator):
+    profile = estimator.calibrate("cl100k_base", ["hello world " * 50] * 10)
+    assert profile.bytes_per_token > 2
+    assert estimator.profiles["cl100k_base"] == profile
+    with pytest.raises(ValueError):
+        estimator.calibrate("cl100k_base", [""])